@@ -0,0 +1,313 @@
+"""End-to-end benchmark of the data service and the backend, run in-process.
+
+Both FastAPI apps are served through ``httpx.ASGITransport``: the backend's
+client to the data service is routed to the data app, so a /query crosses
+the same HTTP hop as in production without any network. The corpus is
+synthetic, embedded with a hashing function, and the LLM is the local fake
+backend, so the numbers measure our own overhead plus the configured model
+pace. Results are printed and written as JSON to track regressions.
+
+Usage: python -m benchmarks.run_benchmarks --concurrency 1 8 32 --requests 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import AsyncExitStack
+from pathlib import Path
+from types import ModuleType
+from typing import Awaitable, Callable
+
+import chromadb
+import httpx
+import numpy as np
+from chromadb.api.client import SharedSystemClient
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from data.lexical_index import build_lexical_index  # noqa: E402
+from src.llm_backends import LocalFakeChatModel  # noqa: E402
+from src.llm_registry import ModelRegistry  # noqa: E402
+
+ENDPOINTS = ("similarity_search", "insert_query", "write_feedback", "query")
+DB_NAME = "chroma_db_default_emb"
+TOPICS = ["sql", "python", "neural", "networks", "cloud", "statistics", "design",
+          "finance", "security", "marketing", "databases", "pasta", "leadership",
+          "excel", "kubernetes", "negotiation", "photography", "accounting"]
+
+
+class HashingEmbeddingFunction:
+    """Embed texts as hashed bag-of-words vectors, standing in for the model."""
+
+    def __init__(self, dim: int = 384) -> None:
+        """Initialize the embedding dimension."""
+        self.dim = dim
+
+    def __call__(self, input: list[str]) -> list[list[float]]:  # noqa: A002
+        """Embed each text as the normalized hashed counts of its words."""
+        vectors = np.zeros((len(input), self.dim), dtype=np.float32)
+        for row, text in enumerate(input):
+            for word in text.lower().split():
+                vectors[row, zlib.crc32(word.encode()) % self.dim] += 1.0
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+        return vectors.tolist()
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    """Return a text made of random topic words."""
+    return " ".join(rng.choice(TOPICS) for _ in range(words))
+
+
+def build_corpus(n_docs: int, embedding_function: HashingEmbeddingFunction,
+                 rng: random.Random, chunks_per_doc: int = 10) -> None:
+    """Write a synthetic collection and its lexical index under ./data."""
+    client = chromadb.PersistentClient("data/" + DB_NAME)
+    collection = client.create_collection(DB_NAME, metadata={"version": 1})
+    for start in range(0, n_docs, 500):
+        ids = range(start, min(start + 500, n_docs))
+        documents = [f"Title: Course {i}\n" + random_text(rng, 80) for i in ids]
+        collection.add(
+            ids=[f"course_{i // chunks_per_doc}.txt_chunk_{i % chunks_per_doc}"
+                 for i in ids],
+            documents=documents,
+            embeddings=embedding_function(documents),
+            metadatas=[{"source": f"course_{i // chunks_per_doc}.txt",
+                        "title": f"Course {i}", "chunk_index": i % chunks_per_doc}
+                       for i in ids],
+        )
+    build_lexical_index(collection, f"data/{DB_NAME}/{DB_NAME}_bm25", version=1)
+
+
+def load_module(name: str) -> ModuleType:
+    """Import a module, or reload it so that it reads the current directory."""
+    if name in sys.modules:
+        return importlib.reload(sys.modules[name])
+    return importlib.import_module(name)
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    """Return the latency percentiles (ms) and throughput of a run."""
+    values = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) if len(values) else (0, 0, 0)
+    return {"requests": len(latencies), "errors": errors,
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "mean_ms": round(float(values.mean()), 3) if len(values) else 0.0,
+            "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3)}
+
+
+async def drive(call: Callable[[int], Awaitable[httpx.Response]], requests: int,
+                concurrency: int) -> dict:
+    """Issue requests from ``concurrency`` concurrent workers and time them."""
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for index in counter:
+            start = time.perf_counter()
+            try:
+                response = await call(index)
+                failed = response.status_code >= 400  # noqa: PLR2004
+            except httpx.HTTPError:
+                failed = True
+            if failed:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_level(data_app: ModuleType, backend: ModuleType, args: argparse.Namespace,
+                    concurrency: int, rng: random.Random) -> dict:
+    """Benchmark every selected endpoint at one concurrency level."""
+    data_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=data_app.app),
+                                    base_url="http://data")
+    backend_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=backend.app),
+                                       base_url="http://backend")
+    # Distinct queries, so that the caches only help as much as in production
+    queries = [random_text(rng, 4) for _ in range(args.requests)]
+    interaction_ids: list[str] = []
+    results = {}
+
+    async def similarity_search(i: int) -> httpx.Response:
+        return await data_client.post("/similarity_search", json={
+            "query": queries[i], "n_docs": args.n_docs, "retrieval": args.retrieval})
+
+    async def insert_query(i: int) -> httpx.Response:
+        response = await data_client.post("/insert_query", json={
+            "query": queries[i], "answer": "answer " * 50,
+            "documents": ["document " * 100] * args.n_docs})
+        interaction_ids.append(response.json()["interaction_id"])
+        return response
+
+    async def write_feedback(i: int) -> httpx.Response:
+        return await data_client.post("/write_feedback", json={
+            "interaction_id": interaction_ids[i % len(interaction_ids)],
+            "feedback": "Thumbs up"})
+
+    async def query(i: int) -> httpx.Response:
+        return await backend_client.post("/query", json={"query": queries[i]},
+                                         params={"n_docs": args.n_docs})
+
+    calls = {"similarity_search": similarity_search, "insert_query": insert_query,
+             "write_feedback": write_feedback, "query": query}
+    async with data_client, backend_client:
+        for endpoint in args.endpoints:
+            if endpoint == "write_feedback" and not interaction_ids:
+                await drive(insert_query, min(args.requests, 100), concurrency)
+            results[endpoint] = await drive(calls[endpoint], args.requests, concurrency)
+            if endpoint in ("insert_query", "write_feedback"):
+                # Writes are queued: also time their commit to sqlite
+                start = time.perf_counter()
+                await asyncio.to_thread(data_app.query_log.flush)
+                results[endpoint]["flush_ms"] = round(
+                    (time.perf_counter() - start) * 1000, 3)
+    return results
+
+
+async def run(args: argparse.Namespace) -> dict:
+    """Set up both apps on a synthetic corpus and run every concurrency level."""
+    rng = random.Random(args.seed)
+    embedding_function = HashingEmbeddingFunction()
+    build_corpus(args.docs, embedding_function, rng)
+    data_app = load_module("data.db_app")
+    data_app.retriever.embedding_function = embedding_function
+    backend = importlib.import_module("src.app")
+
+    async with AsyncExitStack() as stack:
+        stack.callback(setattr, backend, "ANSWER_CACHE_ENABLED",
+                       backend.ANSWER_CACHE_ENABLED)
+        stack.callback(setattr, backend, "LLM_MODELS", backend.LLM_MODELS)
+        backend.ANSWER_CACHE_ENABLED = args.answer_cache
+        backend.LLM_MODELS = []  # The real models are replaced by the fake
+        await stack.enter_async_context(data_app.app.router.lifespan_context(
+            data_app.app))
+        await stack.enter_async_context(backend.app.router.lifespan_context(
+            backend.app))
+        # The backend reaches the data service in-process, the LLM is the fake
+        await backend.app.state.http_client.aclose()
+        backend.app.state.http_client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=data_app.app),
+            base_url=backend.DB_URL)
+        stack.push_async_callback(backend.app.state.http_client.aclose)
+        backend.app.state.models = ModelRegistry(lambda _model_name: (
+            backend.prompt | LocalFakeChatModel(
+                answer_tokens=args.llm_tokens,
+                first_token_latency=args.llm_first_token_ms / 1000,
+                token_latency=args.llm_token_ms / 1000)
+        ), max_concurrency=args.llm_concurrency, max_queue=backend.LLM_MAX_QUEUE,
+            queue_timeout=backend.LLM_QUEUE_TIMEOUT, metrics=backend.metrics)
+
+        levels = {}
+        for concurrency in args.concurrency:
+            levels[str(concurrency)] = await run_level(data_app, backend, args,
+                                                       concurrency, rng)
+    return levels
+
+
+def git_commit() -> str | None:
+    """Return the current commit of the repository, if known."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args: argparse.Namespace) -> dict:
+    """Run the benchmark in a temporary directory and write its JSON report.
+
+    Args:
+    ----
+        args (argparse.Namespace): The parsed command line arguments.
+
+    Returns:
+    -------
+        dict: The report: configuration, environment and, per concurrency
+        level and endpoint, latency percentiles and throughput.
+
+    """
+    output = Path(args.output).resolve()
+    cwd = Path.cwd()
+    with tempfile.TemporaryDirectory() as workspace:
+        os.chdir(workspace)
+        Path("data").mkdir()
+        SharedSystemClient.clear_system_cache()
+        try:
+            levels = asyncio.run(run(args))
+        finally:
+            SharedSystemClient.clear_system_cache()
+            os.chdir(cwd)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items()
+                   if key != "output"},
+        "results": levels,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    return report
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse the command line arguments of the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS,
+                        default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32],
+                        help="Concurrent clients, one run per level.")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="Requests per endpoint and level.")
+    parser.add_argument("--docs", type=int, default=5000,
+                        help="Chunks in the synthetic collection.")
+    parser.add_argument("--n-docs", type=int, default=3,
+                        help="Chunks retrieved per query.")
+    parser.add_argument("--retrieval", choices=["vector", "lexical", "hybrid"],
+                        default="vector")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="Keep the answer cache of /query enabled.")
+    parser.add_argument("--llm-tokens", type=int, default=32)
+    parser.add_argument("--llm-first-token-ms", type=float, default=0.0)
+    parser.add_argument("--llm-token-ms", type=float, default=0.0)
+    parser.add_argument("--llm-concurrency", type=int, default=64,
+                        help="Generations in flight allowed for the fake model.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmarks/results/latest.json")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    report = run_benchmarks(args)
+    for concurrency, endpoints in report["results"].items():
+        print(f"Concurrency {concurrency}")
+        for endpoint, stats in endpoints.items():
+            print(f"  {endpoint:<18} {stats['throughput_rps']:>9.1f} req/s  "
+                  f"p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  "
+                  f"p99 {stats['p99_ms']:>8.2f} ms  errors {stats['errors']}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
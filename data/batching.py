@@ -0,0 +1,123 @@
+"""Module providing the micro-batcher that merges concurrent requests."""
+
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+ItemT = TypeVar("ItemT")
+ResultT = TypeVar("ResultT")
+
+
+class MicroBatcher(Generic[ItemT, ResultT]):
+    """Merge items submitted concurrently into batches processed in one call.
+
+    A background thread takes the first pending item, waits at most
+    ``max_wait`` seconds for more (up to ``max_batch_size``), then calls
+    ``process`` on the whole batch and fans the results back out to the
+    futures of the submitters. If the batch fails, its items are processed
+    one at a time, so that an invalid item only fails its own future.
+    """
+
+    _STOP: Any = object()
+
+    def __init__(self, process: Callable[[list[ItemT]], list[ResultT]],
+                 max_batch_size: int = 32, max_wait: float = 0.002) -> None:
+        """Initialize the batcher.
+
+        Args:
+        ----
+            process (Callable[[list[ItemT]], list[ResultT]]): Processes a batch
+            and returns one result per item, in order.
+            max_batch_size (int): Maximum number of items per batch.
+            max_wait (float): Maximum time in seconds the first item of a batch
+            waits for others.
+
+        """
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_sizes = {"batches": 0, "items": 0}
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Start the background thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="micro-batcher",
+                                        daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Process the pending items and stop the background thread."""
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, item: ItemT) -> Future:
+        """Queue an item and return the future of its result."""
+        if self._thread is None:
+            msg = "The micro-batcher is not running."
+            raise RuntimeError(msg)
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: ItemT) -> ResultT:
+        """Process an item as part of a batch and wait for its result."""
+        return self.submit(item).result()
+
+    def _next_batch(self) -> tuple[list[tuple[ItemT, Future]], bool]:
+        """Collect the next batch and whether the batcher must stop."""
+        entry = self._queue.get()
+        if entry is self._STOP:
+            return [], True
+        batch = [entry]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 \
+                    else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is self._STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _run(self) -> None:
+        """Process batches until the stop sentinel is received."""
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if not batch:
+                continue
+            self.batch_sizes["batches"] += 1
+            self.batch_sizes["items"] += len(batch)
+            try:
+                results = self.process([item for item, _ in batch])
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to process a batch of %d items", len(batch))
+                # Items are retried one by one: only the bad ones get the error
+                self._process_each(batch)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _process_each(self, batch: list[tuple[ItemT, Future]]) -> None:
+        """Process the items of a failed batch separately."""
+        for item, future in batch:
+            try:
+                future.set_result(self.process([item])[0])
+            except Exception as error:  # noqa: BLE001
+                future.set_exception(error)
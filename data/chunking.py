@@ -0,0 +1,185 @@
+"""Module providing the boundary-aware chunker used for ingestion."""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from typing import Callable, Iterator, Sequence, Tuple
+
+import numpy as np
+
+# Boundary levels: a chunk preferably ends at the strongest boundary of its window
+WORD, LINE, SENTENCE, PARAGRAPH = 0, 1, 2, 3
+
+_SENTENCE_END = np.array([ord(c) for c in ".!?"], dtype=np.uint32)
+_NEWLINE = ord("\n")
+
+# Maps a text to the (start, end) character offsets of its tokens
+TokenOffsets = Callable[[str], Sequence[Tuple[int, int]]]
+
+
+def find_boundaries(text: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find every whitespace run of a text and how strong a boundary it is.
+
+    The text is scanned once with vectorized operations on its code points.
+
+    Args:
+    ----
+        text (str): The text to scan.
+
+    Returns:
+    -------
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The start and end offsets
+        of each whitespace run and its level: PARAGRAPH for two newlines or
+        more, SENTENCE after ".", "!" or "?", LINE for a single newline and
+        WORD otherwise.
+
+    """
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    # ASCII whitespace: space, then tab, newline, vertical tab, form feed, return
+    space = (codes == ord(" ")) | ((codes >= ord("\t")) & (codes <= ord("\r")))
+    edges = np.diff(space.view(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    # Newlines only occur inside whitespace runs, so those counted from one run
+    # start to the next all belong to the run
+    newline_count = (np.add.reduceat(codes == _NEWLINE, starts, dtype=np.int32)
+                     if len(starts) else np.zeros(0, dtype=np.int32))
+    after_sentence = np.zeros(len(starts), dtype=bool)
+    inner = starts > 0
+    after_sentence[inner] = np.isin(codes[starts[inner] - 1], _SENTENCE_END)
+
+    levels = np.full(len(starts), WORD, dtype=np.int8)
+    levels[newline_count == 1] = LINE
+    levels[after_sentence] = SENTENCE
+    levels[newline_count >= 2] = PARAGRAPH  # noqa: PLR2004
+    return starts, ends, levels
+
+
+def iter_chunk_spans(text: str, chunk_size: int = 500, overlap: int = 50,
+                     min_chunk_size: int | None = None,
+                     token_offsets: TokenOffsets | None = None,
+                     ) -> Iterator[Tuple[int, int]]:
+    """Lazily split a text into overlapping chunks, as (start, end) offsets.
+
+    Each chunk ends at the strongest boundary (paragraph, sentence, line, then
+    word) found between ``min_chunk_size`` and ``chunk_size`` from its start,
+    the latest one on ties, and is only cut blindly when its window has no
+    whitespace at all. The next chunk starts at the first word beginning at
+    most ``overlap`` before the previous end, or exactly ``overlap`` before
+    a blind cut when no word begins there. No substring is built: callers
+    slice the text only if they need the chunk content.
+
+    Args:
+    ----
+        text (str): The content of the document.
+        chunk_size (int): The maximum chunk size. Defaults to 500.
+        overlap (int): The size of the overlap between chunks. Defaults to 50.
+        min_chunk_size (int | None): The minimum chunk size before a boundary is
+        considered. Defaults to half the chunk size.
+        token_offsets (TokenOffsets | None): If given, sizes are counted in
+        tokens of this tokenizer instead of characters.
+
+    Yields:
+    ------
+        Tuple[int, int]: The start and end offsets of a chunk in the text.
+
+    Raises:
+    ------
+        ValueError: If the chunk size is not positive or the overlap is not
+        smaller than it.
+
+    """
+    if chunk_size < 1:
+        msg = f"chunk_size must be at least 1, got {chunk_size}."
+        raise ValueError(msg)
+    if overlap >= chunk_size:
+        msg = f"overlap ({overlap}) must be smaller than chunk_size ({chunk_size})."
+        raise ValueError(msg)
+    # At least one character or token: an empty window would look backwards
+    min_chunk_size = max(1, chunk_size // 2 if min_chunk_size is None
+                         else min_chunk_size)
+    # Plain lists: bisect on them is much cheaper than per-chunk numpy calls
+    run_starts, run_ends, levels = (array.tolist() for array in find_boundaries(text))
+    length = len(text)
+
+    if token_offsets is None:
+        def advance(start: int, size: int) -> int:
+            return start + size
+
+        def rewind(end: int, size: int) -> int:
+            return end - size
+    else:
+        offsets = token_offsets(text)
+        token_starts = [token_start for token_start, _ in offsets]
+        token_ends = [token_end for _, token_end in offsets]
+
+        def advance(start: int, size: int) -> int:
+            # End offset of the size-th token starting at or after start
+            index = bisect_left(token_starts, start) + size - 1
+            return token_ends[index] if index < len(token_ends) else length
+
+        def rewind(end: int, size: int) -> int:
+            # Start offset of the size-th token ending at or before end
+            index = bisect_right(token_ends, end) - size
+            return token_starts[max(index, 0)] if token_starts else end
+
+    # Skip leading whitespace
+    start = run_ends[0] if run_starts and run_starts[0] == 0 else 0
+    while start < length:
+        limit = advance(start, chunk_size)
+        if limit >= length:
+            yield start, length
+            return
+
+        # Whitespace runs starting inside [start + min_chunk_size, limit]
+        low = bisect_left(run_starts, advance(start, min_chunk_size))
+        high = bisect_right(run_starts, limit)
+        hard_cut = high <= low
+        if not hard_cut:
+            strongest = max(levels[low:high])
+            best = next(i for i in range(high - 1, low - 1, -1)
+                        if levels[i] == strongest)
+            end, next_start = run_starts[best], run_ends[best]
+        else:
+            end = next_start = limit
+
+        yield start, end
+        if next_start >= length:
+            return
+
+        # Start the next chunk at a word beginning within the overlap
+        if overlap > 0:
+            overlap_start = rewind(end, overlap)
+            word = bisect_left(run_ends, overlap_start)
+            if word < len(run_ends) and start < run_ends[word] < next_start:
+                next_start = run_ends[word]
+            elif hard_cut:
+                # No word begins there: overlap blindly, as the cut was made
+                next_start = max(overlap_start, start + 1)
+        start = next_start
+
+
+class ByteOffsets:
+    """Convert non-decreasing character offsets of a text to UTF-8 byte offsets.
+
+    Only the text between two consecutive offsets is encoded, so converting
+    every chunk boundary of a document costs a single pass over it.
+    """
+
+    def __init__(self, text: str) -> None:
+        """Initialize the converter for the given text."""
+        self.text = text
+        self.is_ascii = text.isascii()
+        self._char = 0
+        self._byte = 0
+
+    def __call__(self, offset: int) -> int:
+        """Return the byte offset of the given character offset."""
+        if self.is_ascii:
+            return offset
+        if offset < self._char:
+            self._char = self._byte = 0
+        self._byte += len(self.text[self._char:offset].encode("utf-8"))
+        self._char = offset
+        return self._byte
@@ -0,0 +1,247 @@
+"""Module providing reduced-dimension vector storage with full-precision re-ranking.
+
+The HNSW index keeps every vector in memory as float32. This module builds a
+copy of a collection whose vectors are projected by PCA onto fewer
+dimensions (e.g. 384 -> 96, a quarter of the memory), while the original
+vectors are kept in a memory-mapped file on disk. Searches over-fetch
+candidates from the small index and re-rank them with the exact distance to
+the full vectors, which only reads the candidate rows from disk.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+from typing import Iterator, Sequence
+
+import chromadb
+import numpy as np
+
+from data.lexical_index import build_lexical_index
+
+
+class CompressedVectors:
+    """PCA projection of a collection and its full-precision vectors."""
+
+    def __init__(self, path: str) -> None:
+        """Load the projection and memory-map the vectors of a compressed copy."""
+        directory = Path(path)
+        projection = np.load(directory / "projection.npz")
+        self.mean = projection["mean"]
+        self.components = projection["components"]
+        self.vectors = np.load(directory / "vectors.npy", mmap_mode="r")
+        with (directory / "ids.json").open(encoding="utf-8") as file:
+            self.rows = {chunk_id: row for row, chunk_id in enumerate(json.load(file))}
+
+    @property
+    def dim(self) -> int:
+        """The number of dimensions of the projected vectors."""
+        return self.components.shape[0]
+
+    def project(self, embeddings: Sequence[Sequence[float]] | np.ndarray,
+                ) -> np.ndarray:
+        """Project full embeddings onto the principal components."""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        return (vectors - self.mean) @ self.components.T
+
+    def rerank(self, embedding: Sequence[float], ids: Sequence[str],
+               ) -> list[tuple[str, float]]:
+        """Order ids by exact squared L2 distance to the full query embedding.
+
+        Ids missing from the vector file (added after it was written) keep
+        their order, after the others, with the largest known distance.
+        """
+        known = [chunk_id for chunk_id in ids if chunk_id in self.rows]
+        unknown = [chunk_id for chunk_id in ids if chunk_id not in self.rows]
+        if not known:
+            return [(chunk_id, 0.0) for chunk_id in unknown]
+        rows = np.fromiter((self.rows[chunk_id] for chunk_id in known), dtype=np.int64)
+        # Sorted rows read the memory-mapped file sequentially
+        order = np.argsort(rows)
+        candidates = np.empty((len(rows), self.vectors.shape[1]), dtype=np.float32)
+        candidates[order] = self.vectors[rows[order]]
+        query = np.asarray(embedding, dtype=np.float32)
+        distances = ((candidates - query) ** 2).sum(axis=1)
+        reranked = [(known[i], float(distances[i]))
+                    for i in np.argsort(distances, kind="stable")]
+        return reranked + [(chunk_id, reranked[-1][1]) for chunk_id in unknown]
+
+
+def fit_pca(sample: np.ndarray, dim: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return the mean and the ``dim`` principal components of a sample."""
+    mean = sample.mean(axis=0)
+    _, _, components = np.linalg.svd(sample - mean, full_matrices=False)
+    return mean.astype(np.float32), components[:dim].astype(np.float32)
+
+
+def iter_pages(collection: chromadb.Collection, include: list[str],
+               page_size: int = 1000) -> Iterator[dict]:
+    """Yield the content of a collection page by page."""
+    offset = 0
+    while True:
+        page = collection.get(include=include, limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+
+def compress_collection(source: chromadb.Collection, target: chromadb.Collection,
+                        path: str, dim: int, sample_size: int = 20_000,
+                        page_size: int = 1000, seed: int = 0) -> int:
+    """Copy a collection with projected vectors and write its full vectors.
+
+    Args:
+    ----
+        source (chromadb.Collection): The collection with full vectors.
+        target (chromadb.Collection): The empty collection to fill.
+        path (str): The directory of the projection and the full vectors.
+        dim (int): The number of dimensions to keep.
+        sample_size (int): The number of vectors the PCA is fitted on.
+        page_size (int): The number of chunks read and written at once.
+        seed (int): Seed of the PCA sample.
+
+    Returns:
+    -------
+        int: The number of copied chunks.
+
+    """
+    directory = Path(path)
+    directory.mkdir(parents=True, exist_ok=True)
+    count = source.count()
+    rng = random.Random(seed)
+    sampled = set(rng.sample(range(count), min(sample_size, count)))
+
+    # First pass: the full vectors go to disk, in collection order
+    ids: list[str] = []
+    vectors = None
+    for page in iter_pages(source, ["embeddings"], page_size):
+        embeddings = np.asarray(page["embeddings"], dtype=np.float32)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(directory / "vectors.npy", mode="w+",
+                                                dtype=np.float32,
+                                                shape=(count, embeddings.shape[1]))
+        vectors[len(ids):len(ids) + len(embeddings)] = embeddings
+        ids.extend(page["ids"])
+    if vectors is None:
+        return 0
+    vectors.flush()
+    with (directory / "ids.json").open("w", encoding="utf-8") as file:
+        json.dump(ids, file)
+    mean, components = fit_pca(np.asarray(vectors[sorted(sampled)]), dim)
+    np.savez(directory / "projection.npz", mean=mean, components=components)
+
+    # Second pass: the projected vectors go to the target collection
+    compressed = CompressedVectors(path)
+    for page in iter_pages(source, ["documents", "metadatas"], page_size):
+        rows = [compressed.rows[chunk_id] for chunk_id in page["ids"]]
+        target.upsert(ids=page["ids"], documents=page["documents"],
+                      metadatas=page["metadatas"],
+                      embeddings=compressed.project(compressed.vectors[rows]).tolist())
+    return len(ids)
+
+
+def evaluate_recall(source: chromadb.Collection, target: chromadb.Collection,
+                    compressed: CompressedVectors, n_queries: int = 200, k: int = 5,
+                    rerank_factor: int = 4, seed: int = 0) -> dict:
+    """Measure the recall@k of the compressed search against the full one.
+
+    The queries are stored vectors with a little noise; the reference is the
+    top k of the full collection.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(compressed.rows), size=min(n_queries, len(compressed.rows)),
+                      replace=False)
+    queries = np.asarray(compressed.vectors[np.sort(rows)])
+    queries += rng.normal(scale=0.05 * queries.std(), size=queries.shape)
+    queries = queries.astype(np.float32)
+
+    truth = source.query(query_embeddings=queries.tolist(), n_results=k,
+                         include=[])["ids"]
+    start = time.perf_counter()
+    reduced = target.query(query_embeddings=compressed.project(queries).tolist(),
+                           n_results=k * rerank_factor, include=[])["ids"]
+    search_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    start = time.perf_counter()
+    reranked = [[chunk_id for chunk_id, _ in compressed.rerank(query, ids)[:k]]
+                for query, ids in zip(queries, reduced)]
+    rerank_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    def recall(results: list[list[str]]) -> float:
+        return float(np.mean([len(set(found[:k]) & set(expected)) / len(expected)
+                              for found, expected in zip(results, truth)]))
+
+    full_dim, dim = compressed.vectors.shape[1], compressed.dim
+    return {
+        "queries": len(queries), "k": k, "rerank_factor": rerank_factor,
+        "recall_reduced": round(recall(reduced), 4),
+        "recall_reranked": round(recall(reranked), 4),
+        "search_ms_per_query": round(search_ms, 3),
+        "rerank_ms_per_query": round(rerank_ms, 3),
+        "full_dim": full_dim, "reduced_dim": dim,
+        # In-memory vector data of the HNSW index, links excluded
+        "index_vector_bytes_full": len(compressed.rows) * full_dim * 4,
+        "index_vector_bytes_reduced": len(compressed.rows) * dim * 4,
+        "memory_ratio": round(full_dim / dim, 2),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line arguments of the compression CLI."""
+    parser = argparse.ArgumentParser(
+        description="Build a reduced-dimension copy of a collection, with the "
+                    "full vectors kept on disk for re-ranking, and measure its "
+                    "recall against the original.",
+    )
+    # The data service opens data/chroma_db_default_emb and looks for the
+    # full vectors of a collection in data/chroma_db_default_emb/<name>
+    parser.add_argument("--db-path", default="data/chroma_db_default_emb")
+    parser.add_argument("--collection", default="chroma_db_default_emb")
+    parser.add_argument("--dim", type=int, default=96,
+                        help="Dimensions kept by the PCA projection.")
+    parser.add_argument("--sample-size", type=int, default=20_000,
+                        help="Number of vectors the PCA is fitted on.")
+    parser.add_argument("--queries", type=int, default=200,
+                        help="Number of queries of the recall measurement.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rerank-factor", type=int, default=4,
+                        help="Candidates re-ranked per result.")
+    parser.add_argument("--output", default=None,
+                        help="Path of the JSON report (default: printed only).")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    client = chromadb.PersistentClient(path=args.db_path)
+    source = client.get_collection(args.collection)
+    name = f"{args.collection}_pca{args.dim}"
+    path = str(Path(args.db_path) / name)
+
+    # Rebuilt from scratch: the projection depends on the whole collection
+    if name in [collection.name for collection in client.list_collections()]:
+        client.delete_collection(name)
+    target = client.create_collection(name, metadata=source.metadata)
+    start = time.monotonic()
+    copied = compress_collection(source, target, path, dim=args.dim,
+                                 sample_size=args.sample_size)
+    # Lexical and hybrid searches of the copy need their own BM25 index
+    build_lexical_index(target, str(Path(args.db_path) / f"{name}_bm25"),
+                        version=int((source.metadata or {}).get("version", 0)))
+    print(f"Compressed {copied} chunks into {name} in "
+          f"{time.monotonic() - start:.1f}s")
+
+    report = evaluate_recall(source, target, CompressedVectors(path),
+                             n_queries=args.queries, k=args.k,
+                             rerank_factor=args.rerank_factor)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"Serve it with COLLECTIONS={name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,92 +1,367 @@
 from __future__ import annotations
 
-import sqlite3
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Annotated, AsyncIterator, Literal, Union
 
 import chromadb
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+from fastapi import FastAPI, HTTPException, Response
+from pydantic import BaseModel, Field
+
+from data.batching import MicroBatcher
+from data.metrics import ServiceMetrics
+from data.retriever import Retriever, SearchQuery, merge_results
+from data.sql_database import QueryLogWriter
+
+logger = logging.getLogger(__name__)
+_startup = time.perf_counter()
+
+# Stage and request latency histograms, served on /metrics
+metrics = ServiceMetrics("data")
 
 # Initialize ChromaDB client
 db_name = "chroma_db_default_emb"
 chroma_client = chromadb.PersistentClient("data/" + db_name)
-db = chroma_client.get_collection(name=db_name)
+embedding_function = DefaultEmbeddingFunction()
+# Collections that can be searched, the first one by default. A
+# reduced-dimension copy of a collection (see compressed_vectors.py) is
+# served with the full vectors written next to it
+collection_names = [name.strip() for name in
+                    os.getenv("COLLECTIONS", os.getenv("COLLECTION_NAME", db_name))
+                    .split(",") if name.strip()]
+
+
+def load_retriever(name: str) -> Retriever:
+    """Open a collection along with its BM25 index and full vectors, if any."""
+    compressed_path = Path("data", db_name, name)
+    return Retriever(
+        chroma_client, name, embedding_function,
+        embedding_cache_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "4096")),
+        result_cache_size=int(os.getenv("RESULT_CACHE_SIZE", "4096")),
+        # BM25 index written by vector_db.py next to the collection
+        lexical_index_path=f"data/{db_name}/{name}_bm25",
+        metrics=metrics,
+        compressed_vectors_path=str(compressed_path)
+        if (compressed_path / "projection.npz").exists() else None,
+        rerank_factor=int(os.getenv("RERANK_FACTOR", "4")),
+    )
+
+
+# Loaded once and shared by every request: searches only share locked caches
+retrievers = {name: load_retriever(name) for name in collection_names}
+retriever = retrievers[collection_names[0]]
+db = retriever.collection
+logger.info("Opened collections %s in %.0f ms", collection_names,
+            (time.perf_counter() - _startup) * 1000)
+
+# Query records and feedback are written behind the requests, in batches
+query_log = QueryLogWriter(metrics=metrics)
+
+
+# Set by the warm-up: /ready only succeeds once the first search is fast
+readiness = {"ready": False, "error": None, "warmup_ms": {}}
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+
+
+def warm_up() -> None:
+    """Load the embedding model and the indexes, then mark the service ready."""
+    start = time.perf_counter()
+    timings: dict[str, float] = {}
+    try:
+        for name, collection_retriever in retrievers.items():
+            for step, seconds in collection_retriever.warm_up().items():
+                timings[step if len(retrievers) == 1 else f"{name}.{step}"] = seconds
+    except Exception as error:  # noqa: BLE001
+        logger.exception("Warm-up failed")
+        readiness["error"] = repr(error)
+        return
+    readiness["warmup_ms"] = {step: round(seconds * 1000, 1)
+                              for step, seconds in timings.items()}
+    readiness["ready"] = True
+    logger.info("Warm-up done in %.0f ms (%s), %.0f ms after startup",
+                (time.perf_counter() - start) * 1000, readiness["warmup_ms"],
+                (time.perf_counter() - _startup) * 1000)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Run the query log writer for the app lifetime, flushing it on shutdown.
+
+    The warm-up runs in the background, so that liveness probes on / answer
+    while it loads and readiness probes on /ready wait for it.
+    """
+    query_log.start()
+    search_batcher.start()
+    if WARMUP_ENABLED:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    else:
+        readiness["ready"] = True
+    yield
+    search_batcher.close()
+    query_log.close()
 
-search_kwargs = {"n_results": 5}
 
 # Define FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+metrics.install(app)
+
+FilterScalar = Union[str, int, float, bool]
+
 
 class QueryRequest(BaseModel):
-    """Represents a request for a query."""
+    """Represents a request for a query.
+
+    ``retrieval`` selects embedding similarity ("vector"), BM25 keyword
+    matching ("lexical") or both fused by reciprocal rank ("hybrid").
+    ``filters`` restrict the chunks to those whose metadata has the given
+    values (e.g. {"source": "Big_data.txt"}), a list accepting any of its
+    items. ``collections`` searches several collections, whose results are
+    merged by score, instead of the default one.
+    """
 
     query: str
-    n_docs: int = 5
+    n_docs: int = Field(5, ge=1)
+    embedding: list[float] | None = None
+    include_text: bool = True
+    retrieval: Literal["vector", "lexical", "hybrid"] = "vector"
+    filters: dict[str, Union[FilterScalar,
+                             Annotated[list[FilterScalar], Field(min_length=1)]]] = {}
+    collections: list[str] | None = None
 
 class QueryResponse(BaseModel):
-    """Represents the response for a query."""
+    """Represents the response for a query.
+
+    Without text, documents and context are empty and the chunks are only
+    described by their ids and metadata (source, title, chunk index, offsets).
+    ``collections`` gives the collection of each chunk, ``scores`` its score
+    (the higher, the better). ``collection_version`` is the sum of the
+    versions of the searched collections.
+    """
 
     documents: list[str]
     context: str
+    collection_version: int = 0
+    ids: list[str] = []
+    metadatas: list[dict] = []
+    scores: list[float] = []
+    collections: list[str] = []
+
+class BatchQueryRequest(BaseModel):
+    """Represents a batch of queries searched together."""
+
+    queries: list[QueryRequest]
+
+class BatchQueryResponse(BaseModel):
+    """Represents the responses to a batch of queries, in order."""
+
+    results: list[QueryResponse]
+
+class DocumentsRequest(BaseModel):
+    """Represents a request for the text of chunks."""
+
+    ids: list[str]
+
+class DocumentsResponse(BaseModel):
+    """Represents the text of chunks, in the requested order."""
+
+    ids: list[str]
+    documents: list[str]
+
+class EmbedRequest(BaseModel):
+    """Represents a request to embed a query."""
+
+    query: str
+
+class EmbedResponse(BaseModel):
+    """Represents the embedding of a query."""
+
+    embedding: list[float]
+    collection_version: int
 
 class InsertQueryRequest(BaseModel):
     """Represents a request to insert a query."""
 
+    interaction_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     query: str
     answer: str
     documents: list[str]
 
 
 class FeedbackRequest(BaseModel):
-    """Represents a request for feedback."""
+    """Represents a request for feedback on an interaction."""
 
-    query: str
+    interaction_id: str
     feedback: str
 
+def validate_requests(requests: list[QueryRequest]) -> None:
+    """Reject requests the search would fail on, before they join a batch.
+
+    Unknown collections get a 404 and embeddings of the wrong dimension a
+    422, instead of failing the searches batched with them.
+    """
+    unknown = sorted({name for request in requests
+                      for name in request.collections or []} - retrievers.keys())
+    if unknown:
+        raise HTTPException(status_code=404,
+                            detail=f"Unknown collections: {unknown}")
+    for request in requests:
+        if request.embedding is None:
+            continue
+        for name in request.collections or collection_names[:1]:
+            dimension = retrievers[name].embedding_dimension()
+            if dimension is not None and len(request.embedding) != dimension:
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"The embedding has {len(request.embedding)} "
+                           f"dimensions, {name} expects {dimension}.")
+
+
+def search_many(requests: list[QueryRequest]) -> list[QueryResponse]:
+    """Search several queries with one embedding call and few index queries.
+
+    Each collection is searched once for all the queries that target it. With
+    ``include_text`` False, only chunk ids and metadata are returned; the
+    text can be fetched later from /documents.
+    """
+    targets = [request.collections or collection_names[:1] for request in requests]
+    searches = [
+        SearchQuery(query=request.query, n_docs=request.n_docs,
+                    embedding=tuple(request.embedding)
+                    if request.embedding is not None else None,
+                    include_text=request.include_text,
+                    retrieval=request.retrieval,
+                    filters=tuple(sorted(
+                        (key, tuple(value) if isinstance(value, list) else value)
+                        for key, value in request.filters.items())))
+        for request in requests
+    ]
+    # Results of each request, by collection
+    found: list[dict] = [{} for _ in requests]
+    for name, collection_retriever in retrievers.items():
+        positions = [i for i, names in enumerate(targets) if name in names]
+        if not positions:
+            continue
+        results = collection_retriever.search([searches[i] for i in positions])
+        for i, result in zip(positions, results):
+            found[i][name] = result
+
+    responses = []
+    for i, request in enumerate(requests):
+        names = list(dict.fromkeys(targets[i]))
+        if len(names) == 1:
+            result, sources = found[i][names[0]], names * len(found[i][names[0]].ids)
+        else:
+            result, sources = merge_results(found[i], request.n_docs)
+        responses.append(QueryResponse(
+            documents=list(result.documents),
+            context="\n\n\n".join(result.documents),
+            # Changes whenever any of the searched collections does
+            collection_version=sum(retrievers[name].collection_version()
+                                   for name in names),
+            ids=list(result.ids),
+            metadatas=[dict(metadata) for metadata in result.metadatas],
+            scores=list(result.scores), collections=sources))
+    return responses
+
+
+# Concurrent single-query searches arriving within a few milliseconds are
+# merged into one embedding and index call
+search_batcher = MicroBatcher(
+    search_many,
+    max_batch_size=int(os.getenv("SEARCH_BATCH_SIZE", "32")),
+    max_wait=float(os.getenv("SEARCH_BATCH_WAIT_MS", "2")) / 1000,
+)
+
+
 @app.post("/similarity_search", response_model=QueryResponse)
 def similarity_search(request: QueryRequest) -> QueryResponse:
-    """Perform a similarity search in the ChromaDB vectorstore."""
-    search_kwargs["n_results"] = request.n_docs
-    query_results = db.query(query_texts=[request.query], **search_kwargs)
+    """Perform a similarity search in the ChromaDB vectorstore.
 
-    if not query_results["documents"]:
+    The search is micro-batched with the other searches in flight.
+    """
+    validate_requests([request])
+    response = search_batcher(request)
+    if not response.ids:
         raise HTTPException(status_code=404, detail="No documents found.")
+    return response
+
 
-    documents = query_results["documents"][0]
-    context = "\n\n\n".join(documents)
-    return QueryResponse(documents=documents, context=context)
+@app.post("/similarity_search/batch", response_model=BatchQueryResponse)
+def similarity_search_batch(request: BatchQueryRequest) -> BatchQueryResponse:
+    """Perform similarity searches for several queries at once.
+
+    Queries without any result get an empty response instead of a 404.
+    """
+    if not request.queries:
+        return BatchQueryResponse(results=[])
+    validate_requests(request.queries)
+    return BatchQueryResponse(results=search_many(request.queries))
+
+
+@app.post("/documents", response_model=DocumentsResponse)
+def get_documents(request: DocumentsRequest) -> DocumentsResponse:
+    """Fetch the text of chunks by id, e.g. after a search without text.
+
+    Ids are looked up in the default collection first, then in the others.
+    """
+    texts: dict[str, str] = {}
+    for collection_retriever in retrievers.values():
+        missing = [chunk_id for chunk_id in request.ids if chunk_id not in texts]
+        if not missing:
+            break
+        results = collection_retriever.collection.get(ids=missing,
+                                                      include=["documents"])
+        texts.update(zip(results["ids"], results["documents"]))
+    missing = [chunk_id for chunk_id in request.ids if chunk_id not in texts]
+    if missing:
+        raise HTTPException(status_code=404,
+                            detail=f"Unknown document ids: {missing}")
+    return DocumentsResponse(ids=request.ids,
+                             documents=[texts[chunk_id] for chunk_id in request.ids])
+
+
+@app.post("/embed", response_model=EmbedResponse)
+def embed(request: EmbedRequest) -> EmbedResponse:
+    """Embed a query with the collection embedding function."""
+    return EmbedResponse(embedding=retriever.embed([request.query])[0],
+                         collection_version=retriever.collection_version())
+
+
+@app.get("/cache_stats")
+def cache_stats() -> dict:
+    """Return the hit and miss counters of the retrieval caches.
+
+    With several collections, the counters are given by collection.
+    """
+    if len(retrievers) == 1:
+        return retriever.cache_stats()
+    return {name: collection_retriever.cache_stats()
+            for name, collection_retriever in retrievers.items()}
 
 
 @app.post("/insert_query")
 def insert_query(request: InsertQueryRequest) -> dict:
-    """Insert a new query result into the queries.db file."""
-    conn = sqlite3.connect("data/queries.db")
-    cursor = conn.cursor()
-
+    """Queue a new query result for insertion into the queries.db file."""
     context = "\n\n\n".join(request.documents)
+    # Only blocks when the writer is saturated, see QueryLogWriter
+    with metrics.stage("db_enqueue"):
+        query_log.insert_query(request.interaction_id, request.query,
+                               request.answer, context)
 
-    cursor.execute("""
-        INSERT INTO queries (query, answer, documents)
-        VALUES (?, ?, ?)
-    """, (request.query, request.answer, context))
-    conn.commit()
-    conn.close()
-
-    return {"message": "Query inserted successfully"}
+    return {"message": "Query inserted successfully",
+            "interaction_id": request.interaction_id}
 
 @app.post("/write_feedback")
 def write_feedback(request: FeedbackRequest) -> dict:
-    """Write feedback into the queries.db file."""
-    # Store the feedback in the database
-    conn = sqlite3.connect("data/queries.db")
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        UPDATE queries
-        SET feedback = ?
-        WHERE query = ?
-    """, (request.feedback, request.query))
-    conn.commit()
-    conn.close()
+    """Queue feedback for writing into the queries.db file."""
+    with metrics.stage("db_enqueue"):
+        query_log.write_feedback(request.interaction_id, request.feedback)
 
     return {"message": "Feedback received"}
 
@@ -95,3 +370,14 @@ def write_feedback(request: FeedbackRequest) -> dict:
 def read_root() -> dict:
     """Check if server is running."""
     return {"message": "Server is running"}
+
+
+@app.get("/ready")
+def ready(response: Response) -> dict:
+    """Check if the server can serve searches without loading anything first.
+
+    Answers 503 until the warm-up is done, or if it failed.
+    """
+    if not readiness["ready"]:
+        response.status_code = 503
+    return readiness
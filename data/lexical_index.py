@@ -0,0 +1,167 @@
+"""Module providing the BM25 lexical index used for hybrid retrieval."""
+
+from __future__ import annotations
+
+import json
+import math
+import re
+import shutil
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Tuple
+
+import chromadb
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split a text into lowercase word tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def write_lexical_index(path: str, chunks: Iterable[Tuple[str, str]],
+                        version: int = 0) -> int:
+    """Build a BM25 inverted index over chunks and write it to a directory.
+
+    The postings of each term are stored contiguously in flat arrays (chunk
+    positions and term frequencies) so the index can be memory-mapped.
+
+    Args:
+    ----
+        path (str): The directory to write the index into. It is replaced.
+        chunks (Iterable[Tuple[str, str]]): The ids and texts of the chunks.
+        version (int): The collection version the index is built from.
+
+    Returns:
+    -------
+        int: The number of indexed chunks.
+
+    """
+    ids: list[str] = []
+    lengths: list[int] = []
+    postings: dict[str, list[Tuple[int, int]]] = {}
+    for chunk_id, text in chunks:
+        position = len(ids)
+        ids.append(chunk_id)
+        tokens = tokenize(text)
+        lengths.append(len(tokens))
+        for term, count in Counter(tokens).items():
+            postings.setdefault(term, []).append((position, count))
+
+    vocabulary = {}
+    docs = np.empty(sum(len(p) for p in postings.values()), dtype=np.int32)
+    freqs = np.empty(len(docs), dtype=np.float32)
+    offset = 0
+    for term, term_postings in postings.items():
+        end = offset + len(term_postings)
+        docs[offset:end], freqs[offset:end] = zip(*term_postings)
+        vocabulary[term] = [offset, end]
+        offset = end
+
+    # Write next to the target and swap, so readers never see a partial index
+    target = Path(path)
+    tmp = target.with_name(target.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "docs.npy", docs)
+    np.save(tmp / "freqs.npy", freqs)
+    np.save(tmp / "lengths.npy", np.asarray(lengths, dtype=np.float32))
+    with (tmp / "meta.json").open("w", encoding="utf-8") as file:
+        json.dump({"version": version, "ids": ids, "vocabulary": vocabulary}, file)
+    shutil.rmtree(target, ignore_errors=True)
+    tmp.rename(target)
+    return len(ids)
+
+
+def build_lexical_index(db: chromadb.Collection, path: str, version: int = 0,
+                        page_size: int = 1000) -> int:
+    """Build the lexical index of every chunk of a collection.
+
+    Args:
+    ----
+        db (chromadb.Collection): The collection to index.
+        path (str): The directory to write the index into.
+        version (int): The collection version the index is built from.
+        page_size (int): The number of chunks read from the collection at once.
+
+    Returns:
+    -------
+        int: The number of indexed chunks.
+
+    """
+    def iter_chunks() -> Iterable[Tuple[str, str]]:
+        offset = 0
+        while True:
+            page = db.get(include=["documents"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                return
+            yield from zip(page["ids"], page["documents"])
+            offset += len(page["ids"])
+
+    return write_lexical_index(path, iter_chunks(), version=version)
+
+
+class LexicalIndex:
+    """Memory-mapped BM25 index over the chunks of a collection."""
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75) -> None:
+        """Load the index written by ``write_lexical_index``.
+
+        Args:
+        ----
+            path (str): The directory of the index.
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 length normalization.
+
+        """
+        directory = Path(path)
+        with (directory / "meta.json").open(encoding="utf-8") as file:
+            meta = json.load(file)
+        self.version = meta["version"]
+        self.ids = meta["ids"]
+        self.vocabulary = meta["vocabulary"]
+        self.docs = np.load(directory / "docs.npy", mmap_mode="r")
+        self.freqs = np.load(directory / "freqs.npy", mmap_mode="r")
+        lengths = np.load(directory / "lengths.npy")
+        self.k1 = k1
+        # Per-chunk part of the BM25 denominator, computed once
+        average = float(lengths.mean()) if len(lengths) else 1.0
+        self._norms = k1 * (1 - b + b * lengths / max(average, 1e-9))
+
+    def __len__(self) -> int:
+        """Return the number of indexed chunks."""
+        return len(self.ids)
+
+    def search(self, query: str, k: int) -> list[Tuple[str, float]]:
+        """Return the ids and BM25 scores of the best k chunks for a query."""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            span = self.vocabulary.get(term)
+            if span is None:
+                continue
+            docs = self.docs[span[0]:span[1]]
+            freqs = self.freqs[span[0]:span[1]]
+            df = len(docs)
+            idf = math.log(1 + (len(self.ids) - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + self._norms[docs])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(scores[matched], -k)[-k:]]
+        best = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in best]
+
+
+def reciprocal_rank_fusion(rankings: Iterable[list[str]], k: int = 60,
+                           ) -> list[tuple[str, float]]:
+    """Merge rankings of ids by summing 1 / (k + rank) over the rankings.
+
+    Returns the (id, fused score) pairs, best first.
+    """
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
@@ -0,0 +1,130 @@
+"""Module providing the latency metrics and request ids of the services."""
+
+from __future__ import annotations
+
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterator
+
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram
+from prometheus_client.exposition import generate_latest
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Id of the request being served, forwarded to the services it calls
+request_id_var: ContextVar[str | None] = ContextVar("request_id", default=None)
+# Stage durations of the request being served, logged when it ends
+_stages_var: ContextVar[dict[str, float] | None] = ContextVar("stages", default=None)
+
+# From 1 ms to 30 s: covers a cached lookup as well as a long generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 30.0)
+
+
+class ServiceMetrics:
+    """Latency histograms of a service, exposed in the Prometheus format.
+
+    Each service owns its registry, so that several apps can live in one
+    process (e.g. in tests and benchmarks). Stage durations are observed
+    into one histogram labelled by stage and, when a request is being
+    served, added to its own timings, logged with its id when it ends.
+    """
+
+    def __init__(self, namespace: str) -> None:
+        """Create the histograms of the service, prefixed by its namespace."""
+        self.registry = CollectorRegistry()
+        self.stage_seconds = Histogram(
+            f"{namespace}_stage_seconds", "Duration of each stage, in seconds.",
+            ["stage"], buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.request_seconds = Histogram(
+            f"{namespace}_request_seconds",
+            "Duration of each request, body and background tasks included, "
+            "in seconds.",
+            ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+            registry=self.registry)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record the duration of a stage."""
+        self.stage_seconds.labels(stage).observe(seconds)
+        stages = _stages_var.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Time the enclosed block as a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def install(self, app: FastAPI) -> None:
+        """Add the request timing middleware and the /metrics route to an app."""
+        app.add_middleware(RequestMetricsMiddleware, metrics=self)
+
+        @app.get("/metrics", include_in_schema=False)
+        def metrics() -> Response:
+            """Expose the histograms in the Prometheus text format."""
+            return Response(generate_latest(self.registry),
+                            media_type=CONTENT_TYPE_LATEST)
+
+
+class RequestMetricsMiddleware:
+    """Time every HTTP request and give it an id.
+
+    The id comes from the ``X-Request-ID`` header of the caller or is
+    generated, and is echoed in the response. Plain ASGI rather than
+    ``BaseHTTPMiddleware``, so streamed bodies are timed until their end.
+    """
+
+    def __init__(self, app: Callable[..., Awaitable[None]],
+                 metrics: ServiceMetrics) -> None:
+        """Wrap an ASGI app."""
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: dict, receive: Callable[..., Any],
+                       send: Callable[..., Any]) -> None:
+        """Serve a request, then record its duration and stage timings."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        request_id = headers.get(REQUEST_ID_HEADER.lower().encode(), b"").decode() \
+            or uuid.uuid4().hex
+        request_token = request_id_var.set(request_id)
+        stages: dict[str, float] = {}
+        stages_token = _stages_var.set(stages)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_id(message: dict) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []),
+                                      (REQUEST_ID_HEADER.lower().encode(),
+                                       request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            duration = time.perf_counter() - start
+            # The route template, not the raw path, keeps the label set bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.metrics.request_seconds.labels(
+                scope["method"], route, str(status)).observe(duration)
+            logger.info("request_id=%s %s %s status=%d duration_ms=%.2f stages_ms=%s",
+                        request_id, scope["method"], route, status, duration * 1000,
+                        {stage: round(seconds * 1000, 2)
+                         for stage, seconds in stages.items()})
+            _stages_var.reset(stages_token)
+            request_id_var.reset(request_token)
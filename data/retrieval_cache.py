@@ -0,0 +1,66 @@
+"""Module providing the in-process caches used by the retrieval endpoints."""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so that trivially different spellings share a cache key."""
+    return " ".join(query.lower().split()).rstrip(" ?!.")
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU cache with hit and miss counters."""
+
+    def __init__(self, max_size: int = 4096) -> None:
+        """Initialize the cache.
+
+        Args:
+        ----
+            max_size (int): Maximum number of entries kept.
+
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of cached entries."""
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any | None:  # noqa: ANN401
+        """Return the value cached under key, or None."""
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:  # noqa: ANN401
+        """Cache a value, evicting the least recently used entry if full."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """Return the size and hit/miss counters of the cache."""
+        with self._lock:
+            return {"size": len(self._data), "max_size": self.max_size,
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,400 @@
+"""Module providing the retriever shared by the data service requests."""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, ContextManager, Mapping, Sequence, Tuple, Union
+
+import chromadb
+from chromadb.api.types import EmbeddingFunction
+
+from data.compressed_vectors import CompressedVectors
+from data.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from data.retrieval_cache import LRUCache, normalize_query
+
+if TYPE_CHECKING:
+    from data.metrics import ServiceMetrics
+
+logger = logging.getLogger(__name__)
+
+# Retrieval modes: embedding similarity, BM25 keywords, or both fused by rank
+VECTOR, LEXICAL, HYBRID = "vector", "lexical", "hybrid"
+
+# Lexical candidates fetched per result when filters may discard some
+FILTERED_LEXICAL_CANDIDATES = 4
+
+# A metadata value to match, or a tuple of accepted values
+FilterValue = Union[str, int, float, bool, Tuple[Union[str, int, float, bool], ...]]
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    """Represent the parameters of one search, owned by its request.
+
+    ``filters`` are (metadata key, value) pairs sorted by key, all of which a
+    chunk must match; a tuple value matches any of its items.
+    """
+
+    query: str
+    n_docs: int = 5
+    embedding: Tuple[float, ...] | None = None
+    include_text: bool = True
+    retrieval: str = VECTOR
+    filters: Tuple[Tuple[str, FilterValue], ...] = ()
+
+
+@dataclass(frozen=True)
+class SearchResult:
+    """Represent the chunks found for one search, best first.
+
+    The higher the score, the better the chunk: the opposite of the distance
+    for vector searches, the BM25 score for lexical ones and the fused score
+    for hybrid ones.
+    """
+
+    ids: Tuple[str, ...]
+    documents: Tuple[str, ...]
+    metadatas: Tuple[dict, ...]
+    scores: Tuple[float, ...] = ()
+
+
+def where_clause(filters: Tuple[Tuple[str, FilterValue], ...]) -> dict | None:
+    """Translate search filters into a Chroma ``where`` clause."""
+    clauses = [{key: {"$in": list(value)}} if isinstance(value, tuple)
+               else {key: value} for key, value in filters]
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def matches(metadata: dict | None, filters: Tuple[Tuple[str, FilterValue], ...],
+            ) -> bool:
+    """Check whether chunk metadata matches every search filter."""
+    metadata = metadata or {}
+    return all(metadata.get(key) in value if isinstance(value, tuple)
+               else metadata.get(key) == value for key, value in filters)
+
+
+def merge_results(results: Mapping[str, SearchResult], n_docs: int,
+                  ) -> tuple[SearchResult, list[str]]:
+    """Merge the results of several collections into the n_docs best by score.
+
+    A chunk found in several collections (e.g. a collection and its
+    compressed copy) is kept once, with its best score. Scores are only
+    comparable between collections searched the same way: vector distances
+    need the same embedding model, fused scores are based on ranks and
+    always are.
+
+    Returns:
+    -------
+        tuple[SearchResult, list[str]]: The merged result and the collection
+        of each of its chunks.
+
+    """
+    merged: list[tuple[float, int, str]] = sorted(
+        ((score, position, name) for name, result in results.items()
+         for position, score in enumerate(result.scores)),
+        key=lambda item: (-item[0], item[1]),
+    )
+    best: dict[str, tuple[int, str]] = {}
+    for _, position, name in merged:
+        best.setdefault(results[name].ids[position], (position, name))
+        if len(best) == n_docs:
+            break
+    picked = [(results[name], position) for position, name in best.values()]
+    return SearchResult(
+        ids=tuple(result.ids[position] for result, position in picked),
+        documents=tuple(result.documents[position] for result, position in picked)
+        if any(result.documents for result in results.values()) else (),
+        metadatas=tuple(result.metadatas[position] for result, position in picked),
+        scores=tuple(result.scores[position] for result, position in picked),
+    ), [name for _, name in best.values()]
+
+
+class Retriever:
+    """Embed and search queries in a Chroma collection, from any thread.
+
+    Every search gets its parameters from its own ``SearchQuery``; the only
+    shared state is the caches, the collection version and the lexical index,
+    which are guarded by locks. Query embeddings are cached by normalized
+    query, and results by (normalized query, n_docs, include_text, retrieval,
+    filters, collection version) so that ingestion, which bumps the version,
+    invalidates them.
+
+    Metadata filters are pushed down into the vector index query. The BM25
+    index knows nothing of metadata: its candidates are over-fetched and
+    filtered once their metadata is read.
+
+    Lexical and hybrid searches need the BM25 index written by ingestion next
+    to the collection; it is reloaded when the version changes. Without it,
+    they fall back to vector search.
+
+    With ``compressed_vectors_path``, the collection holds PCA-projected
+    vectors (see ``compressed_vectors.py``): queries are projected the same
+    way, ``rerank_factor`` times more candidates are fetched and re-ranked
+    with the full-precision vectors kept on disk.
+    """
+
+    def __init__(self, client: chromadb.ClientAPI, collection_name: str,
+                 embedding_function: EmbeddingFunction,
+                 embedding_cache_size: int = 4096, result_cache_size: int = 4096,
+                 version_refresh_seconds: float = 5.0,
+                 lexical_index_path: str | None = None,
+                 hybrid_candidates: int = 4,
+                 metrics: ServiceMetrics | None = None,
+                 compressed_vectors_path: str | None = None,
+                 rerank_factor: int = 4) -> None:
+        """Initialize the retriever.
+
+        Args:
+        ----
+            client (chromadb.ClientAPI): The Chroma client.
+            collection_name (str): The name of the collection to search.
+            embedding_function (EmbeddingFunction): Embeds the queries.
+            embedding_cache_size (int): Maximum number of cached embeddings.
+            result_cache_size (int): Maximum number of cached results.
+            version_refresh_seconds (float): Maximum age of the collection
+            version before it is read again.
+            lexical_index_path (str | None): The directory of the BM25 index.
+            hybrid_candidates (int): Each ranking fused by a hybrid search has
+            this many times n_docs candidates.
+            metrics (ServiceMetrics | None): Records the duration of the
+            embedding, vector search, re-ranking, lexical search and document
+            fetches.
+            compressed_vectors_path (str | None): The directory of the
+            projection and full vectors of a compressed collection.
+            rerank_factor (int): Candidates re-ranked per result of a
+            compressed collection.
+
+        """
+        self.client = client
+        self.collection_name = collection_name
+        self.embedding_function = embedding_function
+        self.collection = client.get_collection(name=collection_name,
+                                                embedding_function=embedding_function)
+        self.embedding_cache = LRUCache(max_size=embedding_cache_size)
+        self.result_cache = LRUCache(max_size=result_cache_size)
+        self.version_refresh_seconds = version_refresh_seconds
+        self._version = 0
+        self._version_checked_at = float("-inf")
+        self._version_lock = threading.Lock()
+        self.lexical_index_path = lexical_index_path
+        self.hybrid_candidates = hybrid_candidates
+        self.metrics = metrics
+        self.compressed = CompressedVectors(compressed_vectors_path) \
+            if compressed_vectors_path is not None else None
+        self.rerank_factor = rerank_factor if self.compressed is not None else 1
+        self.lexical_index: LexicalIndex | None = None
+        self.load_lexical_index()
+        self._dimension: int | None = None
+
+    def load_lexical_index(self) -> None:
+        """Memory-map the BM25 index, if it was built."""
+        if self.lexical_index_path is None:
+            return
+        if not (Path(self.lexical_index_path) / "meta.json").exists():
+            logger.warning("No lexical index at %s: lexical and hybrid searches "
+                           "fall back to vector search", self.lexical_index_path)
+            return
+        self.lexical_index = LexicalIndex(self.lexical_index_path)
+
+    def _stage(self, stage: str) -> ContextManager:
+        """Time a stage if metrics are recorded."""
+        return self.metrics.stage(stage) if self.metrics is not None else nullcontext()
+
+    def collection_version(self) -> int:
+        """Return the ingestion version of the collection."""
+        with self._version_lock:
+            now = time.monotonic()
+            if now - self._version_checked_at >= self.version_refresh_seconds:
+                metadata = self.client.get_collection(
+                    name=self.collection_name).metadata or {}
+                version = int(metadata.get("version", 0))
+                if version != self._version:
+                    self.load_lexical_index()
+                self._version = version
+                self._version_checked_at = now
+            return self._version
+
+    def embedding_dimension(self) -> int | None:
+        """Return the dimension of query embeddings, None for an empty collection.
+
+        Queries of a compressed collection keep the full dimension: they are
+        projected by the retriever.
+        """
+        if self._dimension is None:
+            if self.compressed is not None:
+                self._dimension = self.compressed.vectors.shape[1]
+            else:
+                stored = self.collection.get(limit=1, include=["embeddings"])
+                if stored["embeddings"] is not None and len(stored["embeddings"]):
+                    self._dimension = len(stored["embeddings"][0])
+        return self._dimension
+
+    def embed(self, queries: Sequence[str]) -> list[list[float]]:
+        """Return the embeddings of queries, computing cache misses in one call."""
+        keys = [normalize_query(query) for query in queries]
+        embeddings = {key: self.embedding_cache.get(key) for key in keys}
+        missing = {key: query for key, query in zip(keys, queries)
+                   if embeddings[key] is None}
+        if missing:
+            with self._stage("embed"):
+                computed = self.embedding_function(list(missing.values()))
+            for key, embedding in zip(missing, computed):
+                embeddings[key] = [float(x) for x in embedding]
+                self.embedding_cache.put(key, embeddings[key])
+        return [embeddings[key] for key in keys]
+
+    def search(self, queries: Sequence[SearchQuery]) -> list[SearchResult]:
+        """Search several queries with one embedding call and few index queries.
+
+        Cached results are reused. The remaining vector and hybrid queries are
+        embedded together (unless their embedding is given) and searched in a
+        single call per distinct set of filters, for the largest number of
+        candidates, then truncated to each query's own. Hybrid queries fuse
+        this ranking with the BM25 one by reciprocal rank; chunks only found
+        by BM25 are fetched in one call.
+
+        Args:
+        ----
+            queries (Sequence[SearchQuery]): The searches to run.
+
+        Returns:
+        -------
+            list[SearchResult]: One result per query, in order.
+
+        """
+        version = self.collection_version()
+        lexical_index = self.lexical_index
+        # A given embedding, not the text, is what a vector search looks for
+        keys = [(normalize_query(query.query), query.embedding, query.n_docs,
+                 query.include_text, query.retrieval, query.filters, version)
+                for query in queries]
+        results = [self.result_cache.get(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if not misses:
+            return results
+
+        modes = {i: queries[i].retrieval if lexical_index is not None else VECTOR
+                 for i in misses}
+        candidates = {i: queries[i].n_docs * (self.hybrid_candidates
+                                              if modes[i] == HYBRID else 1)
+                      for i in misses}
+        with_text = any(queries[i].include_text for i in misses)
+        include = ["metadatas", "documents"] if with_text else ["metadatas"]
+        rankings: dict[int, list[list[Tuple[str, float]]]] = {i: [] for i in misses}
+        chunks: dict[str, Tuple[str, dict]] = {}
+
+        vector_misses = [i for i in misses if modes[i] != LEXICAL]
+        if vector_misses:
+            to_embed = [queries[i].query for i in vector_misses
+                        if queries[i].embedding is None]
+            computed = iter(self.embed(to_embed) if to_embed else [])
+            embeddings = [list(queries[i].embedding)
+                          if queries[i].embedding is not None else next(computed)
+                          for i in vector_misses]
+            index_embeddings = embeddings if self.compressed is None \
+                else self.compressed.project(embeddings).tolist()
+            # A Chroma query takes a single where clause for all its embeddings
+            groups: dict[Tuple[Tuple[str, FilterValue], ...], list[int]] = {}
+            for position, i in enumerate(vector_misses):
+                groups.setdefault(queries[i].filters, []).append(position)
+            for filters, positions in groups.items():
+                with self._stage("vector_search"):
+                    query_results = self.collection.query(
+                        query_embeddings=[index_embeddings[position]
+                                          for position in positions],
+                        n_results=max(candidates[vector_misses[position]]
+                                      for position in positions) * self.rerank_factor,
+                        where=where_clause(filters),
+                        include=[*include, "distances"],
+                    )
+                for row, position in enumerate(positions):
+                    i = vector_misses[position]
+                    ids = query_results["ids"][row]
+                    documents = query_results["documents"][row] if with_text \
+                        else [""] * len(ids)
+                    chunks.update(zip(ids, zip(documents,
+                                               query_results["metadatas"][row])))
+                    ranking = list(zip(ids, query_results["distances"][row]))
+                    if self.compressed is not None:
+                        with self._stage("rerank"):
+                            ranking = self.compressed.rerank(
+                                embeddings[position],
+                                ids[:candidates[i] * self.rerank_factor])
+                    rankings[i].append([(chunk_id, -distance) for chunk_id, distance
+                                        in ranking[:candidates[i]]])
+
+        lexical_misses = [i for i in misses if modes[i] != VECTOR]
+        lexical: dict[int, list[Tuple[str, float]]] = {}
+        for i in lexical_misses:
+            # Over-fetched, as filtering may discard part of the candidates
+            with self._stage("lexical_search"):
+                lexical[i] = lexical_index.search(
+                    queries[i].query, candidates[i] * (FILTERED_LEXICAL_CANDIDATES
+                                                       if queries[i].filters else 1))
+        missing = list({chunk_id for ranking in lexical.values()
+                        for chunk_id, _ in ranking if chunk_id not in chunks})
+        if missing:
+            with self._stage("fetch_documents"):
+                fetched = self.collection.get(ids=missing, include=include)
+            documents = fetched["documents"] if with_text \
+                else [""] * len(fetched["ids"])
+            chunks.update(zip(fetched["ids"], zip(documents, fetched["metadatas"])))
+        for i in lexical_misses:
+            # The lexical index may still list chunks deleted since it was built
+            rankings[i].append([
+                (chunk_id, score) for chunk_id, score in lexical[i]
+                if chunk_id in chunks and matches(chunks[chunk_id][1],
+                                                  queries[i].filters)
+            ][:candidates[i]])
+
+        for i in misses:
+            ranking = (rankings[i][0] if len(rankings[i]) == 1
+                       else reciprocal_rank_fusion(
+                           [[chunk_id for chunk_id, _ in ranked]
+                            for ranked in rankings[i]]))[:queries[i].n_docs]
+            results[i] = SearchResult(
+                ids=tuple(chunk_id for chunk_id, _ in ranking),
+                documents=tuple(chunks[chunk_id][0] for chunk_id, _ in ranking)
+                if queries[i].include_text else (),
+                metadatas=tuple(chunks[chunk_id][1] or {} for chunk_id, _ in ranking),
+                scores=tuple(score for _, score in ranking),
+            )
+            self.result_cache.put(keys[i], results[i])
+        return results
+
+    def warm_up(self, query: str = "warm up") -> dict[str, float]:
+        """Load what the first searches would otherwise load, and time it.
+
+        Embedding a query loads the embedding model, and a hybrid search loads
+        the vector index and pages in the lexical one. The entries it leaves
+        in the caches are harmless.
+
+        Returns:
+        -------
+            dict[str, float]: The duration of each step, in seconds.
+
+        """
+        timings = {}
+        start = time.perf_counter()
+        self.collection_version()
+        timings["collection_version"] = time.perf_counter() - start
+        start = time.perf_counter()
+        embedding = self.embed([query])[0]
+        timings["embedding_model"] = time.perf_counter() - start
+        start = time.perf_counter()
+        self.search([SearchQuery(query=query, n_docs=1, embedding=tuple(embedding),
+                                 retrieval=HYBRID)])
+        timings["search"] = time.perf_counter() - start
+        return timings
+
+    def cache_stats(self) -> dict:
+        """Return the hit and miss counters of the caches."""
+        return {"embeddings": self.embedding_cache.stats(),
+                "results": self.result_cache.stats()}
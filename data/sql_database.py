@@ -1,11 +1,66 @@
 """Module to provide functions for initializing and interacting with the database."""
 
+from __future__ import annotations
+
+import logging
+import queue
 import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Tuple
+
+if TYPE_CHECKING:
+    from data.metrics import ServiceMetrics
+
+QUERIES_DB_PATH = "data/queries.db"
+
+logger = logging.getLogger(__name__)
+
+# A resent insert of the same interaction is ignored rather than failing,
+# as one failing statement would roll back the whole batch it is part of
+INSERT_QUERY_SQL = """
+    INSERT OR IGNORE INTO queries (interaction_id, query, answer, documents)
+    VALUES (?, ?, ?, ?)
+"""
+WRITE_FEEDBACK_SQL = """
+    UPDATE queries
+    SET feedback = ?
+    WHERE interaction_id = ?
+"""
+
+# Schema migrations, applied in order. The index of the last applied script
+# (1-based) is stored in the database user_version.
+MIGRATIONS = [
+    # Address rows by a stable interaction id rather than by the query text.
+    # Feedback is written by id, so it needs a unique index to avoid a scan.
+    """
+    ALTER TABLE queries ADD COLUMN interaction_id TEXT;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_queries_interaction_id
+        ON queries (interaction_id);
+    """,
+]
+
 
+def migrate_db(conn: sqlite3.Connection) -> None:
+    """Apply the schema migrations that have not been applied yet.
 
-def init_db() -> None:
-    """Initialize the database."""
-    conn = sqlite3.connect("data/queries.db")
+    Each script and its version bump are committed in one transaction, so
+    a migration interrupted midway is applied again from scratch.
+    """
+    conn.commit()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            conn.executescript(f"BEGIN;\n{script}\n"
+                               f"PRAGMA user_version = {number};\nCOMMIT;")
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+
+def init_db(db_path: str = QUERIES_DB_PATH) -> None:
+    """Initialize the database and bring its schema up to date."""
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS queries (
@@ -17,4 +72,123 @@ def init_db() -> None:
         )
     """)
     conn.commit()
+    migrate_db(conn)
     conn.close()
+
+
+class QueryLogWriter:
+    """Write-behind buffer for query records and feedback.
+
+    Writes are queued in memory and flushed by a background thread in a single
+    transaction once ``batch_size`` statements are pending or ``flush_interval``
+    seconds have passed, over one long-lived WAL-mode connection.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db_path: str = QUERIES_DB_PATH, batch_size: int = 64,
+                 flush_interval: float = 0.5, max_pending: int = 10_000,
+                 metrics: ServiceMetrics | None = None) -> None:
+        """Initialize the writer.
+
+        Args:
+        ----
+            db_path (str): Path of the sqlite database.
+            batch_size (int): Maximum number of statements per transaction.
+            flush_interval (float): Maximum time in seconds a write stays
+            buffered before being flushed.
+            max_pending (int): Maximum number of buffered writes. Producers
+            block once it is reached.
+            metrics (ServiceMetrics | None): Records the duration of each
+            batch transaction as the "db_write" stage.
+
+        """
+        self.db_path = db_path
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Create the schema if needed and start the background writer."""
+        if self._thread is not None:
+            return
+        init_db(self.db_path)
+        self._thread = threading.Thread(target=self._run, name="query-log-writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Flush every pending write and stop the background writer."""
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+
+    def flush(self) -> None:
+        """Block until every write queued so far has been committed."""
+        self._queue.join()
+
+    def insert_query(self, interaction_id: str, query: str, answer: str,
+                     documents: str) -> None:
+        """Queue the insertion of a query record."""
+        self._queue.put((INSERT_QUERY_SQL,
+                         (interaction_id, query, answer, documents)))
+
+    def write_feedback(self, interaction_id: str, feedback: str) -> None:
+        """Queue a feedback update for the given interaction."""
+        self._queue.put((WRITE_FEEDBACK_SQL, (feedback, interaction_id)))
+
+    def _next_batch(self) -> Tuple[list[Tuple[str, Tuple[Any, ...]]], bool]:
+        """Collect the next batch of writes and whether the writer must stop."""
+        item = self._queue.get()
+        if item is self._STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _write(self, conn: sqlite3.Connection,
+               batch: list[Tuple[str, Tuple[Any, ...]]]) -> None:
+        """Write a batch of statements in one transaction, in queue order."""
+        start = time.perf_counter()
+        try:
+            with conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+            if self.metrics is not None:
+                self.metrics.observe("db_write", time.perf_counter() - start)
+        except sqlite3.Error:
+            logger.exception("Failed to write %d queued statements", len(batch))
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _run(self) -> None:
+        """Drain the queue until the stop sentinel is received."""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            stop = False
+            while not stop:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._write(conn, batch)
+            # Account for the stop sentinel itself
+            self._queue.task_done()
+        finally:
+            conn.close()
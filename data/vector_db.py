@@ -1,10 +1,33 @@
 from __future__ import annotations
 
+import argparse
+import hashlib
+import json
 import os
+import re
+import time
+from bisect import bisect_left
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
 from pathlib import Path
-from typing import Tuple
+from typing import Callable, Iterable, Iterator, Tuple
 
 import chromadb
+from chromadb.api.types import EmbeddingFunction
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+from data.chunking import ByteOffsets, TokenOffsets, iter_chunk_spans
+from data.lexical_index import build_lexical_index
+
+# Ids, texts and metadata of a batch of chunks
+Batch = Tuple[list[str], list[str], list[dict]]
+
+TITLE_PATTERN = re.compile(r"^Title:(.*)$", re.MULTILINE)
 
 
 def load_documents(input_dir: str,
@@ -32,53 +55,478 @@ def load_documents(input_dir: str,
             documents.append((content, file_name))
     return documents
 
-def split_into_chunks(text: str, chunk_size: int = 500,
-                      overlap: int = 50) -> list[str]:
+def split_into_chunks(text: str, chunk_size: int = 500, overlap: int = 50,
+                      token_offsets: TokenOffsets | None = None) -> list[str]:
     """Split a document into smaller chunks of a given number of characters with overlap.
 
+    Chunks end on paragraph, sentence or word boundaries when possible, see
+    ``iter_chunk_spans`` for the lazy, offset-only version.
+
     Args:
     ----
         text (str): The content of the document.
         chunk_size (int): The maximum number of characters per chunk. Defaults to 500.
         overlap (int): The number of characters to overlap between chunks.
         Defaults to 50.
+        token_offsets (TokenOffsets | None): If given, sizes are counted in
+        tokens of this tokenizer instead of characters.
 
     Returns:
     -------
         List[str]: A list of text chunks.
 
     """
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start += chunk_size - overlap
-    return chunks
+    return [text[start:end] for start, end in iter_chunk_spans(
+        text, chunk_size=chunk_size, overlap=overlap, token_offsets=token_offsets)]
+
+
+def hf_token_offsets(model_name: str) -> TokenOffsets:
+    """Return a function giving the token offsets of a text for a HF tokenizer.
+
+    Args:
+    ----
+        model_name (str): The name of the tokenizer on the Hugging Face hub,
+        e.g. the one of the embedding model.
+
+    Returns:
+    -------
+        TokenOffsets: Maps a text to the character offsets of its tokens.
+
+    """
+    # Only needed for token-based chunk sizes
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    def token_offsets(text: str) -> list[Tuple[int, int]]:
+        return tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                         verbose=False)["offset_mapping"]
+
+    return token_offsets
+
+
+def iter_documents(input_dir: str,
+                   sample_size: int | None = None) -> Iterator[Tuple[str, str]]:
+    """Lazily read documents from the specified input directory.
+
+    Args:
+    ----
+        input_dir (str): The directory containing the input text files.
+        sample_size (int | None): The number of files to read. Defaults to all.
+
+    Yields:
+    ------
+        Tuple[str, str]: The content of a document and its file name.
+
+    """
+    file_names = sorted(os.listdir(input_dir))[:sample_size]
+    for file_name in file_names:
+        file_path = Path(input_dir) / file_name
+        with file_path.open(encoding="utf-8") as file:
+            yield file.read(), file_name
+
+
+def iter_document_chunks(doc_content: str, doc_id: str, chunk_size: int = 500,
+                         overlap: int = 50, token_offsets: TokenOffsets | None = None,
+                         ) -> Iterator[Tuple[str, str, dict]]:
+    """Split a document into chunks along with their metadata.
+
+    Args:
+    ----
+        doc_content (str): The content of the document.
+        doc_id (str): The file name of the document.
+        chunk_size (int): The maximum number of characters per chunk.
+        overlap (int): The number of characters to overlap between chunks.
+        token_offsets (TokenOffsets | None): If given, sizes are counted in
+        tokens of this tokenizer instead of characters.
+
+    Yields:
+    ------
+        Tuple[str, str, dict]: The id, text and metadata of a chunk. The
+        metadata holds the source file, the chunk index, the UTF-8 byte offsets
+        of the chunk in the source file and its title: the first "Title:" line
+        in the chunk, else the last one before it, else the file name.
+
+    """
+    title_starts, titles = [], []
+    for match in TITLE_PATTERN.finditer(doc_content):
+        title_starts.append(match.start())
+        titles.append(match.group(1).strip())
+    default_title = Path(doc_id).stem.replace("_", " ")
+    start_bytes, end_bytes = ByteOffsets(doc_content), ByteOffsets(doc_content)
+
+    for i, (start, end) in enumerate(iter_chunk_spans(
+            doc_content, chunk_size=chunk_size, overlap=overlap,
+            token_offsets=token_offsets)):
+        title_index = bisect_left(title_starts, start)
+        if title_index == len(title_starts) or title_starts[title_index] >= end:
+            title_index -= 1
+        metadata = {
+            "source": doc_id,
+            "title": titles[title_index] if title_index >= 0 else default_title,
+            "chunk_index": i,
+            "start_byte": start_bytes(start),
+            "end_byte": end_bytes(end),
+        }
+        yield f"{doc_id}_chunk_{i}", doc_content[start:end], metadata
+
+
+def iter_chunk_batches(documents: Iterable[Tuple[str, str]], batch_size: int = 256,
+                       chunk_size: int = 500, overlap: int = 50,
+                       token_offsets: TokenOffsets | None = None,
+                       ) -> Iterator[Batch]:
+    """Split documents into chunks and group them into batches.
+
+    Args:
+    ----
+        documents (Iterable[Tuple[str, str]]): The documents and their file names.
+        batch_size (int): The number of chunks per batch. Defaults to 256.
+        chunk_size (int): The maximum number of characters per chunk.
+        overlap (int): The number of characters to overlap between chunks.
+        token_offsets (TokenOffsets | None): If given, sizes are counted in
+        tokens of this tokenizer instead of characters.
+
+    Returns:
+    -------
+        Iterator[Batch]: The ids, texts and metadata of the chunks, batch by
+        batch.
+
+    """
+    chunks = (
+        chunk
+        for doc_content, doc_id in documents
+        for chunk in iter_document_chunks(doc_content, doc_id, chunk_size=chunk_size,
+                                          overlap=overlap, token_offsets=token_offsets)
+    )
+    return batched(chunks, batch_size)
+
+
+def batched(chunks: Iterable[Tuple[str, str, dict]],
+            batch_size: int = 256) -> Iterator[Batch]:
+    """Group (id, text, metadata) chunks into batches.
+
+    Args:
+    ----
+        chunks (Iterable[Tuple[str, str, dict]]): The ids, texts and metadata
+        of the chunks.
+        batch_size (int): The number of chunks per batch. Defaults to 256.
+
+    Yields:
+    ------
+        Batch: The ids, texts and metadata of a batch of chunks.
+
+    """
+    ids: list[str] = []
+    texts: list[str] = []
+    metadatas: list[dict] = []
+    for chunk_id, text, metadata in chunks:
+        ids.append(chunk_id)
+        texts.append(text)
+        metadatas.append(metadata)
+        if len(ids) == batch_size:
+            yield ids, texts, metadatas
+            ids, texts, metadatas = [], [], []
+    if ids:
+        yield ids, texts, metadatas
+
+
+# Bumped whenever the chunking algorithm or the stored chunk metadata change,
+# to re-index every chunk
+CHUNKER_VERSION = 4
+
+
+def content_hash(text: str) -> str:
+    """Return the SHA-256 hex digest of a text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IncrementalIndexer:
+    """Track which files and chunks of a collection changed since the last run.
+
+    The manifest maps each indexed file to the hash of its content and to the
+    hashes of the text and of the metadata of each of its chunks. Unchanged
+    files are skipped without being chunked, and only the chunks of changed
+    files whose text is new or modified are yielded for embedding. Chunks
+    whose text is unchanged but whose metadata moved, e.g. byte offsets after
+    an edit earlier in the file, are collected in ``metadata_updates`` so
+    that their embedding is kept. Chunks that no longer exist (shorter or
+    deleted files) are collected in ``stale_ids`` for deletion.
+    """
+
+    def __init__(self, manifest_path: str, chunk_size: int = 500,
+                 overlap: int = 50, tokenizer: str | None = None) -> None:
+        """Initialize the indexer from the manifest of the previous run, if any.
+
+        Args:
+        ----
+            manifest_path (str): The path of the JSON manifest.
+            chunk_size (int): The maximum number of characters per chunk.
+            overlap (int): The number of characters to overlap between chunks.
+            tokenizer (str | None): If given, the Hugging Face tokenizer in
+            whose tokens chunk sizes are counted.
+
+        """
+        self.manifest_path = Path(manifest_path)
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.tokenizer = tokenizer
+        self.token_offsets = hf_token_offsets(tokenizer) if tokenizer else None
+        self.manifest: dict = {"files": {}}
+        if self.manifest_path.exists():
+            with self.manifest_path.open(encoding="utf-8") as file:
+                self.manifest = json.load(file)
+        # Chunking parameters changed: every chunk has to be recomputed
+        if self.manifest.get("chunking") != self.chunking:
+            self.manifest["files"] = {
+                name: {"hash": None, "chunks": entry["chunks"]}
+                for name, entry in self.manifest["files"].items()
+            }
+        self.files: dict[str, dict] = {}
+        self.stale_ids: list[str] = []
+        self.metadata_updates: dict[str, dict] = {}
+        self.stats = {"unchanged_files": 0, "changed_files": 0, "deleted_files": 0,
+                      "upserted_chunks": 0, "updated_metadata": 0}
+
+    def changed_chunks(self, documents: Iterable[Tuple[str, str]],
+                       ) -> Iterator[Tuple[str, str, dict]]:
+        """Yield the id, text and metadata of every new or modified chunk.
+
+        Args:
+        ----
+            documents (Iterable[Tuple[str, str]]): The documents and their file
+            names.
+
+        Yields:
+        ------
+            Tuple[str, str, dict]: The id, text and metadata of a chunk to embed
+            and upsert.
+
+        """
+        for doc_content, doc_id in documents:
+            file_hash = content_hash(doc_content)
+            previous = self.manifest["files"].get(doc_id, {"hash": None, "chunks": {}})
+            if previous["hash"] == file_hash:
+                self.files[doc_id] = previous
+                self.stats["unchanged_files"] += 1
+                continue
+
+            self.stats["changed_files"] += 1
+            chunk_hashes = {}
+            for chunk_id, chunk, metadata in iter_document_chunks(
+                    doc_content, doc_id, chunk_size=self.chunk_size,
+                    overlap=self.overlap, token_offsets=self.token_offsets):
+                # Only the text is embedded: offsets and titles are updated
+                # in place when nothing else changed
+                hashes = [content_hash(chunk),
+                          content_hash(json.dumps(metadata, sort_keys=True))]
+                chunk_hashes[chunk_id] = hashes
+                previous_hashes = previous["chunks"].get(chunk_id)
+                if not isinstance(previous_hashes, list) \
+                        or previous_hashes[0] != hashes[0]:
+                    self.stats["upserted_chunks"] += 1
+                    yield chunk_id, chunk, metadata
+                elif previous_hashes[1] != hashes[1]:
+                    self.stats["updated_metadata"] += 1
+                    self.metadata_updates[chunk_id] = metadata
+            self.stale_ids.extend(set(previous["chunks"]) - set(chunk_hashes))
+            self.files[doc_id] = {"hash": file_hash, "chunks": chunk_hashes}
+
+    def remove_missing_files(self, present_files: Iterable[str]) -> None:
+        """Mark the chunks of indexed files that no longer exist as stale."""
+        present = set(present_files)
+        for name, entry in self.manifest["files"].items():
+            if name not in present:
+                self.stale_ids.extend(entry["chunks"])
+                self.stats["deleted_files"] += 1
+            elif name not in self.files:
+                # Present but not processed in this run (e.g. sampled out)
+                self.files[name] = entry
+
+    @property
+    def chunking(self) -> dict:
+        """The chunking parameters the manifest hashes depend on."""
+        return {"chunker": CHUNKER_VERSION, "chunk_size": self.chunk_size,
+                "overlap": self.overlap, "tokenizer": self.tokenizer}
+
+    @property
+    def changed(self) -> bool:
+        """Whether the collection content changed in this run."""
+        return bool(self.stats["upserted_chunks"] or self.metadata_updates
+                    or self.stale_ids)
+
+    def save(self) -> None:
+        """Atomically write the manifest of the current run."""
+        manifest = {"chunking": self.chunking, "files": self.files}
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+        tmp_path.replace(self.manifest_path)
+
+
+def bump_collection_version(db: chromadb.Collection) -> int:
+    """Increment the version stored in the collection metadata.
+
+    The services compare it with the version their caches were filled from.
+    """
+    # The distance function cannot be passed to modify, even unchanged
+    metadata = {key: value for key, value in (db.metadata or {}).items()
+                if key != "hnsw:space"}
+    metadata["version"] = int(metadata.get("version", 0)) + 1
+    db.modify(metadata=metadata)
+    return metadata["version"]
+
+
+# Embedding function of the current ingestion worker process
+_worker_embedding_function: EmbeddingFunction | None = None
+
+
+def _init_worker(embedding_function_factory: Callable[[], EmbeddingFunction],
+                 ) -> None:
+    """Load the embedding model once per worker process."""
+    global _worker_embedding_function  # noqa: PLW0603
+    _worker_embedding_function = embedding_function_factory()
+
+
+def _embed_batch(chunks: list[str]) -> list[list[float]]:
+    """Embed a batch of chunks in a worker process."""
+    embeddings = _worker_embedding_function(chunks)
+    return [[float(x) for x in embedding] for embedding in embeddings]
+
+
+def ingest(db: chromadb.Collection, batches: Iterable[Batch],
+           embedding_function_factory: Callable[[], EmbeddingFunction] =
+           DefaultEmbeddingFunction,
+           workers: int = 4, max_pending: int | None = None,
+           report_every: float = 5.0) -> int:
+    """Embed batches of chunks in parallel and upsert them into a collection.
+
+    Batches are pulled from the (lazy) iterable only while fewer than
+    ``max_pending`` of them are being embedded, so memory stays bounded however
+    large the corpus is. Embedded batches are written as soon as they are ready.
+
+    Args:
+    ----
+        db (chromadb.Collection): The collection to write into.
+        batches (Iterable[Batch]): The ids, texts and metadata of the chunks,
+        batch by batch.
+        embedding_function_factory (Callable[[], EmbeddingFunction]): Builds the
+        embedding function in each worker. Must be picklable.
+        workers (int): The number of embedding processes. Defaults to 4.
+        max_pending (int | None): The maximum number of batches in flight.
+        Defaults to twice the number of workers.
+        report_every (float): Seconds between two progress reports.
+
+    Returns:
+    -------
+        int: The number of chunks written.
+
+    """
+    max_pending = max_pending or 2 * workers
+    start_time = last_report = time.monotonic()
+    written = 0
+
+    def write(future: Future) -> None:
+        nonlocal written, last_report
+        ids, chunks, metadatas = pending.pop(future)
+        db.upsert(ids=ids, documents=chunks, metadatas=metadatas,
+                  embeddings=future.result())
+        written += len(ids)
+        now = time.monotonic()
+        if now - last_report >= report_every:
+            print(f"Ingested {written} chunks "
+                  f"({written / (now - start_time):.1f} chunks/s)")
+            last_report = now
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(embedding_function_factory,)) as pool:
+        # Only the texts go to the workers, the rest of a batch waits here
+        pending: dict[Future, Batch] = {}
+        for batch in batches:
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future)
+            pending[pool.submit(_embed_batch, batch[1])] = batch
+        for future in as_completed(list(pending)):
+            write(future)
+
+    elapsed = time.monotonic() - start_time
+    print(f"Ingested {written} chunks in {elapsed:.1f}s "
+          f"({written / max(elapsed, 1e-9):.1f} chunks/s)")
+    return written
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line arguments of the ingestion CLI."""
+    parser = argparse.ArgumentParser(
+        description="Incrementally chunk, embed and write documents into a Chroma "
+                    "collection. Only files changed since the last run are "
+                    "re-embedded.",
+    )
+    parser.add_argument("--input-dir", default="data/wikipedia_articles")
+    parser.add_argument("--db-path", default="data/chroma_db")
+    parser.add_argument("--collection", default="chroma_db")
+    parser.add_argument("--sample-size", type=int, default=None,
+                        help="Number of files to ingest (default: all).")
+    parser.add_argument("--chunk-size", type=int, default=500,
+                        help="Maximum chunk size, in characters or in tokens "
+                             "if --tokenizer is set.")
+    parser.add_argument("--overlap", type=int, default=50)
+    parser.add_argument("--tokenizer", default=None,
+                        help="Hugging Face tokenizer to count chunk sizes in "
+                             "tokens, e.g. the embedding model's.")
+    parser.add_argument("--batch-size", type=int, default=256,
+                        help="Number of chunks embedded and written at once.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of embedding processes.")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="Maximum number of batches in flight.")
+    parser.add_argument("--manifest", default=None,
+                        help="Path of the content hash manifest "
+                             "(default: <db-path>/<collection>_manifest.json).")
+    parser.add_argument("--lexical-index", default=None,
+                        help="Directory of the BM25 index used by hybrid search "
+                             "(default: <db-path>/<collection>_bm25).")
+    return parser.parse_args()
+
 
 def main() -> None:
-    # Define paths and parameters
-    input_dir = "data/wikipedia_articles"
-    sample_size = len(os.listdir(input_dir))
-    collection_name = "chroma_db"
+    args = parse_args()
 
-    # Load and process documents
-    documents_tuple = load_documents(input_dir, sample_size=sample_size)
+    manifest_path = args.manifest or str(
+        Path(args.db_path) / f"{args.collection}_manifest.json")
+    indexer = IncrementalIndexer(manifest_path, chunk_size=args.chunk_size,
+                                 overlap=args.overlap, tokenizer=args.tokenizer)
 
-    # Split documents into smaller chunks
-    # Small overlap to preserve context
-    documents = []
-    id_list = []
-    for doc_content, doc_id in documents_tuple:
-        chunks = split_into_chunks(doc_content, chunk_size=500, overlap=50)
-        documents.extend(chunks)
-        id_list.extend([f"{doc_id}_chunk_{i}" for i in range(len(chunks))])
-
-    # Add documents to the vector store
-    chroma_client = chromadb.PersistentClient(path="data/chroma_db")
-    db = chroma_client.create_collection(name=collection_name)
-    db.add(documents=documents, ids=id_list)
+    # Stream the new or modified chunks into batches
+    # Small overlap to preserve context
+    documents = iter_documents(args.input_dir, sample_size=args.sample_size)
+    batches = batched(indexer.changed_chunks(documents), batch_size=args.batch_size)
+
+    # Upsert the changed chunks and delete the ones that disappeared
+    chroma_client = chromadb.PersistentClient(path=args.db_path)
+    # The version lets the services invalidate what they cached from it
+    db = chroma_client.get_or_create_collection(name=args.collection,
+                                                metadata={"version": 0})
+    ingest(db, batches, workers=args.workers, max_pending=args.max_pending)
+    if indexer.metadata_updates:
+        db.update(ids=list(indexer.metadata_updates),
+                  metadatas=list(indexer.metadata_updates.values()))
+    indexer.remove_missing_files(os.listdir(args.input_dir))
+    if indexer.stale_ids:
+        db.delete(ids=indexer.stale_ids)
+    # The BM25 index covers the whole collection: rebuild it before the
+    # version bump makes the services reload it
+    lexical_index_path = args.lexical_index or str(
+        Path(args.db_path) / f"{args.collection}_bm25")
+    if indexer.changed or not Path(lexical_index_path).exists():
+        version = int((db.metadata or {}).get("version", 0)) + int(indexer.changed)
+        indexed = build_lexical_index(db, lexical_index_path, version=version)
+        print(f"Lexical index: {indexed} chunks")
+    if indexer.changed:
+        print(f"Collection version: {bump_collection_version(db)}")
+    indexer.save()
+    print(f"Indexing stats: {indexer.stats}, deleted chunks: {len(indexer.stale_ids)}")
 
     # Query the vector store and print the result
     print("A sample query to the vector store:")
@@ -1,10 +1,12 @@
+import json
+
 import requests
 import streamlit as st
 
 from config_front import Config
 
 # Retrieve the API_URL from the configuration
-QUERY_URL = Config.get_backend_url() + "/query"
+QUERY_STREAM_URL = Config.get_backend_url() + "/query/stream"
 FEEDBACK_URL = Config.get_backend_url() + "/feedback"
 
 st.title("Training Recommendation Assistant")
@@ -20,30 +22,60 @@ if "feedback" not in st.session_state:
     st.session_state["feedback"] = ""
 if "selected_document" not in st.session_state:
     st.session_state["selected_document"] = ""
+if "interaction_id" not in st.session_state:
+    st.session_state["interaction_id"] = ""
 
 # Function to fetch recommendations
 def fetch_recommendations() -> None:
     """Fetch recommendations based on the user query."""
     if st.session_state["user_query"]:
-        # Prepare the request payload
-        payload = {"query": st.session_state["user_query"]}
-
-        # Send the request to the FastAPI backend
-        with st.spinner("Fetching recommendations..."):
-            try:
-                response = requests.post(QUERY_URL, json=payload, timeout=90)
+        # Prepare the request payload: asking the same question again is
+        # served after new questions when the LLM is busy
+        payload = {"query": st.session_state["user_query"],
+                   "lane": "reask" if st.session_state.get("reask") else "interactive"}
+
+        # Stream the answer from the FastAPI backend: documents come first,
+        # then the answer tokens, rendered as they arrive
+        placeholder = st.empty()
+        try:
+            with requests.post(QUERY_STREAM_URL, json=payload, stream=True,
+                               timeout=90) as response:
+                if response.status_code in (429, 503):
+                    st.warning("The assistant is busy, please retry in "
+                               f"{response.headers.get('Retry-After', 'a few')} "
+                               "seconds.")
+                    return
                 response.raise_for_status()  # Raise an error for bad responses
-                data = response.json()
-                st.session_state["recommendations"] = data.get("answer",
-                                                               "No answer received")
+                events = (json.loads(line) for line in response.iter_lines()
+                          if line)
+                with st.spinner("Fetching recommendations..."):
+                    data = next(events, {})
                 st.session_state["documents"] = data.get("documents", [])
+                sources = data.get("sources", [])
+                st.session_state["interaction_id"] = data.get("interaction_id", "")
+                with placeholder.container():
+                    st.subheader("Recommendations")
+                    answer = st.write_stream(
+                        event["content"] for event in events
+                        if event["type"] == "token"
+                    )
+            st.session_state["recommendations"] = answer or "No answer received"
+            # Titles are stored with the chunks, older indexes need parsing
+            if len(sources) == len(st.session_state["documents"]):
+                st.session_state["document_titles"] = [
+                    f"{source.get('title', '')} ({part_label(source)})"
+                    for source in sources
+                ]
+            else:
                 st.session_state["document_titles"] = extract_titles(
                     st.session_state["documents"],
                 )
-                st.session_state["selected_document"] = ""
-                st.success("Recommendations fetched successfully!")
-            except requests.exceptions.RequestException as e:
-                st.error(f"Request failed: {e}")
+            st.session_state["selected_document"] = ""
+            st.success("Recommendations fetched successfully!")
+        except requests.exceptions.RequestException as e:
+            st.error(f"Request failed: {e}")
+        # The full answer is displayed below with the documents
+        placeholder.empty()
     else:
         st.warning("Please enter a query.")
 
@@ -61,10 +93,19 @@ def extract_titles(documents : list[str]) -> list[str]:
     return titles
 
 
+def part_label(source: dict) -> str:
+    """Describe which chunks of its document a passage covers."""
+    indices = source.get("chunk_indices") or [source.get("chunk_index", 0)]
+    first, last = indices[0] + 1, indices[-1] + 1
+    return f"part {first}" if first == last else f"parts {first}-{last}"
+
+
 # User input for query
 user_query = st.text_input("Enter your query:", st.session_state["user_query"])
 
 if st.button("Get Recommendations"):
+    st.session_state["reask"] = (user_query == st.session_state["user_query"]
+                                 and bool(st.session_state["recommendations"]))
     st.session_state["user_query"] = user_query
     fetch_recommendations()
 
@@ -95,7 +136,7 @@ if st.session_state["recommendations"]:
                                                             "neutral", "negative"))
 
     if st.button("Submit Feedback"):
-        feedback_payload = {"query": st.session_state["user_query"],
+        feedback_payload = {"interaction_id": st.session_state["interaction_id"],
                             "feedback": feedback}
         try:
             feedback_response = requests.post(FEEDBACK_URL,
@@ -0,0 +1,207 @@
+"""Module providing the answer cache placed in front of retrieval and the LLM."""
+
+from __future__ import annotations
+
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Hashable, Tuple
+
+import numpy as np
+
+from data.retrieval_cache import normalize_query
+
+
+@dataclass
+class CachedAnswer:
+    """Represent an answer stored in the cache."""
+
+    answer: str
+    documents: list[str]
+    sources: list[dict] = field(default_factory=list)
+
+
+@dataclass
+class _Entry:
+    """Represent a cache entry and its bookkeeping."""
+
+    value: CachedAnswer
+    slot: int | None
+    created_at: float
+    size: int
+    version: int | None
+
+
+class AnswerCache:
+    """Two-level LRU cache of LLM answers.
+
+    Answers are looked up first by normalized query text, then by cosine
+    similarity between query embeddings. Entries are partitioned (e.g. by model
+    and number of documents) so that only comparable answers are reused, expire
+    after ``ttl`` seconds and are evicted in LRU order once ``max_entries`` or
+    ``max_bytes`` is reached. The whole cache is dropped when the collection
+    version changes. Exact hits skip the data service, so they are only served
+    while the version was observed less than ``version_max_age`` seconds ago
+    and matches the one the entry was cached under.
+
+    The cache is not thread-safe: it is meant to be used from the event loop.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, ttl: float = 3600,
+                 max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024,
+                 version_max_age: float = 5.0) -> None:
+        """Initialize the cache.
+
+        Args:
+        ----
+            similarity_threshold (float): Minimum cosine similarity for a
+            semantic hit.
+            ttl (float): Lifetime of an entry in seconds.
+            max_entries (int): Maximum number of entries.
+            max_bytes (int): Approximate memory cap of the stored answers,
+            documents and embeddings.
+            version_max_age (float): Seconds after which the collection
+            version must be observed again before an exact hit is served.
+
+        """
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version_max_age = version_max_age
+        self.collection_version: int | None = None
+        self._version_seen_at: float | None = None
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self._entries: OrderedDict[Tuple[Hashable, str], _Entry] = OrderedDict()
+        self._bytes = 0
+        # Embeddings live in one preallocated matrix, one row (slot) per entry
+        self._embeddings: np.ndarray | None = None
+        self._slot_keys: list[Tuple[Hashable, str] | None] = [None] * max_entries
+        self._slot_partitions = np.full(max_entries, -1, dtype=np.int64)
+        self._partition_ids: dict[Hashable, int] = {}
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+
+    def __len__(self) -> int:
+        """Return the number of cached answers."""
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        """Approximate memory used by the cached entries."""
+        return self._bytes
+
+    def clear(self) -> None:
+        """Drop every entry, and the embedding matrix with its dimension."""
+        for key in list(self._entries):
+            self._remove(key)
+        self._embeddings = None
+        self._partition_ids.clear()
+
+    def observe_version(self, version: int) -> None:
+        """Record the collection version, dropping every entry if it changed."""
+        if self.collection_version is not None and version != self.collection_version:
+            self.clear()
+        self.collection_version = version
+        self._version_seen_at = time.monotonic()
+
+    def get(self, partition: Hashable, query: str) -> CachedAnswer | None:
+        """Return the answer cached for this exact normalized query, if any."""
+        key = (partition, normalize_query(query))
+        entry = self._entries.get(key)
+        if entry is None or self._expired(key, entry) \
+                or entry.version != self.collection_version:
+            return None
+        # The collection may have changed since its version was last seen
+        if self._version_seen_at is not None \
+                and time.monotonic() - self._version_seen_at > self.version_max_age:
+            return None
+        self._entries.move_to_end(key)
+        self.hits["exact"] += 1
+        return entry.value
+
+    def get_similar(self, partition: Hashable,
+                    embedding: list[float]) -> CachedAnswer | None:
+        """Return the answer of the most similar cached query, if close enough."""
+        partition_id = self._partition_ids.get(partition)
+        # Embeddings of another model cannot be compared with the cached ones
+        if self._embeddings is None or partition_id is None \
+                or len(embedding) != self._embeddings.shape[1]:
+            self.misses += 1
+            return None
+        scores = np.where(self._slot_partitions == partition_id,
+                          self._embeddings @ self._unit(embedding), -np.inf)
+        slot = int(np.argmax(scores))
+        key = self._slot_keys[slot]
+        if key is None or scores[slot] < self.similarity_threshold:
+            self.misses += 1
+            return None
+        entry = self._entries[key]
+        if self._expired(key, entry):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits["semantic"] += 1
+        return entry.value
+
+    def put(self, partition: Hashable, query: str, value: CachedAnswer,
+            embedding: list[float] | None = None) -> None:
+        """Cache an answer under the normalized query and its embedding."""
+        key = (partition, normalize_query(query))
+        if key in self._entries:
+            self._remove(key)
+
+        size = (sys.getsizeof(value.answer)
+                + sum(sys.getsizeof(doc) for doc in value.documents))
+        slot = None
+        if embedding is not None and self._embeddings is not None \
+                and len(embedding) != self._embeddings.shape[1]:
+            # Only reachable by exact lookups, until the cache is cleared
+            embedding = None
+        if embedding is not None:
+            vector = self._unit(embedding)
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.max_entries, vector.shape[0]),
+                                            dtype=np.float32)
+            size += vector.nbytes
+        if size > self.max_bytes:
+            return
+
+        while self._entries and (len(self._entries) >= self.max_entries
+                                 or self._bytes + size > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+        if embedding is not None:
+            slot = self._free_slots.pop()
+            self._embeddings[slot] = vector
+            self._slot_keys[slot] = key
+            self._slot_partitions[slot] = self._partition_ids.setdefault(
+                partition, len(self._partition_ids))
+        self._entries[key] = _Entry(value=value, slot=slot,
+                                    created_at=time.monotonic(), size=size,
+                                    version=self.collection_version)
+        self._bytes += size
+
+    def _expired(self, key: Tuple[Hashable, str], entry: _Entry) -> bool:
+        """Remove the entry and return True if it outlived its TTL."""
+        if time.monotonic() - entry.created_at <= self.ttl:
+            return False
+        self._remove(key)
+        return True
+
+    def _remove(self, key: Tuple[Hashable, str]) -> None:
+        """Remove an entry and release its embedding slot."""
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        if entry.slot is not None:
+            self._slot_keys[entry.slot] = None
+            self._slot_partitions[entry.slot] = -1
+            self._free_slots.append(entry.slot)
+
+    @staticmethod
+    def _unit(embedding: list[float]) -> np.ndarray:
+        """Return the embedding scaled to unit norm, as float32."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
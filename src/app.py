@@ -1,26 +1,120 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import logging
 import os
-from http.client import HTTPException
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Hashable, Literal, Tuple
 
-import requests
+import httpx
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_groq import ChatGroq
+from langchain_core.runnables import Runnable
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from data.metrics import REQUEST_ID_HEADER, ServiceMetrics, request_id_var
+from data.retrieval_cache import LRUCache, normalize_query
+from src.answer_cache import AnswerCache, CachedAnswer
+from src.context import assemble_context
+from src.llm_backends import BACKENDS, build_chat_model
+from src.llm_registry import AdmissionError, ModelRegistry, parse_limits
+from src.reranker import CrossEncoderReranker
+from src.single_flight import SingleFlight
+from src.upstream import Upstream, UpstreamUnavailable
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Retrieve the DB from the configuration
 DB_URL = os.getenv("DB_URL", "http://localhost:8000")
-SEARCH_URL = DB_URL + "/similarity_search"
-FEEDBACK_URL = DB_URL + "/write_feedback"
-WRITE_URL = DB_URL + "/insert_query"
+SEARCH_PATH = "/similarity_search"
+FEEDBACK_PATH = "/write_feedback"
+WRITE_PATH = "/insert_query"
+EMBED_PATH = "/embed"
+
+# Calls to the data service are retried with jitter, skip replicas whose
+# circuit is open and, for reads, are hedged on a second replica
+# (DB_REPLICA_URLS) once slower than the p95 of recent calls
+data_service = Upstream(
+    [DB_URL, *(url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",")
+               if url.strip())],
+    retries=int(os.getenv("DB_RETRIES", "2")),
+    backoff=float(os.getenv("DB_RETRY_BACKOFF_MS", "50")) / 1000,
+    failure_threshold=int(os.getenv("DB_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("DB_BREAKER_RESET_MS", "10000")) / 1000,
+    hedge_quantile=float(os.getenv("DB_HEDGE_QUANTILE", "0.95")),
+)
+# Timeout of each attempt of a read
+DB_READ_TIMEOUT = float(os.getenv("DB_READ_TIMEOUT_MS", "5000")) / 1000
+
+# Connection pool to the data service, shared by every request
+HTTP_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("DB_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("DB_MAX_KEEPALIVE", "20")),
+    keepalive_expiry=30,
+)
 
+# Answers to identical or near-identical queries are served from memory
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+answer_cache = AnswerCache(
+    similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    version_max_age=float(os.getenv("ANSWER_CACHE_VERSION_MAX_AGE", "5")),
+)
 
-# LLM
-model_name = "llama-3.1-70b-versatile"  #"gemma-7b-it"
+# Identical queries in flight share one lookup, retrieval and generation
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+in_flight: SingleFlight[Tuple[CachedAnswer, bool]] = SingleFlight()
+
+# Stage and request latency histograms, served on /metrics
+metrics = ServiceMetrics("backend")
+
+# Retrieved chunks are merged, deduplicated and packed into this many tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+
+# Optional cross-encoder re-ranking: RERANK_CANDIDATES chunks are retrieved
+# and scored, and the best n_docs kept, unless scoring takes longer than
+# RERANK_TIME_BUDGET_MS, in which case the vector search order is kept
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_TIME_BUDGET = float(os.getenv("RERANK_TIME_BUDGET_MS", "150")) / 1000
+
+
+# LLM: served by Groq, Ollama or a local fake for load tests
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+if LLM_BACKEND not in BACKENDS:
+    msg = f"Unknown LLM_BACKEND {LLM_BACKEND!r}, expected one of {BACKENDS}."
+    raise ValueError(msg)
+model_name = os.getenv("LLM_MODEL", "llama-3.1-70b-versatile")  #"gemma-7b-it"
+
+# Models loaded at startup, generations allowed in flight per model
+# (LLM_CONCURRENCY_LIMITS overrides it as "model=limit,...") and whether to
+# open their connection with a tiny prompt before the first request
+LLM_MODELS = [name.strip() for name in os.getenv("LLM_MODELS", model_name).split(",")
+              if name.strip()]
+# Only these models may be asked for, as each one keeps a chain and a queue
+SERVED_MODELS = frozenset({*LLM_MODELS, model_name})
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_CONCURRENCY_LIMITS = parse_limits(os.getenv("LLM_CONCURRENCY_LIMITS", ""))
+LLM_WARMUP = os.getenv("LLM_WARMUP", "false").lower() == "true"
+# Requests waiting for a generation slot, per model, and for how long at most
+# before they are refused with a Retry-After
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT_MS", "10000")) / 1000
+# When each query was last answered: a question asked again within
+# REASK_WINDOW seconds is queued as a re-ask, whatever lane the client claims
+REASK_WINDOW = float(os.getenv("REASK_WINDOW", "600"))
+answered_at = LRUCache(max_size=int(os.getenv("REASK_MAX_ENTRIES", "4096")))
 
 # Chatbot design : Prompt
 prompt = ChatPromptTemplate.from_template(
@@ -32,84 +126,452 @@ prompt = ChatPromptTemplate.from_template(
 Question: {input}""",
 )
 
+
+async def propagate_request_id(request: httpx.Request) -> None:
+    """Forward the id of the request being served to the data service."""
+    request_id = request_id_var.get()
+    if request_id is not None:
+        request.headers[REQUEST_ID_HEADER] = request_id
+
+
+async def load_reranker() -> CrossEncoderReranker | None:
+    """Load the cross-encoder, or return None if it cannot be loaded."""
+    reranker = CrossEncoderReranker(
+        model_name=os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+        batch_size=int(os.getenv("RERANK_BATCH_SIZE", "16")),
+        max_length=int(os.getenv("RERANK_MAX_LENGTH", "256")),
+        threads=int(os.getenv("RERANK_THREADS", "1")),
+    )
+    try:
+        await asyncio.to_thread(reranker.load)
+    except Exception:
+        logger.exception("Failed to load the cross-encoder: searches keep the "
+                         "vector order")
+        return None
+    return reranker
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Open the pooled HTTP client and load the LLM chains for the app lifetime."""
+    app.state.http_client = httpx.AsyncClient(
+        limits=HTTP_LIMITS, timeout=20,
+        event_hooks={"request": [propagate_request_id]})
+    app.state.models = ModelRegistry(build_chain, max_concurrency=LLM_MAX_CONCURRENCY,
+                                     limits=LLM_CONCURRENCY_LIMITS,
+                                     max_queue=LLM_MAX_QUEUE,
+                                     queue_timeout=LLM_QUEUE_TIMEOUT, metrics=metrics)
+    await app.state.models.warm_up(LLM_MODELS, ping=LLM_WARMUP)
+    app.state.reranker = await load_reranker() if RERANK_ENABLED else None
+    yield
+    await app.state.http_client.aclose()
+
+
 # Define FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+metrics.install(app)
+
+
+@app.exception_handler(UpstreamUnavailable)
+async def report_unavailable_upstream(_request: Request, error: UpstreamUnavailable,
+                                      ) -> JSONResponse:
+    """Report a data service that cannot be reached, telling when to retry."""
+    logger.warning("Data service unavailable: %s", error)
+    return JSONResponse(status_code=503, content={"detail": str(error)},
+                        headers={"Retry-After": str(error.retry_after)})
+
+
+@app.exception_handler(AdmissionError)
+async def reject_generation(_request: Request, error: AdmissionError,
+                            ) -> JSONResponse:
+    """Refuse a query the LLM cannot take in time, telling when to retry."""
+    return JSONResponse(status_code=error.status_code,
+                        content={"detail": str(error)},
+                        headers={"Retry-After": str(error.retry_after)})
+
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """Return the shared HTTP client opened in the app lifespan."""
+    return request.app.state.http_client
+
+
+def get_models(request: Request) -> ModelRegistry:
+    """Return the registry of LLM chains loaded in the app lifespan."""
+    return request.app.state.models
+
+
+def get_reranker(request: Request) -> CrossEncoderReranker | None:
+    """Return the cross-encoder loaded in the app lifespan, if enabled."""
+    return getattr(request.app.state, "reranker", None)
+
 
 class QueryRequest(BaseModel):
-    """Represent a query request."""
+    """Represent a query request.
+
+    ``lane`` sets the priority of the generation when the LLM is busy: new
+    questions ("interactive") go before questions asked again ("reask"),
+    which go before background jobs ("batch"). A question answered lately
+    is queued as a re-ask even if sent as "interactive".
+    """
 
     query: str
+    lane: Literal["interactive", "reask", "batch"] = "interactive"
 
 class QueryResponse(BaseModel):
     """Represent a query response."""
 
     answer: str
     documents: list[str]
+    interaction_id: str
+    cached: bool = False
+    sources: list[dict] = []
+    coalesced: bool = False
 
 class FeedbackRequest(BaseModel):
-    """Represent a feedback request."""
+    """Represent a feedback request on a previous interaction."""
 
-    query: str
+    interaction_id: str
     feedback: str
 
 
-@app.post("/query", response_model=QueryResponse)
-def query_llm(request: QueryRequest, model_name : str = model_name,
-              n_docs: int = 3) -> QueryResponse:
-    """Query the LLM model with the given request and return the response.
+async def log_interaction(client: httpx.AsyncClient, payload: dict) -> None:
+    """Send a query record to the insert_query endpoint.
+
+    Runs after the response has been sent, so failures are only logged.
+    """
+    try:
+        with metrics.stage("db_write"):
+            response = await data_service.post(client, WRITE_PATH, payload, timeout=5)
+        response.raise_for_status()
+    except (httpx.HTTPError, UpstreamUnavailable):
+        logger.exception("Failed to insert query result.")
+
+
+def build_chain(model_name: str) -> Runnable:
+    """Build the prompt and model chain for the given LLM.
+
+    Called once per model by the registry: the chain and its client are then
+    reused by every request.
+    """
+    # Chatbot design : Document retrieval (out of chain) + prompt + model
+    chat = build_chat_model(LLM_BACKEND, model_name)
+    return prompt | chat
+
+
+async def stream_answer(chain: Runnable, inputs: dict) -> AsyncIterator[str]:
+    """Stream the tokens of an answer, timing the first one and the whole."""
+    start = time.perf_counter()
+    first_token = True
+    async for chunk in chain.astream(inputs):
+        if first_token:
+            metrics.observe("llm_first_token", time.perf_counter() - start)
+            first_token = False
+        yield chunk.content
+    metrics.observe("llm_generation", time.perf_counter() - start)
+
+
+async def lookup_answer(client: httpx.AsyncClient, query: str,
+                        partition: Hashable,
+                        ) -> Tuple[CachedAnswer | None, list[float] | None]:
+    """Look the query up in the answer cache.
 
     Args:
     ----
-        request (QueryRequest): The query request.
-        model_name (str): The name of the LLM model.
+        client (httpx.AsyncClient): The pooled client to the data service.
+        query (str): The user query.
+        partition (Hashable): The cache partition (model and number of docs).
+
+    Returns:
+    -------
+        Tuple[CachedAnswer | None, list[float] | None]: The cached answer if
+        any, and the query embedding if it had to be computed.
+
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None, None
+    answer = answer_cache.get(partition, query)
+    if answer is not None:
+        return answer, None
+
+    # Embed the query once: used for the semantic lookup and the search
+    with metrics.stage("embed"):
+        response = await data_service.post(client, EMBED_PATH, {"query": query},
+                                           timeout=DB_READ_TIMEOUT, idempotent=True, hedge=True)
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code,
+                            detail="Failed to embed the query.")
+    embed_result = response.json()
+    embedding = embed_result["embedding"]
+    answer_cache.observe_version(embed_result["collection_version"])
+    # An exact hit may only have been refused for want of a recent version
+    answer = answer_cache.get(partition, query) \
+        or answer_cache.get_similar(partition, embedding)
+    return answer, embedding
+
+
+async def rerank_documents(reranker: CrossEncoderReranker, query: str,
+                           documents: list[str], metadatas: list[dict], n_docs: int,
+                           ) -> Tuple[list[str], list[dict]]:
+    """Keep the n_docs documents the cross-encoder finds the most relevant.
+
+    Scoring runs in a worker thread. If it fails or its time budget runs out,
+    the first n_docs documents of the vector search are kept.
+    """
+    with metrics.stage("rerank"):
+        try:
+            order = await asyncio.to_thread(reranker.rerank, query, documents,
+                                            n_docs, RERANK_TIME_BUDGET)
+            if order is None:
+                logger.warning("Re-ranking of %d documents exceeded %.0f ms, "
+                               "keeping the vector order", len(documents),
+                               RERANK_TIME_BUDGET * 1000)
+        except Exception:
+            logger.exception("Re-ranking failed, keeping the vector order")
+            order = None
+    if order is None:
+        order = list(range(min(n_docs, len(documents))))
+    return ([documents[i] for i in order],
+            [metadatas[i] for i in order] if metadatas else [])
+
+
+async def retrieve_documents(client: httpx.AsyncClient, query: str, n_docs: int,
+                             embedding: list[float] | None = None,
+                             reranker: CrossEncoderReranker | None = None,
+                             ) -> Tuple[list[str], str, list[dict]]:
+    """Retrieve the documents for a query and assemble them into the context.
+
+    With a reranker, ``RERANK_CANDIDATES`` documents are retrieved and the
+    n_docs best kept. Adjacent chunks of a source are then merged,
+    near-duplicates dropped and the rest packed into ``CONTEXT_TOKEN_BUDGET``
+    tokens, most relevant first.
+
+    Args:
+    ----
+        client (httpx.AsyncClient): The pooled client to the data service.
+        query (str): The user query.
         n_docs (int): The number of documents to retrieve.
+        embedding (list[float] | None): The query embedding, if already known.
+        reranker (CrossEncoderReranker | None): Re-orders the retrieved
+        documents, if enabled.
 
     Returns:
     -------
-        QueryResponse: The query response containing the answer and documents.
+        Tuple[list[str], str, list[dict]]: The passages sent to the LLM, the
+        context built from them and their metadata (source, title, chunk
+        index, offsets).
 
     """
     # Make a request to the similarity_search endpoint
-    response = requests.post(
-        SEARCH_URL,
-        json={"query": request.query, "n_docs": n_docs},
-        timeout=20,
-    )
+    with metrics.stage("retrieval"):
+        response = await data_service.post(
+            client, SEARCH_PATH,
+            {"query": query, "embedding": embedding,
+             "n_docs": max(n_docs, RERANK_CANDIDATES) if reranker else n_docs},
+            timeout=DB_READ_TIMEOUT, idempotent=True, hedge=True,
+        )
     if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail="""Failed
-                            to perform similarity search.""")
+        raise HTTPException(status_code=response.status_code,
+                            detail="Failed to perform similarity search.")
 
     similarity_search_result = response.json()
+    if ANSWER_CACHE_ENABLED:
+        answer_cache.observe_version(similarity_search_result["collection_version"])
     documents = similarity_search_result["documents"]
-    context = similarity_search_result["context"]
+    metadatas = similarity_search_result.get("metadatas", [])
+    if reranker is not None and len(documents) > n_docs:
+        documents, metadatas = await rerank_documents(reranker, query, documents,
+                                                      metadatas, n_docs)
+    with metrics.stage("context_assembly"):
+        passages = assemble_context(documents, metadatas,
+                                    token_budget=CONTEXT_TOKEN_BUDGET,
+                                    dedup_threshold=CONTEXT_DEDUP_THRESHOLD)
+    documents = [passage.text for passage in passages]
+    return (documents, "\n\n\n".join(documents),
+            [passage.metadata for passage in passages])
+
+
+def admission_lane(partition: Hashable, query: str, lane: str) -> str:
+    """Return the lane of a generation, downgrading re-asked "interactive" ones."""
+    last_answer = answered_at.get((partition, normalize_query(query)))
+    if lane == "interactive" and last_answer is not None \
+            and time.monotonic() - last_answer <= REASK_WINDOW:
+        return "reask"
+    return lane
+
+
+def check_model(name: str) -> None:
+    """Refuse a model that is not served, before it gets a chain or a queue."""
+    if name not in SERVED_MODELS:
+        raise HTTPException(status_code=404,
+                            detail=f"Unknown model {name!r}, expected one of "
+                                   f"{sorted(SERVED_MODELS)}.")
 
-    # Chatbot design : Document retrieval (out of chain) + prompt + model
-    chat = ChatGroq(model=model_name)
-    chain = prompt | chat
 
-    generation = chain.invoke({"input": request.query, "context": context})
+@app.post("/query", response_model=QueryResponse)
+async def query_llm(request: QueryRequest, background_tasks: BackgroundTasks,
+                    model_name : str = model_name, n_docs: int = 3,
+                    client: httpx.AsyncClient = Depends(get_http_client),  # noqa: B008
+                    models: ModelRegistry = Depends(get_models),  # noqa: B008
+                    reranker: CrossEncoderReranker | None = Depends(get_reranker),  # noqa: B008
+                    ) -> QueryResponse:
+    """Query the LLM model with the given request and return the response.
+
+    Args:
+    ----
+        request (QueryRequest): The query request.
+        background_tasks (BackgroundTasks): Tasks run after the response.
+        model_name (str): The name of the LLM model.
+        n_docs (int): The number of documents to retrieve.
+        client (httpx.AsyncClient): The pooled client to the data service.
+        models (ModelRegistry): The long-lived LLM chains.
+        reranker (CrossEncoderReranker | None): The cross-encoder, if enabled.
+
+    Returns:
+    -------
+        QueryResponse: The query response containing the answer, documents,
+        the interaction id to send feedback on, whether the answer was
+        served from the answer cache and whether it was shared with an
+        identical query in flight.
 
-    # Make a request to the insert_query endpoint
-    insert_response = requests.post(
-        WRITE_URL,
-        json={"query": request.query, "answer": generation.content,
-              "documents": documents},
-        timeout=5,
+    """
+    check_model(model_name)
+    partition = (model_name, n_docs)
+
+    async def answer_query() -> Tuple[CachedAnswer, bool]:
+        answer, embedding = await lookup_answer(client, request.query, partition)
+        if answer is not None:
+            return answer, True
+        documents, context, sources = await retrieve_documents(
+            client, request.query, n_docs, embedding, reranker)
+        lane = admission_lane(partition, request.query, request.lane)
+        async with models.acquire(model_name, lane) as chain:
+            tokens = [token async for token in stream_answer(
+                chain, {"input": request.query, "context": context})]
+        answered_at.put((partition, normalize_query(request.query)),
+                        time.monotonic())
+        answer = CachedAnswer(answer="".join(tokens), documents=documents,
+                              sources=sources)
+        if ANSWER_CACHE_ENABLED:
+            answer_cache.put(partition, request.query, answer, embedding)
+        return answer, False
+
+    if COALESCE_ENABLED:
+        (answer, from_cache), coalesced = await in_flight.do(
+            (partition, normalize_query(request.query)), answer_query)
+    else:
+        (answer, from_cache), coalesced = await answer_query(), False
+
+    # Log the interaction once the answer has been sent, once per caller
+    interaction_id = uuid.uuid4().hex
+    background_tasks.add_task(
+        log_interaction, client,
+        {"interaction_id": interaction_id, "query": request.query,
+         "answer": answer.answer, "documents": answer.documents},
     )
 
-    if insert_response.status_code != 200:
-        raise HTTPException(status_code=insert_response.status_code,
-                            detail="Failed to insert query result.")
+    return QueryResponse(answer=answer.answer, documents=answer.documents,
+                         interaction_id=interaction_id, cached=from_cache,
+                         sources=answer.sources, coalesced=coalesced)
+
+
+def ndjson_event(event_type: str, **fields: Any) -> str:  # noqa: ANN401
+    """Serialize a streaming event as one line of newline-delimited JSON."""
+    return json.dumps({"type": event_type, **fields}) + "\n"
+
+
+@app.post("/query/stream")
+async def query_llm_stream(request: QueryRequest, model_name : str = model_name,
+                           n_docs: int = 3,
+                           client: httpx.AsyncClient = Depends(get_http_client),  # noqa: B008
+                           models: ModelRegistry = Depends(get_models),  # noqa: B008
+                           reranker: CrossEncoderReranker | None = Depends(get_reranker),  # noqa: B008
+                           ) -> StreamingResponse:
+    """Query the LLM model and stream the response as newline-delimited JSON.
+
+    The stream starts with a ``documents`` event (documents and their metadata,
+    interaction id and whether the answer comes from the cache), followed by ``token`` events as
+    the LLM generates them and a final ``done`` event. Retrieval and admission
+    happen before the stream starts, so their failures are still reported as
+    HTTP errors.
+
+    Args:
+    ----
+        request (QueryRequest): The query request.
+        model_name (str): The name of the LLM model.
+        n_docs (int): The number of documents to retrieve.
+        client (httpx.AsyncClient): The pooled client to the data service.
+        models (ModelRegistry): The long-lived LLM chains.
+        reranker (CrossEncoderReranker | None): The cross-encoder, if enabled.
+
+    Returns:
+    -------
+        StreamingResponse: The stream of events.
+
+    """
+    check_model(model_name)
+    partition = (model_name, n_docs)
+    answer, embedding = await lookup_answer(client, request.query, partition)
+    if answer is not None:
+        documents, context, sources = answer.documents, None, answer.sources
+    else:
+        documents, context, sources = await retrieve_documents(
+            client, request.query, n_docs, embedding, reranker)
+
+    # The generation slot is taken before the stream starts, so that a
+    # refusal is still reported with its status code and Retry-After
+    slot = AsyncExitStack()
+    if answer is None:
+        chain = await slot.enter_async_context(models.acquire(
+            model_name, admission_lane(partition, request.query, request.lane)))
+
+    interaction_id = uuid.uuid4().hex
+    record = {"interaction_id": interaction_id, "query": request.query,
+              "documents": documents}
+
+    async def events() -> AsyncIterator[str]:
+        yield ndjson_event("documents", documents=documents, sources=sources,
+                           interaction_id=interaction_id,
+                           cached=answer is not None)
+        if answer is not None:
+            record["answer"] = answer.answer
+            yield ndjson_event("token", content=answer.answer)
+        else:
+            tokens = []
+            async with slot:
+                async for token in stream_answer(chain, {"input": request.query,
+                                                         "context": context}):
+                    tokens.append(token)
+                    yield ndjson_event("token", content=token)
+            record["answer"] = "".join(tokens)
+            answered_at.put((partition, normalize_query(request.query)),
+                            time.monotonic())
+            if ANSWER_CACHE_ENABLED:
+                answer_cache.put(partition, request.query,
+                                 CachedAnswer(record["answer"], documents, sources),
+                                 embedding)
+        yield ndjson_event("done")
+
+    async def log_streamed_interaction() -> None:
+        # Frees the slot if the client went away before the stream started
+        await slot.aclose()
+        # The answer is missing if the client went away mid-generation
+        if "answer" in record:
+            await log_interaction(client, record)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson",
+                             background=BackgroundTask(log_streamed_interaction))
 
-    return QueryResponse(answer=generation.content, documents=documents)
 
 @app.post("/feedback")
-def submit_feedback(request: FeedbackRequest) -> dict:
+async def submit_feedback(request: FeedbackRequest,
+                          client: httpx.AsyncClient = Depends(get_http_client),  # noqa: B008
+                          ) -> dict:
     """Submit feedback for a query.
 
     Args:
     ----
         request (FeedbackRequest): The feedback request.
+        client (httpx.AsyncClient): The pooled client to the data service.
 
     Returns:
     -------
@@ -117,9 +579,9 @@ def submit_feedback(request: FeedbackRequest) -> dict:
 
     """
     # Make a request to the write_feedback endpoint
-    response = requests.post(
-        FEEDBACK_URL,
-        json={"query": request.query, "feedback": request.feedback},
+    response = await data_service.post(
+        client, FEEDBACK_PATH,
+        {"interaction_id": request.interaction_id, "feedback": request.feedback},
         timeout=10,
     )
 
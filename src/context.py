@@ -0,0 +1,191 @@
+"""Module assembling the retrieved chunks into the context sent to the LLM."""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Sequence
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def approximate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text, about 4 characters each."""
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class Passage:
+    """Represent consecutive chunks of one source, merged into one text."""
+
+    text: str
+    metadata: dict
+    rank: int
+    chunk_indices: list[int] = field(default_factory=list)
+
+
+def _overlap_length(previous: str, text: str, max_overlap: int = 500) -> int:
+    """Return the length of the longest suffix of previous that starts text."""
+    for size in range(min(len(previous), len(text), max_overlap), 0, -1):
+        if previous.endswith(text[:size]):
+            return size
+    return 0
+
+
+def _append_chunk(passage: Passage, text: str, metadata: dict) -> None:
+    """Append the next chunk of the same source to a passage, once."""
+    start, end = metadata.get("start_byte"), passage.metadata.get("end_byte")
+    if start is not None and end is not None:
+        # Byte offsets tell exactly how much of the chunk is already there
+        if start < end:
+            text = text.encode("utf-8")[end - start:].decode("utf-8", "ignore")
+            passage.text += text
+        else:
+            passage.text += "\n" + text
+    else:
+        passage.text += text[_overlap_length(passage.text, text):]
+    passage.metadata["end_byte"] = metadata.get("end_byte")
+
+
+def merge_adjacent_chunks(documents: Sequence[str],
+                          metadatas: Sequence[dict]) -> list[Passage]:
+    """Merge the chunks that follow each other in the same source.
+
+    Chunks overlap their neighbours (see ``split_into_chunks``): the overlap
+    is only kept once. A passage keeps the best rank of its chunks.
+
+    Args:
+    ----
+        documents (Sequence[str]): The chunks, most relevant first.
+        metadatas (Sequence[dict]): Their metadata (source, chunk index and
+        byte offsets). Chunks without source or index are kept as they are.
+
+    Returns:
+    -------
+        list[Passage]: The passages, most relevant first.
+
+    """
+    passages = []
+    by_source: dict[str, list[tuple[int, int, str, dict]]] = {}
+    for rank, text in enumerate(documents):
+        metadata = dict(metadatas[rank]) if rank < len(metadatas) else {}
+        if metadata.get("source") is None or metadata.get("chunk_index") is None:
+            passages.append(Passage(text=text, metadata=metadata, rank=rank))
+            continue
+        by_source.setdefault(metadata["source"], []).append(
+            (metadata["chunk_index"], rank, text, metadata))
+
+    for chunks in by_source.values():
+        passage = None
+        for index, rank, text, metadata in sorted(chunks, key=lambda c: c[:2]):
+            if passage is not None and index == passage.chunk_indices[-1]:
+                passage.rank = min(passage.rank, rank)  # Same chunk twice
+                continue
+            if passage is not None and index == passage.chunk_indices[-1] + 1:
+                _append_chunk(passage, text, metadata)
+                passage.chunk_indices.append(index)
+                passage.rank = min(passage.rank, rank)
+                continue
+            passage = Passage(text=text, metadata=metadata, rank=rank,
+                              chunk_indices=[index])
+            passages.append(passage)
+
+    passages.sort(key=lambda passage: passage.rank)
+    for passage in passages:
+        if len(passage.chunk_indices) > 1:
+            passage.metadata["chunk_indices"] = passage.chunk_indices
+    return passages
+
+
+def _shingles(text: str, size: int = 3) -> set[tuple[str, ...]]:
+    """Return the set of word n-grams of a text."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def drop_near_duplicates(passages: Sequence[Passage],
+                         threshold: float = 0.8) -> list[Passage]:
+    """Drop the passages mostly contained in a more relevant one.
+
+    Containment is the share of the smaller passage's word 3-grams found in
+    the other, so a chunk repeated inside a longer passage is caught as well
+    as a copy of the same text under another source.
+    """
+    kept: list[tuple[Passage, set]] = []
+    for passage in passages:
+        shingles = _shingles(passage.text)
+        if not any(
+            len(shingles & other) >= threshold * min(len(shingles), len(other))
+            for _, other in kept
+            if shingles and other
+        ):
+            kept.append((passage, shingles))
+    return [passage for passage, _ in kept]
+
+
+def pack_passages(passages: Sequence[Passage], token_budget: int,
+                  count_tokens: Callable[[str], int] = approximate_tokens,
+                  min_tokens: int = 50) -> list[Passage]:
+    """Keep the most relevant passages that fit in the token budget.
+
+    Passages too long for the remaining budget are cut after the last word
+    that fits if at least ``min_tokens`` remain, and skipped otherwise, or
+    when not even their first word fits, so that a shorter, less relevant
+    passage can still fit.
+    """
+    packed = []
+    remaining = token_budget
+    for passage in passages:
+        tokens = count_tokens(passage.text)
+        if tokens <= remaining:
+            packed.append(passage)
+            remaining -= tokens
+            continue
+        if remaining < min_tokens:
+            continue
+        # Longest word prefix that fits: the count grows with the prefix
+        words = passage.text.split(" ")
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(" ".join(words[:middle])) <= remaining:
+                low = middle
+            else:
+                high = middle - 1
+        text = " ".join(words[:low])
+        # Not even its first word fits
+        if not text or count_tokens(text) > remaining:
+            continue
+        packed.append(Passage(text=text, metadata={**passage.metadata,
+                                                   "truncated": True},
+                              rank=passage.rank,
+                              chunk_indices=passage.chunk_indices))
+        remaining -= count_tokens(text)
+    return packed
+
+
+def assemble_context(documents: Sequence[str], metadatas: Sequence[dict],
+                     token_budget: int, dedup_threshold: float = 0.8,
+                     count_tokens: Callable[[str], int] = approximate_tokens,
+                     ) -> list[Passage]:
+    """Turn retrieved chunks into the passages of the LLM context.
+
+    Args:
+    ----
+        documents (Sequence[str]): The chunks, most relevant first.
+        metadatas (Sequence[dict]): Their metadata.
+        token_budget (int): Maximum number of context tokens.
+        dedup_threshold (float): Containment above which a passage is a
+        near-duplicate of a more relevant one.
+        count_tokens (Callable[[str], int]): Counts the tokens of a text.
+
+    Returns:
+    -------
+        list[Passage]: The passages to send, most relevant first.
+
+    """
+    passages = merge_adjacent_chunks(documents, metadatas)
+    passages = drop_near_duplicates(passages, threshold=dedup_threshold)
+    return pack_passages(passages, token_budget, count_tokens=count_tokens)
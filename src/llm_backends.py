@@ -0,0 +1,120 @@
+"""Module providing the chat models the backend can be configured with."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Iterator
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+BACKENDS = ("groq", "ollama", "fake")
+
+
+class LocalFakeChatModel(BaseChatModel):
+    """Deterministic chat model streaming tokens at a configurable pace.
+
+    It stands in for the LLM provider in load tests: the answer is made of
+    the words of the prompt, one token after ``first_token_latency`` seconds
+    and the next ones every ``token_latency`` seconds, so the time spent
+    outside the model can be measured without network access.
+    """
+
+    answer_tokens: int = 64
+    first_token_latency: float = 0.2
+    token_latency: float = 0.02
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-fake"
+
+    def _tokens(self, messages: list[BaseMessage]) -> list[str]:
+        """Return the tokens of the answer to the given messages."""
+        words = str(messages[-1].content).split() or ["ok"]
+        return [(" " if i else "") + words[i % len(words)]
+                for i in range(self.answer_tokens)]
+
+    def _delay(self, index: int) -> float:
+        """Return the time taken to generate the token at this index."""
+        return self.first_token_latency if index == 0 else self.token_latency
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                  run_manager: CallbackManagerForLLMRun | None = None,
+                  **kwargs: Any,  # noqa: ANN401
+                  ) -> ChatResult:
+        content = "".join(chunk.message.content for chunk in
+                          self._stream(messages, stop, run_manager, **kwargs))
+        return ChatResult(generations=[ChatGeneration(
+            message=AIMessage(content=content))])
+
+    async def _agenerate(self, messages: list[BaseMessage],
+                         stop: list[str] | None = None,
+                         run_manager: AsyncCallbackManagerForLLMRun | None = None,
+                         **kwargs: Any,  # noqa: ANN401
+                         ) -> ChatResult:
+        tokens = [chunk.message.content async for chunk in
+                  self._astream(messages, stop, run_manager, **kwargs)]
+        return ChatResult(generations=[ChatGeneration(
+            message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                run_manager: CallbackManagerForLLMRun | None = None,
+                **kwargs: Any,  # noqa: ANN401, ARG002
+                ) -> Iterator[ChatGenerationChunk]:
+        for index, token in enumerate(self._tokens(messages)):
+            time.sleep(self._delay(index))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: list[BaseMessage],
+                       stop: list[str] | None = None,
+                       run_manager: AsyncCallbackManagerForLLMRun | None = None,
+                       **kwargs: Any,  # noqa: ANN401, ARG002
+                       ) -> AsyncIterator[ChatGenerationChunk]:
+        for index, token in enumerate(self._tokens(messages)):
+            await asyncio.sleep(self._delay(index))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def build_chat_model(backend: str, model_name: str) -> BaseChatModel:
+    """Build the chat model of the given backend.
+
+    Args:
+    ----
+        backend (str): "groq" (needs GROQ_API_KEY), "ollama" (served at
+        OLLAMA_HOST) or "fake", whose pace is set by FAKE_LLM_TOKENS,
+        FAKE_LLM_FIRST_TOKEN_MS and FAKE_LLM_TOKEN_MS.
+        model_name (str): The name of the model, ignored by the fake.
+
+    Returns:
+    -------
+        BaseChatModel: The chat model.
+
+    """
+    if backend == "groq":
+        from langchain_groq import ChatGroq
+        return ChatGroq(model=model_name)
+    if backend == "ollama":
+        from langchain_community.chat_models import ChatOllama
+        return ChatOllama(model=model_name, temperature=0,
+                          base_url=os.getenv("OLLAMA_HOST", "http://localhost:11434"))
+    if backend == "fake":
+        return LocalFakeChatModel(
+            answer_tokens=int(os.getenv("FAKE_LLM_TOKENS", "64")),
+            first_token_latency=float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "200")) / 1000,
+            token_latency=float(os.getenv("FAKE_LLM_TOKEN_MS", "20")) / 1000,
+        )
+    msg = f"Unknown LLM backend {backend!r}, expected one of {BACKENDS}."
+    raise ValueError(msg)
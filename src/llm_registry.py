@@ -0,0 +1,238 @@
+"""Module providing the registry of long-lived LLM chains."""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterable
+
+from langchain_core.runnables import Runnable
+
+if TYPE_CHECKING:
+    from data.metrics import ServiceMetrics
+
+logger = logging.getLogger(__name__)
+
+
+def parse_limits(value: str) -> dict[str, int]:
+    """Parse per-model concurrency limits written as "model=limit,model=limit"."""
+    limits = {}
+    for item in value.split(","):
+        if item.strip():
+            name, limit = item.rsplit("=", 1)
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+# Lanes of the generation queues, highest priority first: a new question
+# goes before a question asked again, which goes before background jobs
+LANES = ("interactive", "reask", "batch")
+
+
+class AdmissionError(Exception):
+    """Raised when a generation is refused to keep the others' latency.
+
+    ``status_code`` is 429 when the queue is full and 503 when the request
+    waited longer than the queue deadline; ``retry_after`` estimates, in
+    seconds, when a slot should be free.
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int) -> None:
+        """Initialize the error."""
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _ModelQueue:
+    """Generation slots of one model and the requests waiting for one."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.in_flight = 0
+        # Heap of (lane priority, arrival order, future set on admission)
+        self.waiting: list[tuple[int, int, asyncio.Future]] = []
+        # Moving average of the time a generation holds its slot
+        self.hold_seconds = 1.0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def retry_after(self) -> int:
+        """Estimate the seconds until the queue has room again."""
+        return max(1, math.ceil(self.hold_seconds * (len(self.waiting) + 1)
+                                / self.limit))
+
+
+class ModelRegistry:
+    """Hold one chain per model, built once and shared by every request.
+
+    The chains keep their client, and with it the connection pool to the LLM
+    provider, for the app lifetime. Each model also has a cap on the
+    generations in flight. Requests above it wait in a bounded queue, served
+    by lane priority then arrival order. When the queue is full, a request
+    takes the place of the last waiter of a lower lane, which is refused,
+    or is refused at once, lower lanes being shed first; requests are also
+    refused after the queue deadline if no slot freed up: failing fast keeps
+    the latency of the accepted requests predictable.
+    """
+
+    def __init__(self, factory: Callable[[str], Runnable], max_concurrency: int = 16,
+                 limits: dict[str, int] | None = None, max_queue: int = 64,
+                 queue_timeout: float = 10.0,
+                 lane_shares: dict[str, float] | None = None,
+                 metrics: ServiceMetrics | None = None) -> None:
+        """Initialize the registry.
+
+        Args:
+        ----
+            factory (Callable[[str], Runnable]): Builds the chain of a model.
+            max_concurrency (int): Default maximum number of concurrent
+            generations per model.
+            limits (dict[str, int] | None): Per-model overrides of the limit.
+            max_queue (int): Maximum number of requests waiting per model.
+            queue_timeout (float): Maximum seconds a request waits for a slot.
+            lane_shares (dict[str, float] | None): Share of the queue each
+            lane may fill, all of it for the interactive lane by default, half
+            for re-asks and a quarter for batch jobs.
+            metrics (ServiceMetrics | None): Records the time spent queuing.
+
+        """
+        self.factory = factory
+        self.max_concurrency = max_concurrency
+        self.limits = limits or {}
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.lane_shares = lane_shares or {"interactive": 1.0, "reask": 0.5,
+                                           "batch": 0.25}
+        self.metrics = metrics
+        self._chains: dict[str, Runnable] = {}
+        self._queues: dict[str, _ModelQueue] = {}
+        self._arrivals = itertools.count()
+        self._lock = threading.Lock()
+
+    def __contains__(self, model_name: str) -> bool:
+        """Whether the chain of this model was already built."""
+        return model_name in self._chains
+
+    def get(self, model_name: str) -> Runnable:
+        """Return the chain of a model, building it on first use."""
+        chain = self._chains.get(model_name)
+        if chain is None:
+            with self._lock:
+                chain = self._chains.get(model_name)
+                if chain is None:
+                    chain = self._chains[model_name] = self.factory(model_name)
+                    self._queues[model_name] = _ModelQueue(
+                        self.limits.get(model_name, self.max_concurrency))
+        return chain
+
+    @asynccontextmanager
+    async def acquire(self, model_name: str, lane: str = "interactive",
+                      ) -> AsyncIterator[Runnable]:
+        """Wait for a generation slot of the model and yield its chain.
+
+        Raises
+        ------
+            AdmissionError: If the queue is full or the deadline passed.
+
+        """
+        chain = self.get(model_name)
+        queue = self._queues[model_name]
+        start = time.perf_counter()
+        await self._admit(model_name, queue, lane)
+        admitted = time.perf_counter()
+        if self.metrics is not None:
+            self.metrics.observe("llm_queue", admitted - start)
+        try:
+            yield chain
+        finally:
+            queue.hold_seconds += 0.2 * (time.perf_counter() - admitted
+                                         - queue.hold_seconds)
+            self._release(queue)
+
+    async def _admit(self, model_name: str, queue: _ModelQueue, lane: str) -> None:
+        """Take a slot of the queue, waiting for one if they are all taken."""
+        if queue.in_flight < queue.limit and not queue.waiting:
+            queue.in_flight += 1
+            return
+        priority = LANES.index(lane)
+        if len(queue.waiting) >= self.max_queue * self.lane_shares.get(lane, 1.0):
+            queue.rejected += 1
+            msg = f"Too many requests waiting for {model_name}."
+            # The last waiter of the lowest lane makes room for a higher lane
+            last = max(queue.waiting, default=None)
+            if last is None or last[0] <= priority:
+                raise AdmissionError(msg, 429, queue.retry_after())
+            self._forget(queue, last)
+            last[2].set_exception(AdmissionError(msg, 429, queue.retry_after()))
+
+        entry = (priority, next(self._arrivals),
+                 asyncio.get_running_loop().create_future())
+        heapq.heappush(queue.waiting, entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(entry[2]), self.queue_timeout)
+        except asyncio.TimeoutError:
+            # The slot may have been handed over, or the request evicted,
+            # right at the deadline
+            if entry[2].done():
+                return entry[2].result()
+            self._forget(queue, entry)
+            queue.timed_out += 1
+            msg = f"No slot of {model_name} freed up in {self.queue_timeout:g} s."
+            raise AdmissionError(msg, 503, queue.retry_after()) from None
+        except asyncio.CancelledError:
+            if not entry[2].done():
+                self._forget(queue, entry)
+            elif entry[2].exception() is None:
+                self._release(queue)
+            raise
+
+    @staticmethod
+    def _forget(queue: _ModelQueue, entry: tuple[int, int, asyncio.Future]) -> None:
+        """Remove a request that gave up from the queue."""
+        queue.waiting.remove(entry)
+        heapq.heapify(queue.waiting)
+
+    @staticmethod
+    def _release(queue: _ModelQueue) -> None:
+        """Hand a slot over to the first request waiting, or free it."""
+        if queue.waiting:
+            _, _, future = heapq.heappop(queue.waiting)
+            future.set_result(None)
+        else:
+            queue.in_flight -= 1
+
+    async def warm_up(self, model_names: Iterable[str], ping: bool = False) -> None:
+        """Build the chains of the given models ahead of the first request.
+
+        Failures are only logged: a model that could not be built is built
+        again on its first request, which then reports the error.
+
+        Args:
+        ----
+            model_names (Iterable[str]): The models to load.
+            ping (bool): Also send each model a tiny prompt, so that the
+            connection to the provider is open before the first request.
+
+        """
+        for model_name in model_names:
+            try:
+                chain = self.get(model_name)
+                if ping:
+                    await chain.ainvoke({"input": "Reply with OK.", "context": ""})
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to warm up %s", model_name)
+
+    def stats(self) -> dict:
+        """Return the limit, generations in flight and queue of each model."""
+        return {model_name: {"in_flight": queue.in_flight, "limit": queue.limit,
+                             "queued": len(queue.waiting),
+                             "rejected": queue.rejected,
+                             "timed_out": queue.timed_out}
+                for model_name, queue in self._queues.items()}
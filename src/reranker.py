@@ -0,0 +1,127 @@
+"""Module providing the cross-encoder re-ranking of retrieved chunks."""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Callable, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Scores (query, passage) pairs: the higher, the more relevant
+Scorer = Callable[[str, Sequence[str]], Sequence[float]]
+
+
+class CrossEncoderReranker:
+    """Re-order search candidates with a small cross-encoder, on CPU.
+
+    Candidates are scored in batches, one inference at a time, so that the
+    CPU cost of a request is bounded by the number of candidates, the batch
+    size, the truncation length and the threads given to torch. A request
+    whose time budget runs out between two batches keeps the order of the
+    vector search.
+    """
+
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                 batch_size: int = 16, max_length: int = 256, threads: int = 1,
+                 scorer: Scorer | None = None) -> None:
+        """Initialize the reranker.
+
+        Args:
+        ----
+            model_name (str): The Hugging Face cross-encoder to load.
+            batch_size (int): The number of pairs scored per inference.
+            max_length (int): Pairs are truncated to this many tokens.
+            threads (int): The number of threads torch may use.
+            scorer (Scorer | None): Scores a batch of passages instead of the
+            model, e.g. in tests.
+
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.threads = threads
+        self.scorer = scorer
+        # Loading and scoring have their own locks: a request never waits on
+        # the model load past its budget, nor blocks others once loaded
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def load(self, timeout: float | None = None) -> bool:
+        """Load the tokenizer and model, unless already loaded.
+
+        Args:
+        ----
+            timeout (float | None): The seconds to wait for a load already
+            started by another thread, forever if None.
+
+        Returns:
+        -------
+            bool: Whether the model is loaded.
+
+        """
+        if self.scorer is not None:
+            return True
+        if not self._load_lock.acquire(timeout=-1 if timeout is None else timeout):
+            return False
+        try:
+            if self.scorer is not None:
+                return True
+            import torch
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+            torch.set_num_threads(self.threads)
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+            model.eval()
+
+            def score(query: str, passages: Sequence[str]) -> list[float]:
+                features = tokenizer([query] * len(passages), list(passages),
+                                     padding=True, truncation=True,
+                                     max_length=self.max_length, return_tensors="pt")
+                with torch.inference_mode():
+                    logits = model(**features).logits
+                return logits[:, 0].tolist()
+
+            self.scorer = score
+            logger.info("Loaded cross-encoder %s", self.model_name)
+            return True
+        finally:
+            self._load_lock.release()
+
+    def rerank(self, query: str, passages: Sequence[str], top_n: int,
+               time_budget: float) -> list[int] | None:
+        """Return the indices of the top_n passages, best first.
+
+        Args:
+        ----
+            query (str): The user query.
+            passages (Sequence[str]): The candidates, in vector search order.
+            top_n (int): The number of passages to keep.
+            time_budget (float): The seconds the scoring may take, waiting
+            for the model included.
+
+        Returns:
+        -------
+            list[int] | None: The indices of the kept passages, or None if
+            the budget ran out before every candidate was scored.
+
+        """
+        deadline = time.perf_counter() + time_budget
+        if not self.load(timeout=max(deadline - time.perf_counter(), 0)):
+            return None
+        scores: list[float] = []
+        # One inference at a time: concurrent ones would share the same cores
+        if not self._lock.acquire(timeout=max(deadline - time.perf_counter(), 0)):
+            return None
+        try:
+            for start in range(0, len(passages), self.batch_size):
+                if time.perf_counter() >= deadline:
+                    return None
+                scores.extend(self.scorer(query,
+                                          passages[start:start + self.batch_size]))
+        finally:
+            self._lock.release()
+        order = sorted(range(len(passages)), key=lambda i: -scores[i])
+        return order[:top_n]
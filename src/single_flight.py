@@ -0,0 +1,63 @@
+"""Module providing the coalescing of identical requests in flight."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """Share one computation between the callers of a key at the same time.
+
+    The first caller of a key starts the computation; the callers arriving
+    while it runs wait for its result, or its error, instead of starting
+    their own. The key is forgotten as soon as the computation ends, so later
+    callers start a new one: caching results is left to the caller.
+
+    The computation runs in its own task, so a caller that goes away does not
+    cancel it for the others.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the registry of computations in flight."""
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        """Return the number of computations in flight."""
+        return len(self._in_flight)
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable[T]],
+                 ) -> tuple[T, bool]:
+        """Return the result of the computation of a key.
+
+        Args:
+        ----
+            key (Hashable): Identifies the computation.
+            compute (Callable[[], Awaitable[T]]): Starts the computation, only
+            called if none is in flight for this key.
+
+        Returns:
+        -------
+            tuple[T, bool]: The result and whether it was shared with a
+            computation started by another caller.
+
+        """
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            self.started += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task), shared
+
+    def stats(self) -> dict:
+        """Return the numbers of computations started, shared and in flight."""
+        return {"started": self.started, "shared": self.shared,
+                "in_flight": len(self._in_flight)}
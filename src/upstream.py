@@ -0,0 +1,307 @@
+"""Module providing resilient calls to the replicas of an upstream service."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Statuses of an overloaded or restarting replica, worth another attempt
+RETRYABLE_STATUSES = (502, 503, 504)
+# Errors raised before a request was sent, the only ones writes retry on
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when no replica of the upstream answered in time.
+
+    ``retry_after`` estimates, in seconds, when one should be back.
+    """
+
+    def __init__(self, message: str, retry_after: int = 1) -> None:
+        """Initialize the error."""
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stop calling a replica after consecutive failures, for a while.
+
+    After ``failure_threshold`` failures in a row the circuit opens and the
+    replica is skipped. Once ``reset_timeout`` seconds have passed, the
+    circuit is half open: a single probe request goes through while the
+    others keep skipping the replica. A success closes the circuit, a
+    failure opens it for another ``reset_timeout``.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0,
+                 ) -> None:
+        """Initialize a closed circuit."""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        """Return "closed", "open" or "half_open"."""
+        if self.opened_at is None:
+            return "closed"
+        return "open" if self.retry_after() > 0 else "half_open"
+
+    def allows(self) -> bool:
+        """Whether requests may be sent to the replica."""
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.probing)
+
+    def acquire(self) -> bool:
+        """Take the right to send a request, the probe one if half open."""
+        if not self.allows():
+            return False
+        self.probing = self.state == "half_open"
+        return True
+
+    def retry_after(self) -> float:
+        """Return the seconds left before the circuit lets requests through."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self) -> None:
+        """Close the circuit."""
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> None:
+        """Count a failure, opening the circuit past the threshold."""
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class LatencyWindow:
+    """Recent latencies of a call, to derive its hedging delay from."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20) -> None:
+        """Initialize an empty window."""
+        self.samples: deque[float] = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float) -> None:
+        """Record the latency of a successful call."""
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> float | None:
+        """Return a quantile of the window, or None without enough samples."""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Upstream:
+    """Call the replicas of a service with retries, breakers and hedging.
+
+    Failed attempts (connection errors, timeouts and 502/503/504 answers)
+    of idempotent requests are retried after a jittered exponential backoff,
+    on the next replica; writes are only retried if they could not connect.
+    Each replica has its own circuit breaker, and replicas with an open
+    circuit are skipped. A hedged call sends the same request to a second
+    replica when the first has not answered after the ``hedge_quantile`` of
+    the recent latencies of this path, and keeps the first good answer.
+
+    The state is shared by every request; the HTTP client is given to each
+    call, so that its connection pool stays the app's.
+    """
+
+    def __init__(self, replicas: list[str], retries: int = 2, backoff: float = 0.05,
+                 max_backoff: float = 1.0, failure_threshold: int = 5,
+                 reset_timeout: float = 10.0, hedge_quantile: float = 0.95,
+                 hedge_delay: float = 0.1) -> None:
+        """Initialize the upstream.
+
+        Args:
+        ----
+            replicas (list[str]): The base URLs of the replicas, the
+            preferred one first.
+            retries (int): Attempts made after the first one fails.
+            backoff (float): Base delay before a retry, in seconds, doubled
+            at each retry.
+            max_backoff (float): Maximum delay before a retry, in seconds.
+            failure_threshold (int): Consecutive failures opening a circuit.
+            reset_timeout (float): Seconds an open circuit skips its replica.
+            hedge_quantile (float): Latency quantile after which a hedged
+            call is sent to a second replica.
+            hedge_delay (float): Hedging delay, in seconds, until enough
+            latencies are known.
+
+        """
+        self.replicas = replicas
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_quantile = hedge_quantile
+        self.hedge_delay = hedge_delay
+        self.breakers = {replica: CircuitBreaker(failure_threshold, reset_timeout)
+                         for replica in replicas}
+        self.latencies: dict[str, LatencyWindow] = {}
+        self.counts = {"retries": 0, "hedges": 0, "hedges_won": 0}
+
+    def _available(self, attempt: int) -> list[str]:
+        """Return the replicas to try, rotated so that retries start elsewhere."""
+        shift = attempt % len(self.replicas)
+        rotated = self.replicas[shift:] + self.replicas[:shift]
+        return [replica for replica in rotated if self.breakers[replica].allows()]
+
+    def _retry_after(self) -> int:
+        """Return the seconds until the first circuit lets requests through."""
+        return max(1, round(min(self.breakers[replica].retry_after()
+                                for replica in self.replicas)))
+
+    async def _send(self, client: httpx.AsyncClient, replica: str, path: str,
+                    payload: dict, timeout: float) -> httpx.Response:
+        """Send one request to a replica, recording its outcome."""
+        breaker = self.breakers[replica]
+        # Another request may have taken the probe since the replica was picked
+        if not breaker.acquire():
+            msg = f"The circuit of {replica} is open."
+            raise httpx.ConnectError(msg)
+        probe = breaker.probing
+        start = time.perf_counter()
+        try:
+            response = await client.post(replica + path, json=payload, timeout=timeout)
+        except httpx.TransportError:
+            self._record_failure(replica)
+            raise
+        except asyncio.CancelledError:
+            # A cancelled probe, e.g. a hedge that lost, lets another one go
+            if probe:
+                breaker.probing = False
+            raise
+        if response.status_code in RETRYABLE_STATUSES:
+            self._record_failure(replica)
+        else:
+            breaker.record_success()
+            self.latencies.setdefault(path, LatencyWindow()).add(
+                time.perf_counter() - start)
+        return response
+
+    def _record_failure(self, replica: str) -> None:
+        """Count a failure of a replica, logging when its circuit opens."""
+        breaker = self.breakers[replica]
+        was_closed = breaker.opened_at is None
+        breaker.record_failure()
+        if was_closed and breaker.opened_at is not None:
+            logger.warning("Circuit of %s opened after %d failures", replica,
+                           breaker.failures)
+
+    async def _hedged(self, client: httpx.AsyncClient, replicas: list[str],
+                      path: str, payload: dict, timeout: float) -> httpx.Response:
+        """Send a request, and again to a second replica if the first is slow."""
+        first = asyncio.ensure_future(self._send(client, replicas[0], path,
+                                                 payload, timeout))
+        window = self.latencies.get(path)
+        delay = window.quantile(self.hedge_quantile) if window else None
+        done, _ = await asyncio.wait({first}, timeout=delay or self.hedge_delay)
+        if done or len(replicas) < 2:  # noqa: PLR2004
+            return await first
+
+        self.counts["hedges"] += 1
+        second = asyncio.ensure_future(self._send(client, replicas[1], path,
+                                                  payload, timeout))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None \
+                            and task.result().status_code not in RETRYABLE_STATUSES:
+                        self.counts["hedges_won"] += task is second
+                        return task.result()
+            # Both failed: report the first one
+            return await first
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def post(self, client: httpx.AsyncClient, path: str, payload: dict,
+                   timeout: float, idempotent: bool = False, hedge: bool = False,
+                   ) -> httpx.Response:
+        """Post a JSON payload to the upstream.
+
+        Args:
+        ----
+            client (httpx.AsyncClient): The pooled HTTP client.
+            path (str): The path of the endpoint.
+            payload (dict): The JSON body.
+            timeout (float): The timeout of each attempt, in seconds.
+            idempotent (bool): Whether the request may be sent again after
+            a timeout or an error answer. Other requests are only retried
+            when they could not connect, as they may have been processed.
+            hedge (bool): Whether a slow attempt may be duplicated on a
+            second replica, for idempotent requests only.
+
+        Returns:
+        -------
+            httpx.Response: The first answer that is not a 502, 503 or 504.
+
+        Raises:
+        ------
+            UpstreamUnavailable: If every attempt failed or every circuit
+            is open.
+
+        """
+        error: Exception | None = None
+        for attempt in range(self.retries + 1):
+            replicas = self._available(attempt)
+            if not replicas:
+                msg = f"Every replica of {path} is failing."
+                raise UpstreamUnavailable(msg, self._retry_after())
+            if attempt:
+                self.counts["retries"] += 1
+                # Full jitter: retries of concurrent requests do not align
+                await asyncio.sleep(random.uniform(  # noqa: S311
+                    0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))))
+            try:
+                response = await (
+                    self._hedged(client, replicas, path, payload, timeout)
+                    if hedge and idempotent
+                    else self._send(client, replicas[0], path, payload, timeout))
+            except httpx.TransportError as transport_error:
+                error = transport_error
+                # A write may have reached the upstream unless it never connected
+                if idempotent or isinstance(transport_error, UNSENT_ERRORS):
+                    continue
+                break
+            if response.status_code not in RETRYABLE_STATUSES:
+                return response
+            error = httpx.HTTPStatusError(f"{response.status_code} from {path}",
+                                          request=response.request,
+                                          response=response)
+            if not idempotent:
+                break
+        msg = f"{path} failed after {attempt + 1} attempts: {error!r}"
+        raise UpstreamUnavailable(msg, self._retry_after())
+
+    def reset(self) -> None:
+        """Close every circuit and forget the latencies and counts."""
+        for breaker in self.breakers.values():
+            breaker.record_success()
+        self.latencies.clear()
+        self.counts = dict.fromkeys(self.counts, 0)
+
+    def stats(self) -> dict:
+        """Return the state of each circuit and the retry and hedge counts."""
+        return {"circuits": {replica: breaker.state
+                             for replica, breaker in self.breakers.items()},
+                **self.counts}
@@ -0,0 +1,85 @@
+"""Shared fixtures for the local tests."""
+
+import importlib
+import sys
+import zlib
+from pathlib import Path
+from types import ModuleType
+from typing import Iterator
+
+import chromadb
+import pytest
+from chromadb.api.client import SharedSystemClient
+from fastapi.testclient import TestClient
+
+from data.lexical_index import build_lexical_index
+
+# Adjust the Python path to include the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+EMBEDDING_DIM = 64
+
+COURSES = [
+    "Title: SQL for beginners\nLearn SQL queries, joins and databases.",
+    "Title: Advanced SQL\nWindow functions, SQL optimization and databases.",
+    "Title: Python basics\nLearn Python programming from scratch.",
+    "Title: Deep learning\nNeural networks, training and deep learning models.",
+    "Title: Cooking pasta\nBoil water, add salt and cook the pasta.",
+]
+
+
+class BagOfWordsEmbeddingFunction:
+    """Deterministic bag-of-words embedding standing in for the model."""
+
+    def __call__(self, input: list[str]) -> list[list[float]]:  # noqa: A002
+        """Embed each text as the hashed counts of its lowercase words."""
+        embeddings = []
+        for text in input:
+            vector = [0.0] * EMBEDDING_DIM
+            for word in text.lower().replace(",", " ").replace(".", " ").split():
+                vector[zlib.crc32(word.encode()) % EMBEDDING_DIM] += 1.0
+            embeddings.append(vector)
+        return embeddings
+
+
+@pytest.fixture()
+def bag_of_words() -> BagOfWordsEmbeddingFunction:
+    """Deterministic embedding function fixture."""
+    return BagOfWordsEmbeddingFunction()
+
+
+@pytest.fixture()
+def data_service(tmp_path: Path,
+                 monkeypatch: pytest.MonkeyPatch) -> Iterator[ModuleType]:
+    """Import the data service against a small collection in a temporary dir."""
+    # Chroma shares one client per path string, which is relative here
+    SharedSystemClient.clear_system_cache()
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    embedding_function = BagOfWordsEmbeddingFunction()
+    client = chromadb.PersistentClient("data/chroma_db_default_emb")
+    collection = client.create_collection("chroma_db_default_emb",
+                                          metadata={"version": 1})
+    collection.add(
+        ids=[f"courses.txt_chunk_{i}" for i in range(len(COURSES))],
+        documents=COURSES,
+        embeddings=embedding_function(COURSES),
+        metadatas=[{"source": "courses.txt", "chunk_index": i,
+                    "title": course.split("\n")[0][len("Title: "):]}
+                   for i, course in enumerate(COURSES)],
+    )
+    build_lexical_index(collection, "data/chroma_db_default_emb/"
+                                    "chroma_db_default_emb_bm25", version=1)
+
+    module = importlib.reload(importlib.import_module("data.db_app")) \
+        if "data.db_app" in sys.modules else importlib.import_module("data.db_app")
+    monkeypatch.setattr(module.retriever, "embedding_function", embedding_function)
+    yield module
+    SharedSystemClient.clear_system_cache()
+
+
+@pytest.fixture()
+def data_client(data_service: ModuleType) -> Iterator[TestClient]:
+    """TestClient fixture for the data service, running its lifespan."""
+    with TestClient(data_service.app) as test_client:
+        yield test_client
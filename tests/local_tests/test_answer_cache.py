@@ -0,0 +1,92 @@
+"""Module responsible for testing the answer cache."""
+
+import sys
+import time
+from pathlib import Path
+
+# Adjust the Python path to include the src directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from src.answer_cache import AnswerCache, CachedAnswer
+
+PARTITION = ("model", 3)
+
+
+def test_exact_hit_ignores_case_and_punctuation() -> None:
+    """Test that normalized queries share the same entry."""
+    cache = AnswerCache()
+    cache.put(PARTITION, "Recommend 3 SQL courses", CachedAnswer("answer", ["doc"]))
+    assert cache.get(PARTITION, "  recommend 3 sql   COURSES? ").answer == "answer"
+    assert cache.get(("other-model", 3), "Recommend 3 SQL courses") is None
+
+
+def test_semantic_hit_within_threshold() -> None:
+    """Test the nearest-neighbour lookup on query embeddings."""
+    cache = AnswerCache(similarity_threshold=0.9)
+    cache.put(PARTITION, "sql courses", CachedAnswer("sql", []), [1.0, 0.0, 0.0])
+    cache.put(PARTITION, "python courses", CachedAnswer("python", []), [0.0, 1.0, 0.0])
+
+    assert cache.get_similar(PARTITION, [0.95, 0.1, 0.0]).answer == "sql"
+    assert cache.get_similar(PARTITION, [0.5, 0.5, 0.7]) is None
+    assert cache.get_similar(("other-model", 3), [1.0, 0.0, 0.0]) is None
+    assert cache.hits["semantic"] == 1
+
+
+def test_lru_eviction_and_memory_cap() -> None:
+    """Test that the least recently used entries are evicted first."""
+    cache = AnswerCache(max_entries=2)
+    cache.put(PARTITION, "a", CachedAnswer("a", []), [1.0, 0.0])
+    cache.put(PARTITION, "b", CachedAnswer("b", []), [0.0, 1.0])
+    cache.get(PARTITION, "a")
+    cache.put(PARTITION, "c", CachedAnswer("c", []), [1.0, 1.0])
+    assert cache.get(PARTITION, "b") is None
+    assert cache.get(PARTITION, "a") is not None
+    assert len(cache) == 2
+
+    small = AnswerCache(max_bytes=200)
+    small.put(PARTITION, "a", CachedAnswer("x" * 100, []))
+    small.put(PARTITION, "b", CachedAnswer("y" * 100, []))
+    assert small.size_bytes <= 200
+    assert small.get(PARTITION, "a") is None
+
+
+def test_ttl_and_version_invalidation() -> None:
+    """Test that entries expire and are dropped on collection changes."""
+    expired = AnswerCache(ttl=-1)
+    expired.put(PARTITION, "a", CachedAnswer("a", []), [1.0])
+    assert expired.get(PARTITION, "a") is None
+    assert len(expired) == 0
+
+    cache = AnswerCache()
+    cache.observe_version(1)
+    cache.put(PARTITION, "a", CachedAnswer("a", []), [1.0])
+    cache.observe_version(1)
+    assert len(cache) == 1
+    cache.observe_version(2)
+    assert len(cache) == 0
+    assert cache.get_similar(PARTITION, [1.0]) is None
+
+
+def test_exact_hits_need_a_recent_version() -> None:
+    """Test that exact hits are refused once the version was not seen lately."""
+    cache = AnswerCache(version_max_age=0.05)
+    cache.observe_version(1)
+    cache.put(PARTITION, "a", CachedAnswer("a", []), [1.0, 0.0])
+    assert cache.get(PARTITION, "a") is not None
+    time.sleep(0.1)
+    assert cache.get(PARTITION, "a") is None
+    cache.observe_version(1)
+    assert cache.get(PARTITION, "a") is not None
+
+
+def test_embedding_dimension_can_change() -> None:
+    """Test that a new embedding model does not break the semantic lookup."""
+    cache = AnswerCache()
+    cache.put(PARTITION, "a", CachedAnswer("a", []), [1.0, 0.0])
+    cache.put(PARTITION, "b", CachedAnswer("b", []), [0.0, 1.0, 0.0])
+    assert cache.get_similar(PARTITION, [0.0, 1.0, 0.0]) is None
+    assert cache.get(PARTITION, "b").answer == "b"
+
+    cache.clear()
+    cache.put(PARTITION, "b", CachedAnswer("b", []), [0.0, 1.0, 0.0])
+    assert cache.get_similar(PARTITION, [0.0, 1.0, 0.0]).answer == "b"
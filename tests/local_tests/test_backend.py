@@ -1,22 +1,69 @@
 """Module responsible for testing backend functionalities."""
 
+import asyncio
+import json
 import sys
 from pathlib import Path
+from typing import Iterator
 
+import httpx
 import pytest
 from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
 
 # Adjust the Python path to include the src directory
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
 
+from src import app as app_module
 from src.app import app
+from src.llm_backends import LocalFakeChatModel
 
 CORRECT_RESPONSE_STATUS_CODE = 200
 
 @pytest.fixture()
-def client() -> TestClient:
-    """TestClient fixture for FastAPI app."""
-    return TestClient(app)
+def client() -> Iterator[TestClient]:
+    """TestClient fixture for FastAPI app, running its lifespan."""
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+# Request ids and paths received by the fake data service
+received_request_ids: list[str | None] = []
+received_paths: list[str] = []
+
+
+def fake_data_service(request: httpx.Request) -> httpx.Response:
+    """Answer the data service endpoints used by the backend."""
+    received_request_ids.append(request.headers.get("X-Request-ID"))
+    received_paths.append(request.url.path)
+    if request.url.path == "/embed":
+        return httpx.Response(200, json={"embedding": [1.0, 0.0],
+                                         "collection_version": 1})
+    if request.url.path == "/similarity_search":
+        return httpx.Response(200, json={"documents": ["Title: SQL 101"],
+                                         "context": "Title: SQL 101",
+                                         "collection_version": 1})
+    return httpx.Response(200, json={"message": "ok"})
+
+
+@pytest.fixture()
+def offline_client(monkeypatch: pytest.MonkeyPatch) -> Iterator[TestClient]:
+    """TestClient fixture with the data service and the LLM replaced by fakes."""
+    monkeypatch.setattr(app_module, "build_chain", lambda _model_name: (
+        app_module.prompt | GenericFakeChatModel(
+            messages=iter([AIMessage(content="Take SQL 101")]))
+    ))
+    app_module.answer_cache.clear()
+    app_module.answered_at.clear()
+    app_module.data_service.reset()
+    with TestClient(app) as test_client:
+        app.state.http_client = httpx.AsyncClient(
+            transport=httpx.MockTransport(fake_data_service),
+            base_url=app_module.DB_URL,
+            event_hooks={"request": [app_module.propagate_request_id]},
+        )
+        yield test_client
 
 def test_query_endpoint(client : TestClient) -> None:
     """Test the query endpoint locally."""
@@ -26,13 +73,194 @@ def test_query_endpoint(client : TestClient) -> None:
     assert response.status_code == CORRECT_RESPONSE_STATUS_CODE
     assert "answer" in response.json()
     assert "documents" in response.json()
+    assert "interaction_id" in response.json()
 
 
 def test_feedback_endpoint(client : TestClient) -> None:
     """Test the feedback endpoint locally."""
-    response = client.post("/feedback", json={"query": "test",
+    response = client.post("/feedback", json={"interaction_id": "test",
                                               "feedback" : "test" },
                                               timeout=30)
     assert response.status_code == CORRECT_RESPONSE_STATUS_CODE
     assert "message" in response.json()
     assert response.json()["message"] == "Feedback received"
+
+
+def test_query_stream_endpoint(offline_client : TestClient) -> None:
+    """Test that documents come first, then tokens, then the end of stream."""
+    with offline_client.stream("POST", "/query/stream",
+                               json={"query": "Recommend SQL courses"}) as response:
+        assert response.status_code == CORRECT_RESPONSE_STATUS_CODE
+        events = [json.loads(line) for line in response.iter_lines() if line]
+
+    assert events[0]["type"] == "documents"
+    assert events[0]["documents"] == ["Title: SQL 101"]
+    assert not events[0]["cached"]
+    assert events[-1]["type"] == "done"
+    tokens = [event["content"] for event in events if event["type"] == "token"]
+    assert len(tokens) > 1
+    assert "".join(tokens) == "Take SQL 101"
+
+    cached = offline_client.post("/query", json={"query": "recommend sql courses"})
+    assert cached.json()["cached"]
+    assert cached.json()["answer"] == "Take SQL 101"
+
+
+def test_chains_are_reused_and_limited(offline_client : TestClient,
+                                       monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that requests share one chain per model, within its limit."""
+    models = app.state.models
+    assert app_module.model_name in models
+    built = []
+    monkeypatch.setattr(models, "factory", lambda name: built.append(name) or (
+        app_module.prompt | GenericFakeChatModel(
+            messages=iter([AIMessage(content=f"answer {i}") for i in range(3)]))
+    ))
+    monkeypatch.setattr(models, "limits", {"other-model": 1})
+    monkeypatch.setattr(app_module, "SERVED_MODELS", {"other-model"})
+    for query in ("first question", "second question", "third question"):
+        response = offline_client.post("/query", json={"query": query},
+                                       params={"model_name": "other-model"})
+        assert response.status_code == CORRECT_RESPONSE_STATUS_CODE
+    assert built == ["other-model"]
+    assert models.stats()["other-model"] == {"in_flight": 0, "limit": 1, "queued": 0,
+                                             "rejected": 0, "timed_out": 0}
+
+    # Models that are not served never get a chain
+    for path in ("/query", "/query/stream"):
+        response = offline_client.post(path, json={"query": "first question"},
+                                       params={"model_name": "unknown-model"})
+        assert response.status_code == 404  # noqa: PLR2004
+    assert "unknown-model" not in models
+
+
+def test_request_ids_and_metrics(offline_client : TestClient) -> None:
+    """Test that request ids cross the HTTP hop and stages are exposed."""
+    received_request_ids.clear()
+    response = offline_client.post("/query", json={"query": "Recommend SQL courses"},
+                                   headers={"X-Request-ID": "request-42"})
+    assert response.headers["X-Request-ID"] == "request-42"
+    # Embedding, search and the interaction log written after the response
+    assert received_request_ids == ["request-42"] * 3
+
+    generated = offline_client.post("/feedback", json={"interaction_id": "a",
+                                                       "feedback": "b"})
+    assert len(generated.headers["X-Request-ID"]) == 32  # noqa: PLR2004
+
+    exposition = offline_client.get("/metrics").text
+    for stage in ("embed", "retrieval", "context_assembly", "llm_first_token",
+                  "llm_generation", "db_write"):
+        assert f'backend_stage_seconds_count{{stage="{stage}"}}' in exposition
+    assert 'route="/query"' in exposition
+
+
+def test_identical_queries_in_flight_are_coalesced(offline_client : TestClient,
+                                                  monkeypatch: pytest.MonkeyPatch,
+                                                  ) -> None:
+    """Test that concurrent identical queries share one generation."""
+    monkeypatch.setattr(app.state.models, "factory", lambda _name: (
+        app_module.prompt | LocalFakeChatModel(answer_tokens=3,
+                                               first_token_latency=0.2,
+                                               token_latency=0.0)))
+    monkeypatch.setattr(app_module, "SERVED_MODELS", {"burst-model"})
+    received_paths.clear()
+    started = app_module.in_flight.stats()["started"]
+    queries = ["Trending question", "trending question?", "  TRENDING  question"]
+
+    async def burst() -> list[httpx.Response]:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                     base_url="http://backend") as client:
+            return await asyncio.gather(*(
+                client.post("/query", json={"query": query},
+                            params={"model_name": "burst-model"})
+                for query in queries * 2))
+
+    results = [response.json() for response in asyncio.run(burst())]
+    assert app_module.in_flight.stats()["started"] == started + 1
+    assert len({result["answer"] for result in results}) == 1
+    assert sum(result["coalesced"] for result in results) == len(results) - 1
+    # One search for all, one log and one interaction id per caller
+    assert received_paths.count("/similarity_search") == 1
+    assert received_paths.count("/insert_query") == len(results)
+    assert len({result["interaction_id"] for result in results}) == len(results)
+
+
+def test_overload_is_refused_with_retry_after(offline_client : TestClient,
+                                              monkeypatch: pytest.MonkeyPatch,
+                                              ) -> None:
+    """Test that a query finding the LLM busy and its queue full gets a 429."""
+    models = app.state.models
+    monkeypatch.setattr(models, "factory", lambda _name: (
+        app_module.prompt | LocalFakeChatModel(answer_tokens=2,
+                                               first_token_latency=0.2,
+                                               token_latency=0.0)))
+    monkeypatch.setattr(models, "limits", {"busy-model": 1})
+    monkeypatch.setattr(models, "max_queue", 0)
+    monkeypatch.setattr(app_module, "SERVED_MODELS", {"busy-model"})
+
+    async def burst() -> list[httpx.Response]:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                     base_url="http://backend") as client:
+            return await asyncio.gather(*(
+                client.post(path, json={"query": f"busy question {i}"},
+                            params={"model_name": "busy-model"})
+                for i, path in enumerate(["/query", "/query/stream"])))
+
+    responses = asyncio.run(burst())
+    assert sorted(response.status_code for response in responses) == [200, 429]
+    refused = max(responses, key=lambda response: response.status_code)
+    assert int(refused.headers["Retry-After"]) >= 1
+    assert models.stats()["busy-model"]["rejected"] == 1
+
+
+def test_reasked_questions_are_not_interactive(offline_client : TestClient,
+                                               monkeypatch: pytest.MonkeyPatch,
+                                               ) -> None:
+    """Test that a question answered lately is queued as a re-ask."""
+    models = app.state.models
+    monkeypatch.setattr(models, "factory", lambda _name: (
+        app_module.prompt | LocalFakeChatModel(answer_tokens=2,
+                                               first_token_latency=0.0,
+                                               token_latency=0.0)))
+    monkeypatch.setattr(app_module, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(app_module, "SERVED_MODELS", {"reask-model"})
+    params = {"model_name": "reask-model"}
+    lanes = []
+    acquire = models.acquire
+    monkeypatch.setattr(models, "acquire", lambda name, lane: (
+        lanes.append(lane) or acquire(name, lane)))
+
+    for query, lane in [("Recommend SQL courses", "interactive"),
+                        ("recommend sql courses?", "interactive"),
+                        ("Recommend SQL courses", "batch"),
+                        ("Recommend Python courses", "interactive")]:
+        response = offline_client.post("/query", json={"query": query, "lane": lane},
+                                       params=params)
+        assert response.status_code == CORRECT_RESPONSE_STATUS_CODE
+    with offline_client.stream("POST", "/query/stream",
+                               json={"query": "Recommend Python courses"},
+                               params=params) as stream:
+        assert stream.status_code == CORRECT_RESPONSE_STATUS_CODE
+        stream.read()
+    assert lanes == ["interactive", "reask", "batch", "interactive", "reask"]
+
+
+def test_data_service_errors_are_reported(offline_client : TestClient,
+                                          monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that data service failures become HTTP errors, not 500s."""
+    def failing_data_service(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/similarity_search":
+            return httpx.Response(404, json={"detail": "No documents found."})
+        if request.url.path == "/embed":
+            return fake_data_service(request)
+        return httpx.Response(503, json={"detail": "warming up"})
+
+    app.state.http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(failing_data_service))
+    monkeypatch.setattr(app_module.data_service, "backoff", 0.001)
+    not_found = offline_client.post("/query/stream", json={"query": "unknown topic"})
+    assert not_found.status_code == 404  # noqa: PLR2004
+    unavailable = offline_client.post("/feedback", json={"interaction_id": "a",
+                                                         "feedback": "b"})
+    assert unavailable.status_code == 503  # noqa: PLR2004
+    assert "Retry-After" in unavailable.headers
@@ -0,0 +1,28 @@
+"""Module responsible for testing the benchmark harness on a tiny run."""
+
+import json
+import sys
+from pathlib import Path
+
+# Adjust the Python path to include the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from benchmarks.run_benchmarks import ENDPOINTS, parse_args, run_benchmarks
+
+
+def test_benchmark_report(tmp_path: Path) -> None:
+    """Test that every endpoint is measured without errors and reported."""
+    output = tmp_path / "report.json"
+    args = parse_args(["--requests", "6", "--docs", "50", "--concurrency", "1", "3",
+                       "--llm-tokens", "4", "--output", str(output)])
+    report = run_benchmarks(args)
+
+    assert json.loads(output.read_text()) == report
+    assert set(report["results"]) == {"1", "3"}
+    for endpoints in report["results"].values():
+        assert list(endpoints) == list(ENDPOINTS)
+        for stats in endpoints.values():
+            assert stats["errors"] == 0
+            assert stats["requests"] == 6  # noqa: PLR2004
+            assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+    assert "flush_ms" in report["results"]["1"]["insert_query"]
@@ -0,0 +1,86 @@
+"""Module responsible for testing the boundary-aware chunker."""
+
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+# Adjust the Python path to include the data directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from data.chunking import PARAGRAPH, SENTENCE, WORD, find_boundaries, iter_chunk_spans
+
+
+def whitespace_token_offsets(text: str) -> list[tuple[int, int]]:
+    """Tokenize on whitespace, as a stand-in for a real tokenizer."""
+    return [match.span() for match in re.finditer(r"\S+", text)]
+
+
+def test_find_boundaries_levels() -> None:
+    """Test the level given to each whitespace run."""
+    starts, ends, levels = find_boundaries("One two. Three\n\nFour")
+    assert list(zip(starts, ends)) == [(3, 4), (8, 9), (14, 16)]
+    assert list(levels) == [WORD, SENTENCE, PARAGRAPH]
+
+
+def test_chunks_prefer_paragraph_then_sentence_boundaries() -> None:
+    """Test that chunks end on the strongest boundary of their window."""
+    text = ("First sentence here. " * 10 + "\n\n" + "Next part goes on. " * 10)
+    spans = list(iter_chunk_spans(text, chunk_size=300, overlap=0))
+    assert text[spans[0][0]:spans[0][1]].endswith("First sentence here.")
+    assert spans[0][1] == text.index(" \n\n")
+    assert all(text[end - 1] == "." for _, end in spans[1:-1])
+
+
+def test_chunks_never_cut_words_and_overlap() -> None:
+    """Test chunk sizes, word boundaries and overlapping starts."""
+    text = " ".join(f"word{i}" for i in range(400))
+    spans = list(iter_chunk_spans(text, chunk_size=100, overlap=20))
+    assert spans[0][0] == 0
+    assert spans[-1][1] == len(text)
+    for (start, end), (next_start, _) in zip(spans, spans[1:]):
+        assert end - start <= 100
+        assert text[start - 1] == " " if start else True
+        assert end == len(text) or text[end] == " "
+        assert start < next_start < end
+        assert end - next_start <= 20
+
+
+def test_hard_cut_without_whitespace() -> None:
+    """Test that text without any boundary is cut at the chunk size, overlapping."""
+    assert list(iter_chunk_spans("x" * 250, chunk_size=100, overlap=10)) == [
+        (0, 100), (90, 190), (180, 250)]
+    assert list(iter_chunk_spans("x" * 250, chunk_size=100, overlap=0)) == [
+        (0, 100), (100, 200), (200, 250)]
+    # Sized in tokens, e.g. word pieces of a long identifier
+    def piece_offsets(text: str) -> list[tuple[int, int]]:
+        return [(i, min(i + 5, len(text))) for i in range(0, len(text), 5)]
+
+    assert list(iter_chunk_spans("x" * 30, chunk_size=2, overlap=1,
+                                 token_offsets=piece_offsets)) == [
+        (0, 10), (5, 15), (10, 20), (15, 25), (20, 30)]
+
+
+def test_token_based_chunk_sizes() -> None:
+    """Test that sizes are counted in tokens when a tokenizer is given."""
+    text = " ".join(f"w{i}" for i in range(50))
+    spans = list(iter_chunk_spans(text, chunk_size=10, overlap=2,
+                                  token_offsets=whitespace_token_offsets))
+    sizes = [len(text[start:end].split()) for start, end in spans]
+    assert max(sizes) == 10
+    assert text[spans[1][0]:].startswith("w8 ")
+    assert spans[-1][1] == len(text)
+
+
+def test_single_token_chunks_and_invalid_sizes() -> None:
+    """Test one-token chunks, and sizes that cannot make progress."""
+    text = "one two three"
+    assert list(iter_chunk_spans(text, chunk_size=1, overlap=0,
+                                 token_offsets=whitespace_token_offsets)) == [
+        (0, 3), (4, 7), (8, 13)]
+    assert list(iter_chunk_spans("abcd", chunk_size=1, overlap=0)) == [
+        (0, 1), (1, 2), (2, 3), (3, 4)]
+    for chunk_size, overlap in [(0, 0), (10, 10), (10, 20)]:
+        with pytest.raises(ValueError, match="chunk_size"):
+            list(iter_chunk_spans(text, chunk_size=chunk_size, overlap=overlap))
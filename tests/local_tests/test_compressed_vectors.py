@@ -0,0 +1,60 @@
+"""Module responsible for testing the compressed vector storage."""
+
+import sys
+from pathlib import Path
+
+import chromadb
+import numpy as np
+
+# Adjust the Python path to include the data directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from data.compressed_vectors import (
+    CompressedVectors,
+    compress_collection,
+    evaluate_recall,
+)
+from data.retriever import Retriever, SearchQuery
+
+FULL_DIM, REDUCED_DIM, N_CHUNKS = 64, 16, 600
+
+
+def test_compressed_search_recall(tmp_path: Path, bag_of_words: object) -> None:
+    """Test the recall of the compressed copy, with and without re-ranking."""
+    # Most of the variance in a few directions, like real embeddings
+    rng = np.random.default_rng(0)
+    scales = np.geomspace(4, 0.05, num=FULL_DIM)
+    vectors = rng.normal(size=(N_CHUNKS, FULL_DIM)) * scales
+    ids = [f"doc_{i}" for i in range(N_CHUNKS)]
+
+    client = chromadb.EphemeralClient()
+    source = client.get_or_create_collection("full_vectors",
+                                             metadata={"version": 2})
+    source.upsert(ids=ids, embeddings=vectors.tolist(),
+                  documents=[f"chunk {i}" for i in range(N_CHUNKS)],
+                  metadatas=[{"chunk_index": i} for i in range(N_CHUNKS)])
+    target = client.get_or_create_collection("reduced_vectors",
+                                             metadata={"version": 2})
+    path = str(tmp_path / "reduced_vectors")
+    assert compress_collection(source, target, path, dim=REDUCED_DIM,
+                               page_size=128) == N_CHUNKS
+
+    compressed = CompressedVectors(path)
+    assert compressed.dim == REDUCED_DIM
+    assert compressed.project(vectors[:2]).shape == (2, REDUCED_DIM)
+    assert target.get(ids=["doc_7"], include=["documents"])["documents"] == ["chunk 7"]
+
+    report = evaluate_recall(source, target, compressed, n_queries=100, k=5)
+    assert report["memory_ratio"] == FULL_DIM / REDUCED_DIM
+    assert report["recall_reranked"] > report["recall_reduced"]
+    assert report["recall_reranked"] >= 0.9  # noqa: PLR2004
+
+    # The retriever projects the query and re-ranks with the full vectors
+    retriever = Retriever(client, "reduced_vectors", bag_of_words,
+                          compressed_vectors_path=path, rerank_factor=4)
+    full = source.query(query_embeddings=[vectors[3].tolist()], n_results=3)
+    result = retriever.search([SearchQuery(query="q", n_docs=3,
+                                           embedding=tuple(vectors[3]))])[0]
+    assert result.ids[0] == "doc_3"
+    assert list(result.ids) == full["ids"][0]
+    assert result.documents[0] == "chunk 3"
@@ -0,0 +1,95 @@
+"""Module responsible for testing the context assembly."""
+
+import sys
+from pathlib import Path
+
+# Adjust the Python path to include the src directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from data.chunking import iter_chunk_spans
+from src.context import (
+    approximate_tokens,
+    assemble_context,
+    drop_near_duplicates,
+    merge_adjacent_chunks,
+    pack_passages,
+)
+
+TEXT = ("SQL is a language to query databases. Joins combine tables. "
+        "Window functions compute running totals. Indexes speed up lookups. "
+        "Transactions keep data consistent. Views store named queries.")
+
+
+def chunk(text: str) -> tuple[list[str], list[dict]]:
+    """Split an ASCII text into overlapping chunks and their metadata."""
+    spans = list(iter_chunk_spans(text, chunk_size=60, overlap=20))
+    return ([text[start:end] for start, end in spans],
+            [{"source": "sql.txt", "chunk_index": i, "start_byte": start,
+              "end_byte": end} for i, (start, end) in enumerate(spans)])
+
+
+def test_adjacent_chunks_are_merged_once() -> None:
+    """Test that overlapping neighbours rebuild the original text."""
+    documents, metadatas = chunk(TEXT)
+    assert len(documents) > 2
+
+    # Retrieval order is by relevance, not by position
+    order = [2, 0, 1]
+    passages = merge_adjacent_chunks([documents[i] for i in order],
+                                     [metadatas[i] for i in order])
+    assert len(passages) == 1
+    end = metadatas[2]["end_byte"]
+    assert passages[0].text == TEXT[:end]
+    assert passages[0].metadata["chunk_indices"] == [0, 1, 2]
+    assert passages[0].rank == 0
+
+    # Without offsets, the overlap is found in the text itself
+    bare = [{"source": "sql.txt", "chunk_index": i} for i in range(3)]
+    assert merge_adjacent_chunks(documents[:3], bare)[0].text == TEXT[:end]
+
+
+def test_near_duplicates_and_budget() -> None:
+    """Test that copies are dropped and the most relevant passages fit."""
+    documents = ["Learn SQL joins and window functions with examples",
+                 "Boil the pasta in salted water for ten minutes",
+                 "learn SQL joins and window functions, with examples!"]
+    metadatas = [{"source": "a.txt", "chunk_index": 0},
+                 {"source": "b.txt", "chunk_index": 0},
+                 {"source": "c.txt", "chunk_index": 4}]
+    passages = merge_adjacent_chunks(documents, metadatas)
+    assert [p.text for p in drop_near_duplicates(passages)] == documents[:2]
+
+    # Too long for what remains: skipped, so that a shorter passage fits
+    medium, long_text = "a" * 400, " ".join(["word"] * 400)
+    packed = pack_passages(merge_adjacent_chunks([medium, long_text, "short one"],
+                                                 []),
+                           token_budget=110, min_tokens=20)
+    assert [p.text for p in packed] == [medium, "short one"]
+
+    # Too long for the budget but enough room left: cut at a word boundary
+    packed = pack_passages(merge_adjacent_chunks([long_text], []), token_budget=120)
+    assert packed[0].metadata["truncated"]
+    assert 400 < len(packed[0].text) <= 480
+    assert packed[0].text.endswith(" word")
+
+    assert assemble_context(documents, metadatas, token_budget=5) == []
+
+
+def test_packed_passages_never_exceed_the_budget() -> None:
+    """Test that truncated passages keep every word that fits, within budget."""
+    words = " ".join(f"w{i}" for i in range(200))
+    spaceless = "x" * 400
+    for budget in range(1, 200, 7):
+        for documents in ([words], [spaceless], [spaceless, words], [words, words]):
+            packed = pack_passages(merge_adjacent_chunks(documents, []),
+                                   token_budget=budget, min_tokens=1)
+            assert sum(approximate_tokens(p.text) for p in packed) <= budget
+            remaining = budget
+            for passage in packed:
+                kept = passage.text.split(" ")
+                if passage.metadata.get("truncated") and kept[0] == "w0":
+                    # Cut at a word boundary, with no room left for the next word
+                    assert kept == words.split(" ")[:len(kept)]
+                    assert approximate_tokens(f"{passage.text} w{len(kept)}") \
+                        > remaining
+                remaining -= approximate_tokens(passage.text)
@@ -0,0 +1,219 @@
+"""Module responsible for testing the data service endpoints."""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+
+import pytest
+from fastapi.testclient import TestClient
+
+from data.batching import MicroBatcher
+
+CORRECT_RESPONSE_STATUS_CODE = 200
+
+
+def test_similarity_search_endpoint(data_client : TestClient) -> None:
+    """Test a single search, with and without the chunk text."""
+    response = data_client.post("/similarity_search",
+                                json={"query": "sql databases", "n_docs": 2})
+    assert response.status_code == CORRECT_RESPONSE_STATUS_CODE
+    result = response.json()
+    assert [metadata["title"] for metadata in result["metadatas"]] == [
+        "SQL for beginners", "Advanced SQL"]
+    assert result["context"] == "\n\n\n".join(result["documents"])
+
+    ids_only = data_client.post("/similarity_search",
+                                json={"query": "sql databases", "n_docs": 2,
+                                      "include_text": False}).json()
+    assert ids_only["documents"] == []
+    assert ids_only["ids"] == result["ids"]
+    texts = data_client.post("/documents", json={"ids": ids_only["ids"]}).json()
+    assert texts["documents"] == result["documents"]
+
+
+def test_similarity_search_batch_endpoint(data_client : TestClient) -> None:
+    """Test that a batch returns the same results as single searches."""
+    queries = [{"query": "sql databases", "n_docs": 1},
+               {"query": "cook pasta", "n_docs": 3},
+               {"query": "neural networks deep learning", "n_docs": 2}]
+    batch = data_client.post("/similarity_search/batch",
+                             json={"queries": queries}).json()["results"]
+    singles = [data_client.post("/similarity_search", json=query).json()
+               for query in queries]
+    assert [result["ids"] for result in batch] == [
+        result["ids"] for result in singles]
+    assert [len(result["ids"]) for result in batch] == [1, 3, 2]
+
+
+def test_concurrent_searches_are_micro_batched(data_service : ModuleType,
+                                               data_client : TestClient) -> None:
+    """Test that concurrent single searches share batches and keep their results."""
+    data_service.search_batcher.max_wait = 0.05
+    queries = [f"sql databases {i}" if i % 2 else f"python programming {i}"
+               for i in range(16)]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        responses = list(pool.map(
+            lambda query: data_client.post("/similarity_search",
+                                           json={"query": query, "n_docs": 1}),
+            queries))
+
+    titles = [response.json()["metadatas"][0]["title"] for response in responses]
+    assert titles == ["Python basics" if i % 2 == 0 else "SQL for beginners"
+                      for i in range(16)]
+    batch_sizes = data_service.search_batcher.batch_sizes
+    assert batch_sizes["items"] == 16
+    assert batch_sizes["batches"] < 16
+
+
+
+def test_invalid_searches_are_rejected(data_client : TestClient) -> None:
+    """Test that invalid searches get a 4xx instead of failing the batch."""
+    for invalid in ({"query": "sql", "n_docs": 0},
+                    {"query": "sql", "n_docs": -1},
+                    {"query": "sql", "filters": {"source": []}},
+                    {"query": "sql", "embedding": [1.0, 0.0]}):
+        assert data_client.post("/similarity_search", json=invalid).status_code == 422  # noqa: PLR2004
+        batch = data_client.post("/similarity_search/batch", json={
+            "queries": [{"query": "sql"}, invalid]})
+        assert batch.status_code == 422  # noqa: PLR2004
+
+
+def test_failed_batch_only_fails_the_bad_item() -> None:
+    """Test that items of a failed batch are processed again one by one."""
+    def process(items: list[int]) -> list[int]:
+        if 0 in items:
+            msg = "division by zero"
+            raise ZeroDivisionError(msg)
+        return [10 // item for item in items]
+
+    batcher = MicroBatcher(process, max_wait=0.05)
+    batcher.start()
+    try:
+        futures = [batcher.submit(item) for item in (1, 0, 5)]
+        assert futures[0].result() == 10  # noqa: PLR2004
+        assert isinstance(futures[1].exception(), ZeroDivisionError)
+        assert futures[2].result() == 2  # noqa: PLR2004
+    finally:
+        batcher.close()
+    assert batcher.batch_sizes == {"batches": 1, "items": 3}
+
+
+def test_lexical_and_hybrid_searches(data_client : TestClient) -> None:
+    """Test the BM25 and fused retrieval modes."""
+    def titles(retrieval: str, query: str, n_docs: int) -> list[str]:
+        result = data_client.post("/similarity_search", json={
+            "query": query, "n_docs": n_docs, "retrieval": retrieval}).json()
+        assert len(result["documents"]) == len(result["ids"])
+        return [metadata["title"] for metadata in result["metadatas"]]
+
+    assert titles("lexical", "window functions", 5) == ["Advanced SQL"]
+    hybrid = titles("hybrid", "window functions optimization", 3)
+    assert hybrid[0] == "Advanced SQL"
+    assert len(hybrid) == 3
+    invalid = data_client.post("/similarity_search",
+                               json={"query": "sql", "retrieval": "fuzzy"})
+    assert invalid.status_code == 422
+
+
+
+def test_filtered_searches(data_client : TestClient) -> None:
+    """Test that metadata filters restrict every retrieval mode."""
+    def titles(retrieval: str, query: str, filters: dict) -> list[str]:
+        result = data_client.post("/similarity_search/batch", json={"queries": [{
+            "query": query, "n_docs": 3, "retrieval": retrieval,
+            "filters": filters}]}).json()["results"][0]
+        return [metadata["title"] for metadata in result["metadatas"]]
+
+    assert titles("vector", "sql databases", {"title": "Python basics"}) == [
+        "Python basics"]
+    assert titles("lexical", "learn", {"title": ["Python basics", "Deep learning"]}
+                  ) == ["Python basics"]
+    assert set(titles("hybrid", "sql", {"chunk_index": [1, 4]})) == {
+        "Advanced SQL", "Cooking pasta"}
+    assert titles("hybrid", "sql", {"source": "other.txt"}) == []
+
+
+def test_multi_collection_search(data_service : ModuleType,
+                                 data_client : TestClient, bag_of_words: object,
+                                 monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that results of several collections are merged by score."""
+    documents = ["Title: SQL in the cloud\nManaged SQL databases.",
+                 "Title: Gardening\nGrow tomatoes in the garden."]
+    collection = data_service.chroma_client.create_collection(
+        "cloud", metadata={"version": 3})
+    collection.add(ids=["cloud.txt_chunk_0", "cloud.txt_chunk_1"],
+                   documents=documents, embeddings=bag_of_words(documents),
+                   metadatas=[{"source": "cloud.txt", "title": "SQL in the cloud"},
+                              {"source": "cloud.txt", "title": "Gardening"}])
+    monkeypatch.setitem(data_service.retrievers, "cloud",
+                        data_service.Retriever(data_service.chroma_client, "cloud",
+                                               bag_of_words))
+
+    result = data_client.post("/similarity_search", json={
+        "query": "sql databases", "n_docs": 3,
+        "collections": ["chroma_db_default_emb", "cloud"]}).json()
+    titles = [metadata["title"] for metadata in result["metadatas"]]
+    assert set(titles) == {"SQL for beginners", "SQL in the cloud", "Advanced SQL"}
+    assert result["collections"][titles.index("SQL in the cloud")] == "cloud"
+    assert result["collections"].count("chroma_db_default_emb") == 2  # noqa: PLR2004
+    assert result["scores"] == sorted(result["scores"], reverse=True)
+    assert result["collection_version"] == \
+        data_service.retriever.collection_version() + 3
+    texts = data_client.post("/documents", json={"ids": result["ids"]}).json()
+    assert texts["documents"] == result["documents"]
+
+    unknown = data_client.post("/similarity_search",
+                               json={"query": "sql", "collections": ["missing"]})
+    assert unknown.status_code == 404  # noqa: PLR2004
+
+
+def test_metrics_endpoint(data_service : ModuleType,
+                          data_client : TestClient) -> None:
+    """Test that the search and write stages are exposed as histograms."""
+    data_client.post("/similarity_search",
+                     json={"query": "sql", "retrieval": "hybrid"})
+    data_client.post("/insert_query", json={"query": "q", "answer": "a",
+                                            "documents": ["d"]})
+    data_service.query_log.flush()
+
+    exposition = data_client.get("/metrics").text
+    for stage in ("embed", "vector_search", "lexical_search", "db_enqueue",
+                  "db_write"):
+        assert f'data_stage_seconds_count{{stage="{stage}"}}' in exposition
+    assert 'data_request_seconds_count{method="POST",route="/similarity_search"' \
+        in exposition
+
+
+def wait_for_warm_up(data_client : TestClient) -> dict:
+    """Poll /ready until the warm-up is over, and return its last response."""
+    for _ in range(100):
+        response = data_client.get("/ready")
+        if response.status_code == CORRECT_RESPONSE_STATUS_CODE \
+                or response.json()["error"]:
+            break
+        time.sleep(0.05)
+    return response
+
+
+def test_readiness_after_warm_up(data_client : TestClient) -> None:
+    """Test that /ready succeeds once the model and indexes are loaded."""
+    response = wait_for_warm_up(data_client)
+    assert response.status_code == CORRECT_RESPONSE_STATUS_CODE
+    assert set(response.json()["warmup_ms"]) == {"collection_version",
+                                                 "embedding_model", "search"}
+    assert data_client.get("/").status_code == CORRECT_RESPONSE_STATUS_CODE
+
+
+def test_readiness_when_warm_up_fails(data_service : ModuleType,
+                                      monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that /ready keeps failing, with the error, if the warm-up fails."""
+    def broken_model(_queries: list[str]) -> list[list[float]]:
+        msg = "model not found"
+        raise OSError(msg)
+
+    monkeypatch.setattr(data_service.retriever, "embedding_function", broken_model)
+    with TestClient(data_service.app) as client:
+        response = wait_for_warm_up(client)
+        assert response.status_code == 503  # noqa: PLR2004
+        assert "model not found" in response.json()["error"]
+        assert client.get("/").status_code == CORRECT_RESPONSE_STATUS_CODE
@@ -0,0 +1,43 @@
+"""Module responsible for testing the BM25 lexical index."""
+
+import sys
+from pathlib import Path
+
+# Adjust the Python path to include the data directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from data.lexical_index import (
+    LexicalIndex,
+    reciprocal_rank_fusion,
+    write_lexical_index,
+)
+
+
+def test_bm25_ranking(tmp_path: Path) -> None:
+    """Test that rare terms and short matching chunks rank first."""
+    chunks = [("a", "SQL joins and window functions"),
+              ("b", "Python for data science and machine learning"),
+              ("c", "SQL basics"),
+              ("d", "A long introduction to data, data models and data tools")]
+    path = str(tmp_path / "bm25")
+    assert write_lexical_index(path, chunks, version=3) == len(chunks)
+    index = LexicalIndex(path)
+
+    assert index.version == 3
+    assert [chunk_id for chunk_id, _ in index.search("sql window", k=5)] == ["a", "c"]
+    assert [chunk_id for chunk_id, _ in index.search("SQL", k=5)] == ["c", "a"]
+    assert [chunk_id for chunk_id, _ in index.search("data", k=1)] == ["d"]
+    assert index.search("kubernetes", k=5) == []
+
+    # Rewriting replaces the previous index
+    write_lexical_index(path, chunks[:1], version=4)
+    assert len(LexicalIndex(path)) == 1
+
+
+def test_reciprocal_rank_fusion() -> None:
+    """Test that ids ranked well by both rankings come first."""
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["d", "b", "e", "a"]])
+    ids = [chunk_id for chunk_id, _ in fused]
+    assert ids[:2] == ["b", "a"]
+    assert set(ids) == {"a", "b", "c", "d", "e"}
+    assert fused[0][1] == 2 / 62  # noqa: PLR2004
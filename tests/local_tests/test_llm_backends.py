@@ -0,0 +1,40 @@
+"""Module responsible for testing the configurable LLM backends."""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Adjust the Python path to include the src directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from src.app import prompt
+from src.llm_backends import LocalFakeChatModel, build_chat_model
+
+
+def test_fake_backend_streams_at_its_pace(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the fake model is deterministic and paced by its settings."""
+    monkeypatch.setenv("FAKE_LLM_TOKENS", "5")
+    monkeypatch.setenv("FAKE_LLM_FIRST_TOKEN_MS", "50")
+    monkeypatch.setenv("FAKE_LLM_TOKEN_MS", "10")
+    chain = prompt | build_chat_model("fake", "any-model")
+    inputs = {"input": "Recommend SQL courses", "context": "SQL 101"}
+
+    async def stream() -> tuple[list[str], float]:
+        start = time.perf_counter()
+        tokens = [chunk.content async for chunk in chain.astream(inputs)]
+        return tokens, time.perf_counter() - start
+
+    tokens, elapsed = asyncio.run(stream())
+    assert len(tokens) == 5
+    assert elapsed >= 0.05 + 4 * 0.01
+    assert chain.invoke(inputs).content == "".join(tokens)
+
+    instant = LocalFakeChatModel(answer_tokens=3, first_token_latency=0,
+                                 token_latency=0)
+    assert instant.invoke("a b").content == "a b a"
+
+    with pytest.raises(ValueError, match="Unknown LLM backend"):
+        build_chat_model("openai", "gpt")
@@ -0,0 +1,102 @@
+"""Module responsible for testing the admission control of the LLM registry."""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+# Adjust the Python path to include the src directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from src.llm_registry import AdmissionError, ModelRegistry
+
+
+def test_queue_serves_lanes_by_priority() -> None:
+    """Test that waiting requests are served by lane and lower lanes shed first."""
+    registry = ModelRegistry(lambda name: name, max_concurrency=1, max_queue=4)
+    served = []
+
+    async def generate(name: str, lane: str, hold: asyncio.Event) -> None:
+        async with registry.acquire("model", lane):
+            served.append(name)
+            await hold.wait()
+
+    async def scenario() -> None:
+        release = asyncio.Event()
+        release.set()
+        hold = asyncio.Event()
+        first = asyncio.create_task(generate("first", "interactive", hold))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(generate(name, lane, release))
+                   for name, lane in [("batch", "batch"), ("reask", "reask"),
+                                      ("new", "interactive")]]
+        await asyncio.sleep(0)
+        # A quarter of the queue for batch jobs: the second one is refused
+        with pytest.raises(AdmissionError) as refused:
+            await generate("second batch", "batch", release)
+        assert refused.value.status_code == 429  # noqa: PLR2004
+        assert registry.stats()["model"]["queued"] == 3  # noqa: PLR2004
+        hold.set()
+        await asyncio.gather(first, *waiting)
+
+    asyncio.run(scenario())
+    assert served == ["first", "new", "reask", "batch"]
+    assert registry.stats()["model"] == {"in_flight": 0, "limit": 1, "queued": 0,
+                                         "rejected": 1, "timed_out": 0}
+
+
+def test_queue_deadline() -> None:
+    """Test that a request waiting past the deadline gets a 503."""
+    registry = ModelRegistry(lambda name: name, max_concurrency=1,
+                             queue_timeout=0.05)
+
+    async def scenario() -> AdmissionError:
+        async with registry.acquire("model"):
+            with pytest.raises(AdmissionError) as refused:
+                async with registry.acquire("model"):
+                    pass
+        async with registry.acquire("model"):
+            pass
+        return refused.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 503  # noqa: PLR2004
+    assert error.retry_after >= 1
+    assert registry.stats()["model"]["timed_out"] == 1
+    assert registry.stats()["model"]["in_flight"] == 0
+
+
+def test_full_queue_evicts_lower_lanes() -> None:
+    """Test that a higher lane takes the place of the last lower-lane waiter."""
+    registry = ModelRegistry(lambda name: name, max_concurrency=1, max_queue=2)
+    served = []
+
+    async def generate(name: str, lane: str, hold: asyncio.Event) -> None:
+        async with registry.acquire("model", lane):
+            served.append(name)
+            await hold.wait()
+
+    async def scenario() -> list:
+        release = asyncio.Event()
+        release.set()
+        hold = asyncio.Event()
+        first = asyncio.create_task(generate("first", "interactive", hold))
+        await asyncio.sleep(0)
+        waiting = []
+        for name, lane in [("batch", "batch"), ("reask", "reask"),
+                           ("new", "interactive"), ("newer", "interactive")]:
+            waiting.append(asyncio.create_task(generate(name, lane, release)))
+            await asyncio.sleep(0)
+        # The queue is full of interactive requests: nothing left to evict
+        with pytest.raises(AdmissionError):
+            await generate("reask again", "reask", release)
+        hold.set()
+        return await asyncio.gather(first, *waiting, return_exceptions=True)
+
+    outcomes = asyncio.run(scenario())
+    assert served == ["first", "new", "newer"]
+    evicted = [outcome for outcome in outcomes if outcome is not None]
+    assert [error.status_code for error in evicted] == [429, 429]
+    assert registry.stats()["model"] == {"in_flight": 0, "limit": 1, "queued": 0,
+                                         "rejected": 3, "timed_out": 0}
@@ -0,0 +1,74 @@
+"""Module responsible for testing the cross-encoder re-ranking."""
+
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Sequence
+
+# Adjust the Python path to include the src directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from src.app import rerank_documents
+from src.reranker import CrossEncoderReranker
+
+PASSAGES = ["Cook the pasta", "SQL joins", "Learn SQL queries and SQL joins",
+            "Python basics", "Advanced SQL"]
+
+
+def word_overlap(query: str, passages: Sequence[str]) -> list[float]:
+    """Score passages by the number of query words they contain."""
+    words = query.lower().split()
+    return [float(sum(passage.lower().split().count(word) for word in words))
+            for passage in passages]
+
+
+def test_reranker_scores_in_batches() -> None:
+    """Test that the best scored passages are kept, scored batch by batch."""
+    batches = []
+    reranker = CrossEncoderReranker(batch_size=2, scorer=lambda query, passages: (
+        batches.append(len(passages)) or word_overlap(query, passages)))
+    assert reranker.rerank("sql joins", PASSAGES, top_n=3, time_budget=1.0) == [
+        2, 1, 4]
+    assert batches == [2, 2, 1]
+
+
+def test_rerank_falls_back_to_vector_order() -> None:
+    """Test that a scoring slower than its budget keeps the vector order."""
+    def slow_scorer(query: str, passages: Sequence[str]) -> list[float]:
+        time.sleep(0.05)
+        return word_overlap(query, passages)
+
+    reranker = CrossEncoderReranker(batch_size=1, scorer=slow_scorer)
+    assert reranker.rerank("sql", PASSAGES, top_n=2, time_budget=0.01) is None
+
+    metadatas = [{"chunk_index": i} for i in range(len(PASSAGES))]
+    documents, kept = asyncio.run(rerank_documents(reranker, "sql", PASSAGES,
+                                                   metadatas, n_docs=2))
+    assert documents == PASSAGES[:2]
+    assert kept == metadatas[:2]
+
+
+def test_concurrent_reranks_respect_their_budget() -> None:
+    """Test that waiting for the model or another scoring counts in the budget."""
+    reranker = CrossEncoderReranker()
+    # Another thread is loading the model
+    with reranker._load_lock:  # noqa: SLF001
+        start = time.perf_counter()
+        assert reranker.rerank("sql", PASSAGES, top_n=2, time_budget=0.05) is None
+        assert time.perf_counter() - start < 0.5  # noqa: PLR2004
+
+    def slow_scorer(query: str, passages: Sequence[str]) -> list[float]:
+        time.sleep(0.5)
+        return word_overlap(query, passages)
+
+    reranker.scorer = slow_scorer
+    busy = threading.Thread(target=reranker.rerank,
+                            args=("sql", PASSAGES, 2, 5.0))
+    busy.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    assert reranker.rerank("sql", PASSAGES, top_n=2, time_budget=0.05) is None
+    assert time.perf_counter() - start < 0.3  # noqa: PLR2004
+    busy.join()
@@ -0,0 +1,24 @@
+"""Module responsible for testing the retrieval caches of the data service."""
+
+import sys
+from pathlib import Path
+
+# Adjust the Python path to include the data directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from data.retrieval_cache import LRUCache, normalize_query
+
+
+def test_lru_cache_counts_and_evicts() -> None:
+    """Test hit/miss counters and least-recently-used eviction."""
+    cache = LRUCache(max_size=2)
+    key = (normalize_query("Recommend 3 SQL courses?"), 3, 1)
+    cache.put(key, ("doc",))
+    cache.put("other", ("other",))
+    assert cache.get((normalize_query("recommend 3 sql  courses"), 3, 1)) == ("doc",)
+    assert cache.get((normalize_query("recommend 3 sql courses"), 3, 2)) is None
+
+    cache.put("third", ("third",))
+    assert cache.get("other") is None
+    assert cache.get(key) == ("doc",)
+    assert cache.stats() == {"size": 2, "max_size": 2, "hits": 2, "misses": 2}
@@ -0,0 +1,74 @@
+"""Module responsible for testing the retriever under concurrent load."""
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import chromadb
+
+# Adjust the Python path to include the data directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from data.retriever import Retriever, SearchQuery
+
+TOPICS = ["sql", "python", "neural", "pasta", "cloud", "statistics", "design",
+          "finance", "security", "marketing"]
+
+
+def build_retriever(bag_of_words: object, cache_size: int) -> Retriever:
+    """Build a retriever over a collection of synthetic course descriptions."""
+    client = chromadb.EphemeralClient()
+    name = f"stress_{cache_size}"
+    client.get_or_create_collection(name)
+    collection = client.get_collection(name)
+    documents = [f"{TOPICS[i % 10]} course {i} level {i % 7} " * 3 for i in range(300)]
+    collection.upsert(ids=[f"doc_{i}" for i in range(300)], documents=documents,
+                      embeddings=bag_of_words(documents))
+    return Retriever(client, name, bag_of_words, embedding_cache_size=cache_size,
+                     result_cache_size=cache_size)
+
+
+def test_concurrent_searches_match_serial_results(bag_of_words: object) -> None:
+    """Test that searches give the serial results whatever the number of threads."""
+    retriever = build_retriever(bag_of_words, cache_size=0)
+    # Every search has its own n_docs: none may leak into another's results
+    queries = [SearchQuery(query=f"{TOPICS[i % 10]} level {i % 7}", n_docs=1 + i % 9)
+               for i in range(200)]
+    expected = [retriever.search([query])[0] for query in queries]
+    assert [len(result.ids) for result in expected] == [
+        query.n_docs for query in queries]
+
+    # Throughput is measured by benchmarks/run_benchmarks.py, on /similarity_search
+    for workers in (1, 2, 4, 8):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda query: retriever.search([query])[0],
+                                    queries))
+        assert results == expected
+
+
+def test_concurrent_searches_with_shared_caches(bag_of_words: object) -> None:
+    """Test that the shared caches stay consistent under concurrent use."""
+    retriever = build_retriever(bag_of_words, cache_size=16)
+    queries = [SearchQuery(query=f"{TOPICS[i % 10]} course", n_docs=1 + i % 3)
+               for i in range(400)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda query: retriever.search([query])[0], queries))
+
+    for query, result in zip(queries, results):
+        assert len(result.ids) == query.n_docs
+        assert result == retriever.search([query])[0]
+    stats = retriever.cache_stats()["results"]
+    assert stats["size"] <= stats["max_size"]
+    assert stats["hits"] > 0
+
+
+def test_given_embeddings_are_part_of_the_cache_key(bag_of_words: object) -> None:
+    """Test that a cached text does not answer a search for another vector."""
+    retriever = build_retriever(bag_of_words, cache_size=16)
+    by_text = retriever.search([SearchQuery(query="sql course", n_docs=3)])[0]
+    embedding = tuple(bag_of_words(["pasta course"])[0])
+    by_vector = retriever.search([SearchQuery(query="sql course", n_docs=3,
+                                              embedding=embedding)])[0]
+    assert by_vector != by_text
+    assert by_vector == retriever.search([SearchQuery(query="pasta course",
+                                                      n_docs=3)])[0]
@@ -0,0 +1,126 @@
+"""Module responsible for testing the query log database helpers."""
+
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+# Adjust the Python path to include the data directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from data import sql_database
+from data.sql_database import MIGRATIONS, QueryLogWriter, init_db
+
+
+def test_query_log_writer_batches_and_flushes(tmp_path: Path) -> None:
+    """Test that queued writes are committed in order and flushed on close."""
+    db_path = str(tmp_path / "queries.db")
+    writer = QueryLogWriter(db_path=db_path, batch_size=4, flush_interval=10)
+    writer.start()
+    for i in range(10):
+        writer.insert_query(f"id-{i}", "same query", f"answer {i}", "documents")
+    writer.write_feedback("id-3", "positive")
+    writer.close()
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT interaction_id, feedback FROM queries ORDER BY id",
+    ).fetchall()
+    conn.close()
+    assert [interaction_id for interaction_id, _ in rows] == [
+        f"id-{i}" for i in range(10)
+    ]
+    # Feedback only touches the addressed interaction, not same-text queries
+    assert rows[3] == ("id-3", "positive")
+    assert all(feedback is None for _, feedback in rows[:3] + rows[4:])
+
+
+def test_query_log_writer_flush_waits_for_commit(tmp_path: Path) -> None:
+    """Test that flush returns only once pending writes are visible."""
+    db_path = str(tmp_path / "queries.db")
+    writer = QueryLogWriter(db_path=db_path, batch_size=100, flush_interval=0.05)
+    writer.start()
+    writer.insert_query("id", "query", "answer", "documents")
+    writer.flush()
+
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+    conn.close()
+    writer.close()
+    assert count == 1
+
+
+def test_duplicate_insert_keeps_the_batch(tmp_path: Path) -> None:
+    """Test that a resent interaction does not roll back its batch."""
+    db_path = str(tmp_path / "queries.db")
+    writer = QueryLogWriter(db_path=db_path, batch_size=10, flush_interval=10)
+    writer.start()
+    writer.insert_query("id-0", "query", "first answer", "documents")
+    writer.insert_query("id-1", "query", "answer", "documents")
+    writer.insert_query("id-0", "query", "resent answer", "documents")
+    writer.insert_query("id-2", "query", "answer", "documents")
+    writer.write_feedback("id-0", "positive")
+    writer.close()
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT interaction_id, answer, feedback FROM queries ORDER BY id",
+    ).fetchall()
+    conn.close()
+    assert rows == [("id-0", "first answer", "positive"),
+                    ("id-1", "answer", None), ("id-2", "answer", None)]
+
+
+def test_init_db_migrates_legacy_schema(tmp_path: Path) -> None:
+    """Test that an existing queries table gets the id column and its index."""
+    db_path = str(tmp_path / "queries.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE queries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            query TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            documents TEXT NOT NULL,
+            feedback TEXT
+        )
+    """)
+    conn.execute("INSERT INTO queries (query, answer, documents) VALUES ('q', 'a', 'd')")
+    conn.commit()
+    conn.close()
+
+    init_db(db_path)
+    init_db(db_path)
+
+    conn = sqlite3.connect(db_path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN UPDATE queries SET feedback = 'x' WHERE interaction_id = 'i'",
+    ).fetchall()
+    legacy = conn.execute("SELECT query, interaction_id FROM queries").fetchall()
+    conn.close()
+    assert version == len(MIGRATIONS)
+    assert "idx_queries_interaction_id" in plan[0][-1]
+    assert legacy == [("q", None)]
+
+
+def test_interrupted_migration_is_rolled_back(tmp_path: Path,
+                                              monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a migration failing midway leaves no partial schema behind."""
+    db_path = str(tmp_path / "queries.db")
+    monkeypatch.setattr(sql_database, "MIGRATIONS", [
+        *MIGRATIONS, "ALTER TABLE queries ADD COLUMN rating INTEGER; SELECT * FROM nope;"])
+    with pytest.raises(sqlite3.OperationalError):
+        init_db(db_path)
+
+    conn = sqlite3.connect(db_path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(queries)")]
+    conn.close()
+    assert version == len(MIGRATIONS)
+    assert "interaction_id" in columns
+    assert "rating" not in columns
+
+    monkeypatch.setattr(sql_database, "MIGRATIONS", [
+        *MIGRATIONS, "ALTER TABLE queries ADD COLUMN rating INTEGER;"])
+    init_db(db_path)
@@ -0,0 +1,124 @@
+"""Module responsible for testing the resilient calls to the data service."""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+# Adjust the Python path to include the src directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from src.upstream import Upstream, UpstreamUnavailable
+
+PRIMARY, REPLICA = "http://primary", "http://replica"
+
+
+def test_retries_and_circuit_breaker() -> None:
+    """Test that failures are retried elsewhere and open the circuit."""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.host)
+        if request.url.host == "primary":
+            msg = "connection refused"
+            raise httpx.ConnectError(msg, request=request)
+        return httpx.Response(200, json={"ok": True})
+
+    upstream = Upstream([PRIMARY, REPLICA], retries=1, backoff=0.001,
+                        failure_threshold=2, reset_timeout=30)
+
+    async def scenario() -> None:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            for _ in range(3):
+                response = await upstream.post(client, "/embed", {}, timeout=1)
+                assert response.json() == {"ok": True}
+            upstream.replicas = [PRIMARY]
+            with pytest.raises(UpstreamUnavailable) as unavailable:
+                await upstream.post(client, "/embed", {}, timeout=1)
+            assert unavailable.value.retry_after > 1
+
+    asyncio.run(scenario())
+    # The primary is skipped once its circuit opened after two failures
+    assert calls == ["primary", "replica", "primary", "replica", "replica"]
+    assert upstream.stats()["circuits"] == {PRIMARY: "open", REPLICA: "closed"}
+
+
+def test_slow_requests_are_hedged() -> None:
+    """Test that a slow replica is overtaken by a second one."""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "primary":
+            await asyncio.sleep(0.5)
+        return httpx.Response(200, json={"host": request.url.host})
+
+    upstream = Upstream([PRIMARY, REPLICA], hedge_delay=0.05)
+
+    async def scenario() -> tuple[httpx.Response, float]:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            start = time.perf_counter()
+            response = await upstream.post(client, "/similarity_search", {},
+                                           timeout=1, idempotent=True, hedge=True)
+            return response, time.perf_counter() - start
+
+    response, elapsed = asyncio.run(scenario())
+    assert response.json() == {"host": "replica"}
+    assert elapsed < 0.3  # noqa: PLR2004
+    assert upstream.stats()["hedges_won"] == 1
+
+
+def test_writes_are_not_sent_twice() -> None:
+    """Test that a write is only retried when it could not connect."""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.host)
+        if request.url.host == "primary":
+            msg = "no answer"
+            raise httpx.ReadTimeout(msg, request=request)
+        msg = "connection refused"
+        raise httpx.ConnectError(msg, request=request)
+
+    upstream = Upstream([PRIMARY, REPLICA], retries=2, backoff=0.001)
+
+    async def scenario() -> None:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            with pytest.raises(UpstreamUnavailable):
+                await upstream.post(client, "/insert_query", {}, timeout=1)
+            upstream.replicas = [REPLICA, PRIMARY]
+            with pytest.raises(UpstreamUnavailable):
+                await upstream.post(client, "/insert_query", {}, timeout=1)
+
+    asyncio.run(scenario())
+    # The read timeout may have been processed; the refused connection not
+    assert calls == ["primary", "replica", "primary"]
+
+
+def test_half_open_circuit_lets_one_probe_through() -> None:
+    """Test that only one request probes a replica whose circuit reopens."""
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.host)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"ok": True})
+
+    upstream = Upstream([PRIMARY], retries=0, failure_threshold=1,
+                        reset_timeout=0.01)
+    upstream.breakers[PRIMARY].record_failure()
+
+    async def scenario() -> list:
+        await asyncio.sleep(0.02)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            outcomes = await asyncio.gather(
+                *(upstream.post(client, "/embed", {}, timeout=1, idempotent=True)
+                  for _ in range(3)), return_exceptions=True)
+            # The probe succeeded: the circuit is closed again
+            await upstream.post(client, "/embed", {}, timeout=1, idempotent=True)
+            return outcomes
+
+    outcomes = asyncio.run(scenario())
+    assert calls == ["primary", "primary"]
+    assert sum(isinstance(outcome, UpstreamUnavailable) for outcome in outcomes) == 2
+    assert upstream.stats()["circuits"] == {PRIMARY: "closed"}
@@ -0,0 +1,172 @@
+"""Module responsible for testing the ingestion pipeline."""
+
+import sys
+import zlib
+from pathlib import Path
+
+import chromadb
+import pytest
+
+# Adjust the Python path to include the data directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from data.vector_db import (
+    IncrementalIndexer,
+    batched,
+    bump_collection_version,
+    ingest,
+    iter_chunk_batches,
+    iter_document_chunks,
+    iter_documents,
+)
+
+
+class HashEmbeddingFunction:
+    """Cheap deterministic embedding function standing in for the model."""
+
+    def __call__(self, input: list[str]) -> list[list[float]]:  # noqa: A002
+        """Embed each text as a small vector derived from its checksum."""
+        return [[float((zlib.crc32(text.encode()) >> shift) & 0xFF)
+                 for shift in (0, 8, 16)] for text in input]
+
+
+def write_corpus(input_dir: Path) -> None:
+    """Write a small corpus of text files."""
+    input_dir.mkdir()
+    for i in range(5):
+        (input_dir / f"doc_{i}.txt").write_text(f"Title: doc {i}\n" + "word " * 300,
+                                                encoding="utf-8")
+
+
+def test_iter_chunk_batches_is_bounded(tmp_path: Path) -> None:
+    """Test that chunks are produced lazily in fixed-size batches."""
+    write_corpus(tmp_path / "articles")
+    batches = list(iter_chunk_batches(iter_documents(str(tmp_path / "articles")),
+                                      batch_size=3, chunk_size=500, overlap=50))
+    assert all(len(ids) == len(chunks) == len(metadatas) <= 3
+               for ids, chunks, metadatas in batches)
+    ids = [chunk_id for batch_ids, _, _ in batches for chunk_id in batch_ids]
+    assert ids[:4] == ["doc_0.txt_chunk_0", "doc_0.txt_chunk_1",
+                       "doc_0.txt_chunk_2", "doc_0.txt_chunk_3"]
+    assert len(ids) == len(set(ids))
+
+
+def test_chunk_metadata() -> None:
+    """Test the title, index and byte offsets stored with each chunk."""
+    text = ("Intro é " * 40 + "\nTitle: SQL 101\n" + "Learn SQL. " * 40
+            + "\nTitle: Python\n" + "Learn Python. " * 40)
+    chunks = list(iter_document_chunks(text, "Courses_list.txt", chunk_size=200,
+                                       overlap=20))
+    encoded = text.encode("utf-8")
+    for i, (chunk_id, chunk, metadata) in enumerate(chunks):
+        assert chunk_id == f"Courses_list.txt_chunk_{i}"
+        assert metadata["chunk_index"] == i
+        assert metadata["source"] == "Courses_list.txt"
+        assert encoded[metadata["start_byte"]:metadata["end_byte"]].decode() == chunk
+    titles = [metadata["title"] for _, _, metadata in chunks]
+    assert titles[0] == "Courses list"
+    assert titles[-1] == "Python"
+    assert "SQL 101" in titles
+
+
+def test_ingest_writes_every_chunk(tmp_path: Path) -> None:
+    """Test that parallel ingestion writes every chunk with its embedding."""
+    write_corpus(tmp_path / "articles")
+    db = chromadb.EphemeralClient().get_or_create_collection("test_ingest")
+    batches = iter_chunk_batches(iter_documents(str(tmp_path / "articles")),
+                                 batch_size=4)
+
+    written = ingest(db, batches, embedding_function_factory=HashEmbeddingFunction,
+                     workers=2, max_pending=2)
+
+    assert written == db.count() == 20
+    stored = db.get(ids=["doc_3.txt_chunk_1"],
+                    include=["documents", "embeddings", "metadatas"])
+    expected = HashEmbeddingFunction()(stored["documents"])[0]
+    assert list(stored["embeddings"][0]) == expected
+    assert stored["metadatas"][0]["title"] == "doc 3"
+    assert stored["metadatas"][0]["chunk_index"] == 1
+
+
+def run_incremental_index(input_dir: Path, manifest_path: Path,
+                          db: chromadb.Collection) -> IncrementalIndexer:
+    """Run one incremental indexing pass, as the CLI does."""
+    indexer = IncrementalIndexer(str(manifest_path))
+    batches = batched(indexer.changed_chunks(iter_documents(str(input_dir))),
+                      batch_size=4)
+    ingest(db, batches, embedding_function_factory=HashEmbeddingFunction,
+           workers=1)
+    if indexer.metadata_updates:
+        db.update(ids=list(indexer.metadata_updates),
+                  metadatas=list(indexer.metadata_updates.values()))
+    indexer.remove_missing_files(p.name for p in input_dir.iterdir())
+    if indexer.stale_ids:
+        db.delete(ids=indexer.stale_ids)
+    if indexer.changed:
+        bump_collection_version(db)
+    indexer.save()
+    return indexer
+
+
+def test_incremental_index_only_touches_changes(tmp_path: Path) -> None:
+    """Test that reruns only upsert changed chunks and drop removed files."""
+    input_dir = tmp_path / "articles"
+    write_corpus(input_dir)
+    manifest_path = tmp_path / "manifest.json"
+    db = chromadb.EphemeralClient().get_or_create_collection(
+        "test_incremental", metadata={"version": 0, "hnsw:space": "cosine"})
+
+    first = run_incremental_index(input_dir, manifest_path, db)
+    assert first.stats["upserted_chunks"] == db.count() == 20
+
+    unchanged = run_incremental_index(input_dir, manifest_path, db)
+    assert unchanged.stats["upserted_chunks"] == 0
+    assert not unchanged.changed
+    assert db.metadata["version"] == 1
+
+    # Edit the end of one file, shorten another and delete a third one
+    doc_1 = input_dir / "doc_1.txt"
+    doc_1.write_text(doc_1.read_text(encoding="utf-8") + "appended", encoding="utf-8")
+    (input_dir / "doc_2.txt").write_text("Title: doc 2\nshort", encoding="utf-8")
+    (input_dir / "doc_4.txt").unlink()
+
+    rerun = run_incremental_index(input_dir, manifest_path, db)
+    assert rerun.stats["changed_files"] == 2
+    assert rerun.stats["deleted_files"] == 1
+    assert rerun.stats["upserted_chunks"] == 2
+    assert db.count() == 4 + 4 + 1 + 4
+    assert db.get(ids=["doc_2.txt_chunk_0"])["documents"] == ["Title: doc 2\nshort"]
+    assert db.get(ids=["doc_4.txt_chunk_0"])["ids"] == []
+    assert db.metadata["version"] == 2
+
+
+def test_mid_file_edit_keeps_the_embeddings_of_moved_chunks(tmp_path: Path) -> None:
+    """Test that chunks only shifted by an edit get new offsets, not embeddings."""
+    input_dir = tmp_path / "articles"
+    input_dir.mkdir()
+    doc = input_dir / "notes.txt"
+    doc.write_text("Title: notes\n\n" + "\n\n".join(
+        f"Paragraph {i}. " + "lorem ipsum dolor sit amet " * 10 for i in range(6)),
+        encoding="utf-8")
+    manifest_path = tmp_path / "manifest.json"
+    db = chromadb.EphemeralClient().get_or_create_collection(
+        "test_mid_file_edit", metadata={"version": 0, "hnsw:space": "cosine"})
+    first = run_incremental_index(input_dir, manifest_path, db)
+    assert first.stats["upserted_chunks"] == db.count() == 6
+
+    doc.write_text(doc.read_text(encoding="utf-8").replace(
+        "Paragraph 2.", "Paragraph 2, edited."), encoding="utf-8")
+    rerun = run_incremental_index(input_dir, manifest_path, db)
+    # Only the edited chunk is embedded again, the ones after it moved
+    assert rerun.stats["upserted_chunks"] == 1
+    assert rerun.stats["updated_metadata"] == 3
+    assert db.metadata["version"] == 2
+
+    content = doc.read_text(encoding="utf-8").encode()
+    stored = db.get(ids=["notes.txt_chunk_4"],
+                    include=["documents", "embeddings", "metadatas"])
+    metadata = stored["metadatas"][0]
+    assert content[metadata["start_byte"]:metadata["end_byte"]].decode() \
+        == stored["documents"][0]
+    assert list(stored["embeddings"][0]) == pytest.approx(
+        HashEmbeddingFunction()(stored["documents"])[0])